@@ -0,0 +1,226 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from datetime import timedelta
+
+from django.conf import settings
+from django.utils import timezone
+
+
+def cache_key(model, temperature, prompt):
+    """Content address of a completion request."""
+    raw = json.dumps([model, temperature, prompt], ensure_ascii=False)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+class BaseCache:
+    """
+    Common bookkeeping for the LLM response caches. Subclasses implement
+    _get/_set/_clear; entries older than `ttl` seconds are treated as missing
+    and the oldest entries are dropped once there are more than `max_entries`.
+    """
+
+    def __init__(self, max_entries=1000, ttl=86400):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._stats_lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        value = self._get(key)
+        with self._stats_lock:
+            if value is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return value
+
+    def set(self, key, value):
+        evicted = self._set(key, value)
+        if evicted:
+            with self._stats_lock:
+                self.evictions += evicted
+
+    def clear(self):
+        self._clear()
+
+    def stats(self):
+        with self._stats_lock:
+            return {
+                "backend": type(self).__name__,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
+
+    def _get(self, key):
+        raise NotImplementedError
+
+    def _set(self, key, value):
+        raise NotImplementedError
+
+    def _clear(self):
+        raise NotImplementedError
+
+
+class MemoryCache(BaseCache):
+    """In-process LRU."""
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self._data = OrderedDict()   # key -> (stored_at, value)
+        self._lock = threading.Lock()
+
+    def _get(self, key):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return None
+            if time.time() - entry[0] > self.ttl:
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return entry[1]
+
+    def _set(self, key, value):
+        evicted = 0
+        with self._lock:
+            self._data[key] = (time.time(), value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+                evicted += 1
+        return evicted
+
+    def _clear(self):
+        with self._lock:
+            self._data.clear()
+
+
+class DiskCache(BaseCache):
+    """One file per entry under `path`; shared by every process on the host."""
+
+    def __init__(self, path, **kwargs):
+        super().__init__(**kwargs)
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+
+    def _file(self, key):
+        return os.path.join(self.path, f"{key}.txt")
+
+    def _get(self, key):
+        file_path = self._file(key)
+        try:
+            if time.time() - os.path.getmtime(file_path) > self.ttl:
+                os.remove(file_path)
+                return None
+            with open(file_path, encoding="utf-8") as f:
+                value = f.read()
+        except OSError:
+            return None
+        # Touch so eviction by mtime behaves like LRU
+        try:
+            os.utime(file_path)
+        except OSError:
+            pass
+        return value
+
+    def _set(self, key, value):
+        tmp_path = f"{self._file(key)}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(value)
+        os.replace(tmp_path, self._file(key))
+        return self._cull()
+
+    def _entries(self):
+        with os.scandir(self.path) as it:
+            return [e for e in it if e.name.endswith(".txt")]
+
+    def _cull(self):
+        entries = self._entries()
+        if len(entries) <= self.max_entries:
+            return 0
+        entries.sort(key=lambda e: e.stat().st_mtime)
+        evicted = 0
+        for entry in entries[:len(entries) - self.max_entries]:
+            try:
+                os.remove(entry.path)
+                evicted += 1
+            except OSError:
+                pass
+        return evicted
+
+    def _clear(self):
+        for entry in self._entries():
+            try:
+                os.remove(entry.path)
+            except OSError:
+                pass
+
+
+class DatabaseCache(BaseCache):
+    """Rows in LLMCacheEntry; shared by every process using the database."""
+
+    def _get(self, key):
+        from .models import LLMCacheEntry
+
+        entry = LLMCacheEntry.objects.filter(key=key).only("response", "created_at").first()
+        if entry is None:
+            return None
+        if entry.created_at < timezone.now() - timedelta(seconds=self.ttl):
+            LLMCacheEntry.objects.filter(key=key).delete()
+            return None
+        return entry.response
+
+    def _set(self, key, value):
+        from .models import LLMCacheEntry
+
+        LLMCacheEntry.objects.update_or_create(key=key, defaults={"response": value, "created_at": timezone.now()})
+        return self._cull()
+
+    def _cull(self):
+        from .models import LLMCacheEntry
+
+        evicted, _ = LLMCacheEntry.objects.filter(
+            created_at__lt=timezone.now() - timedelta(seconds=self.ttl)
+        ).delete()
+        excess = LLMCacheEntry.objects.count() - self.max_entries
+        if excess > 0:
+            oldest = list(LLMCacheEntry.objects.order_by("created_at").values_list("key", flat=True)[:excess])
+            evicted += LLMCacheEntry.objects.filter(key__in=oldest).delete()[0]
+        return evicted
+
+    def _clear(self):
+        from .models import LLMCacheEntry
+
+        LLMCacheEntry.objects.all().delete()
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_cache():
+    """The per-process cache selected by LLM_CACHE_BACKEND, or None when disabled."""
+    global _cache
+    backend = settings.LLM_CACHE_BACKEND
+    if backend == "none":
+        return None
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                options = {"max_entries": settings.LLM_CACHE_MAX_ENTRIES, "ttl": settings.LLM_CACHE_TTL}
+                if backend == "memory":
+                    _cache = MemoryCache(**options)
+                elif backend == "disk":
+                    _cache = DiskCache(settings.LLM_CACHE_DIR, **options)
+                elif backend == "database":
+                    _cache = DatabaseCache(**options)
+                else:
+                    raise ValueError(f"Unknown LLM_CACHE_BACKEND: {backend}")
+    return _cache
@@ -1,21 +1,382 @@
-import requests
+import asyncio
+import json
 import os
+import random
+import threading
+import time
+import weakref
+from email.utils import parsedate_to_datetime
+
+import requests
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from requests.adapters import HTTPAdapter
+
+from . import metrics, scheduler
+from .ai_cache import MemoryCache, cache_key, get_cache
+
+try:
+    import httpx
+except ImportError:  # only needed by the async client
+    httpx = None
+
+RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
+
+
+def worth_retrying(error):
+    """
+    Whether a failed LLM call may succeed if its caller tries again. Not for
+    HTTP and network errors: the client has already retried those that can
+    pass (429/5xx, timeouts, dropped connections), and other 4xx never do.
+    """
+    if isinstance(error, requests.RequestException):
+        return False
+    return httpx is None or not isinstance(error, httpx.HTTPError)
+
+
+STREAM_DONE = object()
+
+
+def parse_stream_line(line):
+    """
+    Text delta carried by one server-sent-events line of a streamed completion,
+    STREAM_DONE at the end of the stream, or None for comments/keep-alives.
+    """
+    if not line.startswith("data:"):
+        return None
+    data = line[5:].strip()
+    if data == "[DONE]":
+        return STREAM_DONE
+    if not data:
+        return None
+    chunk = json.loads(data)
+    if "error" in chunk:
+        raise RuntimeError(f"LLM stream error: {chunk['error']}")
+    choices = chunk.get("choices") or [{}]
+    return (choices[0].get("delta") or {}).get("content")
+
+
+class _BaseLLMClient:
+    """Settings, payload and backoff shared by the sync and async clients."""
+
+    def __init__(self, api_url=None, api_key=None, model=None, temperature=None,
+                 connect_timeout=None, read_timeout=None, max_retries=None,
+                 backoff_base=None, backoff_max=None, pool_size=None):
+        self.api_url = api_url or settings.LLM_API_URL
+        self.api_key = api_key or settings.LLM_API_KEY
+        if not self.api_key:
+            raise ImproperlyConfigured("Set OPENROUTER_API_KEY (settings.LLM_API_KEY) to call the LLM.")
+        self.model = model or settings.LLM_MODEL
+        self.temperature = settings.LLM_TEMPERATURE if temperature is None else temperature
+        self.connect_timeout = connect_timeout or settings.LLM_CONNECT_TIMEOUT
+        self.read_timeout = read_timeout or settings.LLM_READ_TIMEOUT
+        self.max_retries = settings.LLM_MAX_RETRIES if max_retries is None else max_retries
+        self.backoff_base = settings.LLM_BACKOFF_BASE if backoff_base is None else backoff_base
+        self.backoff_max = settings.LLM_BACKOFF_MAX if backoff_max is None else backoff_max
+        self.pool_size = pool_size or settings.LLM_POOL_SIZE
+
+    @property
+    def headers(self):
+        return {
+            "Authorization": f"Bearer {self.api_key}",
+            "Content-Type": "application/json",
+        }
+
+    def payload(self, prompt, model=None, temperature=None):
+        return {
+            "model": model or self.model,
+            "messages": [{"role": "user", "content": prompt}],
+            "temperature": self.temperature if temperature is None else temperature,
+        }
+
+    def backoff(self, attempt, retry_after=None):
+        """Seconds to wait before retry number `attempt` (0-based)."""
+        delay = random.uniform(0, min(self.backoff_max, self.backoff_base * (2 ** attempt)))
+        if retry_after is not None:
+            delay = max(delay, min(retry_after, self.backoff_max))
+        return delay
+
+    @staticmethod
+    def parse_retry_after(value):
+        if not value:
+            return None
+        try:
+            return max(0.0, float(value))
+        except ValueError:
+            pass
+        try:
+            return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+        except (TypeError, ValueError):
+            return None
+
+
+class LLMClient(_BaseLLMClient):
+    """
+    Chat-completions client that keeps one pooled keep-alive session, applies
+    connect/read timeouts and retries 429/5xx and network errors with jittered
+    exponential backoff (honouring Retry-After).
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.timeout = (self.connect_timeout, self.read_timeout)
+        self._session = None
+        self._session_pid = None
+        self._lock = threading.Lock()
+
+    @property
+    def session(self):
+        # Sessions must not be shared across a fork (e.g. gunicorn --preload)
+        pid = os.getpid()
+        if self._session is None or self._session_pid != pid:
+            with self._lock:
+                if self._session is None or self._session_pid != pid:
+                    session = requests.Session()
+                    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_size)
+                    session.mount("https://", adapter)
+                    session.mount("http://", adapter)
+                    session.headers.update(self.headers)
+                    self._session = session
+                    self._session_pid = pid
+        return self._session
+
+    def post(self, payload, stream=False):
+        """POST the payload, retrying transient failures. Returns the final response."""
+        for attempt in range(self.max_retries + 1):
+            last_attempt = attempt == self.max_retries
+            try:
+                response = self.session.post(self.api_url, json=payload, timeout=self.timeout, stream=stream)
+            except (requests.ConnectionError, requests.Timeout):
+                if last_attempt:
+                    raise
+                metrics.count_llm_retry("network")
+                time.sleep(self.backoff(attempt))
+                continue
+
+            if response.status_code in RETRY_STATUS_CODES and not last_attempt:
+                metrics.count_llm_retry(response.status_code)
+                retry_after = self.parse_retry_after(response.headers.get("Retry-After"))
+                response.close()
+                time.sleep(self.backoff(attempt, retry_after))
+                continue
+
+            response.raise_for_status()
+            return response
+
+    def complete(self, prompt, model=None, temperature=None):
+        with scheduler.admit(prompt, model) as slot, metrics.llm_timer():
+            data = self.post(self.payload(prompt, model, temperature)).json()
+            slot.output = data["choices"][0]["message"]["content"]
+        return slot.output
+
+
+class AsyncLLMClient(_BaseLLMClient):
+    """
+    asyncio counterpart of LLMClient on httpx, with the same timeouts and retry
+    policy. An instance belongs to the event loop it was first used on.
+    """
+
+    def __init__(self, *args, **kwargs):
+        if httpx is None:
+            raise ImproperlyConfigured("The async LLM client needs the 'httpx' package.")
+        super().__init__(*args, **kwargs)
+        self.client = httpx.AsyncClient(
+            headers=self.headers,
+            timeout=httpx.Timeout(self.read_timeout, connect=self.connect_timeout),
+            limits=httpx.Limits(max_connections=self.pool_size, max_keepalive_connections=self.pool_size),
+        )
+
+    async def post(self, payload):
+        """POST the payload, retrying transient failures. Returns the final response."""
+        for attempt in range(self.max_retries + 1):
+            last_attempt = attempt == self.max_retries
+            try:
+                response = await self.client.post(self.api_url, json=payload)
+            except (httpx.TransportError, httpx.TimeoutException):
+                if last_attempt:
+                    raise
+                metrics.count_llm_retry("network")
+                await asyncio.sleep(self.backoff(attempt))
+                continue
+
+            if response.status_code in RETRY_STATUS_CODES and not last_attempt:
+                metrics.count_llm_retry(response.status_code)
+                retry_after = self.parse_retry_after(response.headers.get("Retry-After"))
+                await asyncio.sleep(self.backoff(attempt, retry_after))
+                continue
+
+            response.raise_for_status()
+            return response
+
+    async def complete(self, prompt, model=None, temperature=None):
+        async with scheduler.aadmit(prompt, model) as slot:
+            with metrics.llm_timer():
+                response = await self.post(self.payload(prompt, model, temperature))
+                slot.output = response.json()["choices"][0]["message"]["content"]
+        return slot.output
+
+    async def stream(self, prompt, model=None, temperature=None):
+        """
+        Yield the completion text as the provider streams it (server-sent events).
+        Failures before the first byte are retried like `post`; once text has
+        been yielded an error is raised as is.
+        """
+        async with scheduler.aadmit(prompt, model) as slot:
+            with metrics.llm_timer():
+                pieces = []
+                async for piece in self._stream(prompt, model, temperature):
+                    pieces.append(piece)
+                    yield piece
+                slot.output = "".join(pieces)
+
+    async def _stream(self, prompt, model, temperature):
+        payload = self.payload(prompt, model, temperature)
+        payload["stream"] = True
+        for attempt in range(self.max_retries + 1):
+            last_attempt = attempt == self.max_retries
+            try:
+                response = await self.client.send(
+                    self.client.build_request("POST", self.api_url, json=payload), stream=True,
+                )
+            except (httpx.TransportError, httpx.TimeoutException):
+                if last_attempt:
+                    raise
+                metrics.count_llm_retry("network")
+                await asyncio.sleep(self.backoff(attempt))
+                continue
+
+            if response.status_code in RETRY_STATUS_CODES and not last_attempt:
+                metrics.count_llm_retry(response.status_code)
+                retry_after = self.parse_retry_after(response.headers.get("Retry-After"))
+                await response.aclose()
+                await asyncio.sleep(self.backoff(attempt, retry_after))
+                continue
+            break
+
+        try:
+            if response.is_error:
+                await response.aread()
+                response.raise_for_status()
+            async for line in response.aiter_lines():
+                event = parse_stream_line(line)
+                if event is STREAM_DONE:
+                    break
+                if event:
+                    yield event
+        finally:
+            await response.aclose()
+
+    async def aclose(self):
+        await self.client.aclose()
+
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_client():
+    """The shared per-process client used by call_ai."""
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = LLMClient()
+    return _client
+
+
+_async_clients = weakref.WeakKeyDictionary()
+
+
+def get_async_client():
+    """The async client for the running event loop."""
+    loop = asyncio.get_running_loop()
+    client = _async_clients.get(loop)
+    if client is None:
+        client = _async_clients[loop] = AsyncLLMClient()
+    return client
+
+
+async def close_async_client():
+    """Close the running loop's client; for short-lived loops such as async_to_sync calls."""
+    client = _async_clients.pop(asyncio.get_running_loop(), None)
+    if client is not None:
+        await client.aclose()
+
+
+def call_ai(prompt, bypass_cache=False):
+    """
+    Send a single-message prompt and return the completion text.
+
+    Responses are cached by (model, temperature, prompt) when LLM_CACHE_BACKEND
+    is enabled. `bypass_cache=True` skips the lookup; the fresh answer still
+    replaces the cached one.
+    """
+    client = get_client()
+    cache = get_cache()
+    if cache is None:
+        metrics.count_llm_call("off")
+        return client.complete(prompt)
+
+    key = cache_key(client.model, client.temperature, prompt)
+    if not bypass_cache:
+        cached = cache.get(key)
+        if cached is not None:
+            metrics.count_llm_call("hit")
+            return cached
+    metrics.count_llm_call("miss")
+    content = client.complete(prompt)
+    cache.set(key, content)
+    return content
+
+
+async def _cache_op(cache, method, *args):
+    # The in-process LRU is safe to use from the event loop; disk/database are not
+    if isinstance(cache, MemoryCache):
+        return method(*args)
+    return await sync_to_async(method)(*args)
+
+
+async def acall_ai(prompt, bypass_cache=False):
+    """Async version of call_ai, sharing the same response cache."""
+    client = get_async_client()
+    cache = get_cache()
+    if cache is None:
+        metrics.count_llm_call("off")
+        return await client.complete(prompt)
+
+    key = cache_key(client.model, client.temperature, prompt)
+    if not bypass_cache:
+        cached = await _cache_op(cache, cache.get, key)
+        if cached is not None:
+            metrics.count_llm_call("hit")
+            return cached
+    metrics.count_llm_call("miss")
+    content = await client.complete(prompt)
+    await _cache_op(cache, cache.set, key, content)
+    return content
+
+
+async def astream_ai(prompt):
+    """
+    Like acall_ai but yields the completion in pieces as they arrive. A cached
+    answer comes back as a single piece; a streamed one is cached once complete.
+    """
+    client = get_async_client()
+    cache = get_cache()
+    key = None
+    if cache is not None:
+        key = cache_key(client.model, client.temperature, prompt)
+        cached = await _cache_op(cache, cache.get, key)
+        if cached is not None:
+            metrics.count_llm_call("hit")
+            yield cached
+            return
 
-API_KEY = "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"
-API_URL = "https://openrouter.ai/api/v1/chat/completions"
-
-def call_ai(prompt):
-    headers = {
-        "Authorization": f"Bearer {API_KEY}",
-        "Content-Type": "application/json",
-    }
-    payload = {
-        "model": "openai/gpt-3.5-turbo",  # model name
-        "messages": [{"role": "user", "content": prompt}],
-        "temperature": 0.7,
-    }
-
-    response = requests.post(API_URL, headers=headers, json=payload)
-    response.raise_for_status()
-    data = response.json()
-    return data["choices"][0]["message"]["content"]
+    metrics.count_llm_call("off" if cache is None else "miss")
+    pieces = []
+    async for piece in client.stream(prompt):
+        pieces.append(piece)
+        yield piece
+    if cache is not None:
+        await _cache_op(cache, cache.set, key, "".join(pieces))
@@ -0,0 +1,129 @@
+"""
+Native async versions of the two LLM-bound endpoints, used when the app is
+served over ASGI (ACTIVITIES_ASYNC_VIEWS). They return the same payloads as
+LessonCreateView and grade_quiz, but awaiting the LLM doesn't hold a worker
+thread, so one process can have many lesson creations and gradings in flight.
+
+Validation, dedupe, scoring and result assembly live in endpoints.py and are
+shared with the DRF views. Authentication matches theirs too: JWT only, the
+same 401 bodies, and no CSRF check (DRF enforces it only for session auth).
+"""
+import asyncio
+import json
+
+from asgiref.sync import sync_to_async
+from django.http import JsonResponse
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_POST
+from rest_framework.exceptions import AuthenticationFailed, NotAuthenticated
+from users_accounts.authentication import CachedJWTAuthentication
+
+from . import jobs, metrics, scheduler, streaming
+from .ai_service import acall_ai
+from .endpoints import RequestError, grade_submission, start_lesson, store_upload
+from .grading import aexplain_incorrect
+from .serializers import LessonJobSerializer, LessonSerializer
+from .uploads import HashingUploadHandler
+
+
+def _error(message, status):
+    return JsonResponse({"error": message}, status=status)
+
+
+async def _authenticate(request):
+    """(user, None) for a request with a valid JWT, else (None, the 401 DRF would send)."""
+    authenticator = CachedJWTAuthentication()
+    try:
+        result = await sync_to_async(authenticator.authenticate)(request)
+    except AuthenticationFailed as e:
+        detail = e.detail if isinstance(e.detail, dict) else {"detail": e.detail}
+        result, response = None, JsonResponse(detail, status=e.status_code)
+    else:
+        if result is not None:
+            return result[0], None
+        response = JsonResponse({"detail": NotAuthenticated.default_detail}, status=401)
+    response["WWW-Authenticate"] = authenticator.authenticate_header(request)
+    return None, response
+
+
+def _parse_form(request):
+    hasher = HashingUploadHandler(request)
+    request.upload_handlers.insert(0, hasher)
+    return request.POST, request.FILES, hasher
+
+
+def _serialize(lesson):
+    return LessonSerializer(lesson).data
+
+
+async def _job_events(job):
+    yield {"event": "job", "job": LessonJobSerializer(job).data}
+    async for event in jobs.astream_job(job.pk):
+        yield event
+
+
+@csrf_exempt
+@require_POST
+async def lesson_create(request):
+    user, denied = await _authenticate(request)
+    if denied:
+        return denied
+
+    # Multipart parsing and hashing are blocking file work
+    with metrics.timer("parse"):
+        data, files, hasher = await sync_to_async(_parse_form, thread_sensitive=False)(request)
+    stream_format = streaming.requested_format(request)
+    try:
+        status, lesson, job = await sync_to_async(start_lesson)(user, data, files, hasher)
+    except RequestError as e:
+        return _error(e.message, e.status)
+
+    if lesson is not None:
+        if stream_format:
+            return streaming.response(streaming.lesson_events(lesson), stream_format)
+        return JsonResponse(await sync_to_async(_serialize)(lesson), status=status)
+
+    with metrics.timer("queue"):
+        if job.source_name:
+            await sync_to_async(store_upload, thread_sensitive=False)(job, files["file"])
+        await job.asave()
+    if stream_format:
+        return streaming.response(_job_events(job), stream_format)
+    jobs.enqueue_async(job)
+    return JsonResponse(LessonJobSerializer(job).data, status=202)
+
+
+@csrf_exempt
+@require_POST
+async def grade_quiz(request, pk):
+    user, denied = await _authenticate(request)
+    if denied:
+        return denied
+
+    try:
+        quiz_data = json.loads(request.body or b"{}")
+    except ValueError:
+        return _error("Invalid JSON", 400)
+    try:
+        grade = await sync_to_async(grade_submission)(user, pk, quiz_data)
+    except RequestError as e:
+        return _error(e.message, e.status)
+
+    question_results = grade.question_results
+    ai_feedback = grade.fallback_feedback
+    # Grading is interactive: its LLM calls are admitted ahead of lesson generation
+    with scheduler.caller("interactive", user.pk):
+        if not grade.feedback_wanted:
+            with metrics.timer("explain"):
+                await aexplain_incorrect(question_results)
+        else:
+            with metrics.timer("feedback"):
+                feedback, _ = await asyncio.gather(
+                    acall_ai(grade.feedback_prompt()),
+                    aexplain_incorrect(question_results),
+                    return_exceptions=True,
+                )
+            if not isinstance(feedback, BaseException):
+                ai_feedback = feedback
+
+    return JsonResponse(grade.result(ai_feedback), status=200)
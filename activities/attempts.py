@@ -0,0 +1,89 @@
+"""
+Quiz attempt history and the running statistics kept alongside it.
+
+Every grade stores a QuizAttempt with its answers (one bulk insert) and, in
+the same transaction, adds the result to three tables of running totals: per
+lesson, per user, and per question (answered / missed). Reading statistics is
+then a lookup of a few rows instead of a pass over the attempts.
+
+Each total is bumped with an UPDATE of F() expressions, after inserting a zero
+row if there is none yet, so concurrent grades add up correctly without
+reading the row first. Rows are always updated lesson first, so two grades of
+the same lesson queue on that row and never deadlock on the others.
+
+Totals are not rewound when attempts go away: deleting a lesson drops its
+rows, but a user's totals keep counting attempts on lessons deleted since.
+Regenerating a quiz drops the per-question totals of the old questions.
+"""
+from django.db import transaction
+from django.db.models import Case, F, IntegerField, Value, When
+from django.db.models.functions import Greatest
+from django.utils import timezone
+
+from .models import LessonQuizStats, QuestionQuizStats, QuizAnswer, QuizAttempt, UserQuizStats
+
+# QuizAnswer answer fields are bounded; clients may send anything
+_ANSWER_LENGTH = 255
+
+
+def _add_result(model, key, score, total, percentage, now):
+    model.objects.bulk_create([model(**key)], ignore_conflicts=True)
+    model.objects.filter(**key).update(
+        attempts=F("attempts") + 1,
+        correct=F("correct") + score,
+        answered=F("answered") + total,
+        percentage_sum=F("percentage_sum") + percentage,
+        best_percentage=Greatest(F("best_percentage"), Value(percentage)),
+        last_attempt_at=now,
+    )
+
+
+def _add_answers(lesson, question_results):
+    # score_answers keeps one result per stored question
+    missed = {}
+    for result in question_results:
+        if result.get("questionId") is not None:
+            missed[result["questionId"]] = not result["isCorrect"]
+    if not missed:
+        return
+    QuestionQuizStats.objects.bulk_create(
+        [QuestionQuizStats(question_id=question_id, lesson=lesson) for question_id in sorted(missed)],
+        ignore_conflicts=True,
+    )
+    missed_ids = [question_id for question_id, was_missed in missed.items() if was_missed]
+    QuestionQuizStats.objects.filter(question_id__in=list(missed)).update(
+        answered=F("answered") + 1,
+        missed=F("missed") + Case(
+            When(question_id__in=missed_ids, then=Value(1)), default=Value(0), output_field=IntegerField(),
+        ),
+    )
+
+
+def record_attempt(lesson, user, score, question_results):
+    """
+    Store a graded attempt (question_results as returned by score_answers) and
+    add it to the lesson, user and question totals. Returns the QuizAttempt.
+    """
+    total = len(question_results)
+    percentage = round(score / total * 100, 1) if total else 0.0
+    now = timezone.now()
+    with transaction.atomic():
+        attempt = QuizAttempt.objects.create(
+            lesson=lesson, user=user, score=score, total=total, percentage=percentage, created_at=now,
+        )
+        QuizAnswer.objects.bulk_create([
+            QuizAnswer(
+                attempt=attempt,
+                question_id=result.get("questionId"),
+                position=position,
+                question_text=result["question"],
+                user_answer=result["userAnswer"][:_ANSWER_LENGTH],
+                correct_answer=result["correctAnswer"][:_ANSWER_LENGTH],
+                is_correct=result["isCorrect"],
+            )
+            for position, result in enumerate(question_results, start=1)
+        ])
+        _add_result(LessonQuizStats, {"lesson": lesson}, score, total, percentage, now)
+        _add_answers(lesson, question_results)
+        _add_result(UserQuizStats, {"user": user}, score, total, percentage, now)
+    return attempt
@@ -0,0 +1,162 @@
+"""
+Request handling shared by the DRF views (views.py) and their native async
+versions (async_views.py): validating a lesson-create form, deciding whether
+it needs a job, and scoring a quiz submission. Only the LLM calls, the
+response classes and the sync/async plumbing differ between the two.
+"""
+import os
+import uuid
+
+from django.db.models import Q
+
+from . import metrics
+from .attempts import record_attempt
+from .grading import build_feedback_prompt, score_answers
+from .models import Lesson, LessonJob
+from .pipeline import SUPPORTED_EXTENSIONS, clone_lesson
+from .uploads import fingerprint_text
+
+
+class RequestError(Exception):
+    """A request the endpoint turns down with `status` and {"error": message}."""
+
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.message = message
+        self.status = status
+
+
+# --- lesson creation ----------------------------------------------------------------
+
+def build_job(user, data, files, hasher):
+    """
+    Validate a lesson-create form. Returns (job, revises): an unsaved LessonJob
+    (the caller stores an upload with store_upload) and the user's lesson it
+    regenerates in place, if any.
+    """
+    title = data.get("title")
+    raw_topic = data.get("topic")
+    uploaded_file = files.get("file")
+    revises_id = data.get("lesson")
+
+    if not title:
+        raise RequestError("Title required")
+
+    # A revised document for one of the user's lessons regenerates that lesson in place
+    revises = None
+    if revises_id:
+        if str(revises_id).isdigit():
+            revises = Lesson.objects.filter(pk=revises_id, created_by=user).first()
+        if revises is None:
+            raise RequestError("Lesson not found", 404)
+
+    # Validate input here; extraction and the LLM passes run in a job worker
+    if raw_topic:
+        if not raw_topic.strip():
+            raise RequestError("Empty content")
+        job = LessonJob(title=title, raw_topic=raw_topic, source_hash=fingerprint_text(raw_topic), created_by=user)
+    elif uploaded_file:
+        ext = os.path.splitext(uploaded_file.name)[1].lower()
+        if ext not in SUPPORTED_EXTENSIONS:
+            raise RequestError("Unsupported file type")
+        job = LessonJob(title=title, source_name=uploaded_file.name, source_hash=hasher.digests.get("file"),
+                        created_by=user)
+    else:
+        raise RequestError("Provide either text or file")
+    return job, revises
+
+
+def start_lesson(user, data, files, hasher):
+    """
+    What a lesson-create request produces, as (status, lesson, job):
+    - (200, lesson, None): a revision whose document hasn't changed
+    - (201, lesson, None): a copy of a lesson generated from the same document
+    - (202, None, job): a job to save and run
+    Raises RequestError for invalid input.
+    """
+    job, revises = build_job(user, data, files, hasher)
+    if revises is not None:
+        # Same document as before: nothing to regenerate
+        if job.source_hash and revises.source_hash == job.source_hash:
+            return 200, revises, None
+        job.revises = revises
+        return 202, None, job
+
+    # Without a fingerprint there is nothing to match (and NULL would match every old lesson)
+    if not job.source_hash:
+        return 202, None, job
+    # Same document already turned into a lesson: copy the result instead of regenerating.
+    # Another user's lesson only while it is as generated (version 1), never after an edit.
+    with metrics.timer("dedupe"):
+        existing = (
+            Lesson.objects.filter(source_hash=job.source_hash)
+            .filter(Q(created_by=user) | Q(version=1))
+            .only("quiz", "source_hash", "slide_count")
+            .order_by("-created_at")
+            .first()
+        )
+    if existing is None:
+        return 202, None, job
+    with metrics.timer("clone"):
+        return 201, clone_lesson(existing, job.title, user), None
+
+
+def store_upload(job, uploaded_file):
+    """
+    Save the upload of an unsaved job to storage in chunks (a large upload
+    Django already spooled to a temp file is moved, not copied).
+    """
+    ext = os.path.splitext(job.source_name)[1].lower()
+    job.upload.save(uuid.uuid4().hex + ext, uploaded_file, save=False)
+
+
+# --- grading --------------------------------------------------------------------
+
+class Grade:
+    """A scored and recorded quiz submission."""
+
+    def __init__(self, correct_count, question_results, attempt, feedback_wanted):
+        self.correct_count = correct_count
+        self.question_results = question_results
+        self.attempt = attempt
+        self.feedback_wanted = feedback_wanted
+        self.total = len(question_results)
+        self.percentage = (correct_count / self.total) * 100 if self.total > 0 else 0
+
+    @property
+    def fallback_feedback(self):
+        return (f"Great job completing the quiz! You scored {self.correct_count} out of {self.total} "
+                f"questions correctly.")
+
+    def feedback_prompt(self):
+        return build_feedback_prompt(self.correct_count, self.total, self.percentage, self.question_results)
+
+    def result(self, feedback):
+        return {
+            'attemptId': self.attempt.pk,
+            'score': self.correct_count,
+            'totalQuestions': self.total,
+            'percentage': round(self.percentage, 1),
+            'feedback': feedback,
+            'questionResults': self.question_results,
+        }
+
+
+def grade_submission(user, lesson_id, data):
+    """Score a grade-quiz request body against the lesson's answer key and record the attempt."""
+    try:
+        lesson = Lesson.objects.get(pk=lesson_id)
+    except Lesson.DoesNotExist:
+        raise RequestError("Lesson not found", 404)
+
+    questions = data.get('questions') if isinstance(data, dict) else None
+    if not questions or not isinstance(questions, list) or not all(isinstance(q, dict) for q in questions):
+        raise RequestError("No questions provided")
+
+    # Calculate basic score (against the stored answer key when the lesson has one)
+    with metrics.timer("score"):
+        correct_count, question_results = score_answers(lesson, questions)
+    # Saved before the LLM calls; explanations are not part of the history
+    with metrics.timer("record"):
+        attempt = record_attempt(lesson, user, correct_count, question_results)
+    return Grade(correct_count, question_results, attempt, bool(data.get('feedback', True)))
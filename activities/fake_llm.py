@@ -0,0 +1,201 @@
+"""
+A local stand-in for the OpenRouter chat-completions API, for development
+and load testing without network access or API credits.
+
+Point LLM_API_URL at it (see `manage.py fake_llm_server`). It answers every
+prompt with generated text that the pipeline can parse (lesson prose,
+seams of a merge joined unchanged, a lettered quiz, JSON explanation
+arrays) and supports `"stream": true` with server-sent events, emitting
+words at a fixed rate. Latency, jitter and a rate of 429/503 errors can be
+configured for load tests.
+"""
+import json
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+WORDS = (
+    "cells energy membrane protein reaction system structure function process "
+    "model signal growth pattern network layer balance force matter light wave"
+).split()
+
+
+def lesson_text(words):
+    """Deterministic prose of about `words` words in short paragraphs."""
+    out = []
+    for i in range(words):
+        word = WORDS[(i * 7) % len(WORDS)]
+        if i % 12 == 0:
+            word = word.capitalize()
+        out.append(word)
+        if i % 12 == 11:
+            out[-1] += "."
+            if i % 48 == 47:
+                out[-1] += "\n\n"
+    return " ".join(out).replace("\n\n ", "\n\n").strip() + "."
+
+
+def quiz_text(questions):
+    blocks = []
+    for n in range(1, questions + 1):
+        blocks.append(
+            f"{n}. Which statement about {WORDS[n % len(WORDS)]} is correct?\n"
+            f"A) Option one\nB) Option two\nC) Option three\nD) Option four\n"
+            f"Correct: {'ABCD'[n % 4]}"
+        )
+    return "\n\n".join(blocks)
+
+
+_QUIZ_ANSWER_LINE = re.compile(r"^\s*Correct:\s*[A-D]\b", re.MULTILINE)
+_GRADED_QUESTION_LINE = re.compile(r"^\d+\.\s*Question:", re.MULTILINE)
+
+
+def option_explanations_text(questions):
+    """JSON explanations of options A-D of `questions` questions, as quiz.explain_options asks for."""
+    return json.dumps([
+        {"number": n, "explanations": {label: f"Option {label} of question {n} is explained by the lesson."
+                                       for label in "ABCD"}}
+        for n in range(1, questions + 1)
+    ])
+
+
+def answer_explanations_text(questions):
+    """JSON explanations of `questions` wrong answers, as grading's batched prompt asks for."""
+    return json.dumps([
+        {"number": n, "explanation": f"The correct answer to question {n} follows from the lesson."}
+        for n in range(1, questions + 1)
+    ])
+
+
+_SEAM_MARKER = re.compile(r"^(=== Seam \d+ ===)[ \t]*$", re.MULTILINE)
+_SEAM_LABEL = re.compile(r"^(\[End of one section\]|\[Start of the next section\]|Earlier headings:.*)$")
+
+
+def merged_seams_text(prompt):
+    """The seams of a normalization merge prompt joined as they are, under their markers."""
+    pieces = _SEAM_MARKER.split(prompt)
+    seams = []
+    for marker, block in zip(pieces[1::2], pieces[2::2]):
+        paragraphs = [p.strip() for p in block.split("\n\n") if p.strip() and not _SEAM_LABEL.match(p.strip())]
+        seams.append("\n\n".join([marker] + paragraphs))
+    return "\n\n".join(seams)
+
+
+def answer_for(prompt, lesson_words=400, quiz_questions=12):
+    if _SEAM_MARKER.search(prompt):
+        return merged_seams_text(prompt)
+    if "multiple-choice quiz" in prompt:
+        return quiz_text(quiz_questions)
+    if "JSON" in prompt:
+        # One entry per question listed in the prompt, like a well-behaved model
+        if "explain each option" in prompt:
+            return option_explanations_text(len(_QUIZ_ANSWER_LINE.findall(prompt.split("Quiz:", 1)[-1])))
+        return answer_explanations_text(len(_GRADED_QUESTION_LINE.findall(prompt)))
+    if "Provide a brief explanation" in prompt:
+        return "The correct answer follows from the lesson."
+    return lesson_text(lesson_words)
+
+
+class FakeLLMServer(ThreadingHTTPServer):
+    """
+    `token_delay` is the pause between streamed words (seconds) and
+    `first_token_delay` the pause before the first byte of any answer, varied
+    by up to +/- `jitter` seconds. A fraction `error_rate` of requests fail
+    with 429 or 503 (with Retry-After: 0).
+    """
+
+    daemon_threads = True
+    request_queue_size = 128
+
+    def __init__(self, address=("127.0.0.1", 8001), token_delay=0.02, first_token_delay=0.2,
+                 lesson_words=400, quiz_questions=12, jitter=0.0, error_rate=0.0, seed=None):
+        super().__init__(address, _Handler)
+        self.token_delay = token_delay
+        self.first_token_delay = first_token_delay
+        self.lesson_words = lesson_words
+        self.quiz_questions = quiz_questions
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.random = random.Random(seed)
+        self.requests = 0
+        self.errors = 0
+        self._count_lock = threading.Lock()
+
+    def delay(self):
+        with self._count_lock:
+            offset = self.random.uniform(-self.jitter, self.jitter) if self.jitter else 0.0
+        return max(0.0, self.first_token_delay + offset)
+
+    def failure_status(self):
+        """429 or 503 for a request picked to fail, else None."""
+        with self._count_lock:
+            if self.error_rate > 0 and self.random.random() < self.error_rate:
+                self.errors += 1
+                return self.random.choice([429, 503])
+            return None
+
+    @property
+    def url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}/v1/chat/completions"
+
+    def start(self):
+        """Serve from a daemon thread; returns self."""
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *args):
+        pass
+
+    def do_POST(self):
+        server = self.server
+        with server._count_lock:
+            server.requests += 1
+        payload = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+        prompt = payload.get("messages", [{}])[-1].get("content", "")
+        answer = answer_for(prompt, server.lesson_words, server.quiz_questions)
+        time.sleep(server.delay())
+        status = server.failure_status()
+        if status:
+            self._send_json({"error": {"code": status, "message": "fake failure"}}, status, {"Retry-After": "0"})
+        elif payload.get("stream"):
+            self._stream(answer, payload.get("model"))
+        else:
+            time.sleep(server.token_delay * len(answer.split()))
+            self._send_json({"model": payload.get("model"),
+                             "choices": [{"message": {"role": "assistant", "content": answer}}]})
+
+    def _send_json(self, data, status=200, headers=None):
+        body = json.dumps(data).encode()
+        self.send_response(status)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _chunk(self, data):
+        self.wfile.write(b"%x\r\n%s\r\n" % (len(data), data))
+        self.wfile.flush()
+
+    def _stream(self, answer, model):
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        self._chunk(b": FAKE PROCESSING\n\n")
+        pieces = answer.split(" ")
+        for i, piece in enumerate(pieces):
+            text = piece if i == 0 else " " + piece
+            event = {"model": model, "choices": [{"delta": {"content": text}}]}
+            self._chunk(f"data: {json.dumps(event)}\n\n".encode())
+            time.sleep(self.server.token_delay)
+        self._chunk(b"data: [DONE]\n\n")
+        self._chunk(b"")
@@ -0,0 +1,256 @@
+import json
+import re
+
+from django.conf import settings
+
+from .ai_service import acall_ai, call_ai
+from .utils import bounded_map, gather_bounded
+
+_NUMBERED_LINE = re.compile(r"^\s*(?:Q(?:uestion)?\s*)?(\d+)\s*[.):\-]\s*(.*)$", re.IGNORECASE)
+
+
+def build_explanations_prompt(wrong_results):
+    questions = ""
+    for number, q in enumerate(wrong_results, start=1):
+        questions += f"""
+{number}. Question: {q['question']}
+   Correct Answer: {q['correctAnswer']}
+   Student Answer: {q['userAnswer']}
+"""
+    return f"""
+A student answered the quiz questions below incorrectly.
+For each one, provide a brief explanation (1-2 sentences) of why the correct answer is right.
+
+Return ONLY a JSON array with one object per question, in the same order, like:
+[{{"number": 1, "explanation": "..."}}, {{"number": 2, "explanation": "..."}}]
+
+Questions:
+{questions}
+"""
+
+
+def parse_explanations(text, count):
+    """
+    Map question number (1-based) -> explanation from a batched answer. Accepts
+    the requested JSON array (objects or plain strings) and falls back to
+    numbered lines. Numbers outside 1..count are ignored.
+    """
+    explanations = {}
+    start, end = text.find("["), text.rfind("]")
+    if start != -1 and end > start:
+        try:
+            items = json.loads(text[start:end + 1])
+        except ValueError:
+            items = None
+        if isinstance(items, list):
+            for position, item in enumerate(items, start=1):
+                if isinstance(item, dict):
+                    number = item.get("number", position)
+                    explanation = item.get("explanation")
+                else:
+                    number, explanation = position, item
+                try:
+                    number = int(number)
+                except (TypeError, ValueError):
+                    continue
+                if isinstance(explanation, str) and explanation.strip() and 1 <= number <= count:
+                    explanations[number] = explanation.strip()
+            if explanations:
+                return explanations
+
+    current = None
+    for line in text.splitlines():
+        match = _NUMBERED_LINE.match(line)
+        if match:
+            current = int(match.group(1)) if 1 <= int(match.group(1)) <= count else None
+            if current is not None:
+                explanations[current] = match.group(2).strip()
+        elif current is not None and line.strip():
+            explanations[current] = f"{explanations[current]} {line.strip()}".strip()
+    return {n: e for n, e in explanations.items() if e}
+
+
+def _normalize_answer(value):
+    return (value or '').strip().upper().replace(')', '')
+
+
+def _normalize_question(text):
+    return " ".join((text or "").split()).lower()
+
+
+def match_answer_keys(lesson, submitted, stored=None):
+    """
+    The stored Question for each submitted question (None when the lesson has no
+    parsed quiz or nothing matches). Matching is by question id, then by question
+    text, then by position when the client sent the whole quiz.
+    """
+    if stored is None:
+        stored = list(lesson.questions.prefetch_related("options"))
+    if not stored:
+        return [None] * len(submitted)
+    by_id = {str(q.pk): q for q in stored}
+    by_text = {_normalize_question(q.text): q for q in stored}
+    keys = []
+    for index, item in enumerate(submitted):
+        key = by_id.get(str(item.get("id") or item.get("questionId") or ""))
+        if key is None:
+            key = by_text.get(_normalize_question(item.get("question")))
+        if key is None and len(submitted) == len(stored):
+            key = stored[index]
+        keys.append(key)
+    return keys
+
+
+# Result explanation for an answer that matches none of the lesson's stored questions
+UNKNOWN_QUESTION = "This question is not part of the lesson's quiz."
+
+
+def score_answers(lesson, submitted):
+    """
+    Grade submitted answers. When the lesson has stored answer keys, every
+    answer is graded against them and gets the stored explanation: answers
+    matching no stored question count as incorrect, and only the first answer
+    to each question counts (later ones are dropped). Lessons without stored
+    keys fall back to the client's correctAnswer with an empty explanation.
+    Returns (correct_count, question_results).
+    """
+    correct_count = 0
+    question_results = []
+    stored = list(lesson.questions.prefetch_related("options"))
+    keys = match_answer_keys(lesson, submitted, stored)
+    answered = set()
+    for question_data, key in zip(submitted, keys):
+        if key is not None:
+            if key.pk in answered:
+                continue
+            answered.add(key.pk)
+        user_answer = _normalize_answer(question_data.get('userAnswer'))
+        explanation = ''
+        if key is not None:
+            correct_answer = key.correct_option
+            for option in key.options.all():
+                if option.label == correct_answer:
+                    explanation = option.explanation
+        elif stored:
+            correct_answer = ''
+            explanation = UNKNOWN_QUESTION
+        else:
+            correct_answer = _normalize_answer(question_data.get('correctAnswer'))
+        is_correct = bool(correct_answer) and user_answer == correct_answer
+
+        if is_correct:
+            correct_count += 1
+
+        result = {
+            'question': question_data.get('question', '') or (key.text if key else ''),
+            'userAnswer': user_answer,
+            'correctAnswer': correct_answer,
+            'isCorrect': is_correct,
+            'explanation': explanation,
+        }
+        if key is not None:
+            result['questionId'] = key.pk
+        question_results.append(result)
+    return correct_count, question_results
+
+
+def build_feedback_prompt(correct_count, total_questions, percentage, question_results):
+    quiz_summary = f"""
+    Student Quiz Results:
+    - Score: {correct_count}/{total_questions} ({percentage:.1f}%)
+    - Questions and Answers:
+    """
+    
+    for i, q in enumerate(question_results):
+        quiz_summary += f"""
+    {i+1}. {q['question']}
+       Student answered: {q['userAnswer']}
+       Correct answer: {q['correctAnswer']}
+       Result: {'Correct' if q['isCorrect'] else 'Incorrect'}
+    """
+    
+    return f"""
+    Based on the quiz results below, provide:
+    1. Encouraging feedback (2-3 sentences)
+    2. Areas for improvement if score < 70%
+    3. Congratulations if score >= 70%
+
+    Keep it positive, educational and short.
+
+    {quiz_summary}
+    """
+
+
+def build_explanation_prompt(q):
+    return f"""
+                Question: {q['question']}
+                Correct Answer: {q['correctAnswer']}
+                Student Answer: {q['userAnswer']}
+                
+                Provide a brief explanation (1-2 sentences) of why the correct answer is right.
+                """
+
+
+def _explain_one(q):
+    try:
+        return call_ai(build_explanation_prompt(q)).strip()
+    except Exception:
+        return ""
+
+
+async def _aexplain_one(q):
+    try:
+        return (await acall_ai(build_explanation_prompt(q))).strip()
+    except Exception:
+        return ""
+
+
+def _apply_batch(wrong, parsed):
+    """Copy batched explanations onto `wrong`; returns the items still missing one."""
+    missing = []
+    for number, q in enumerate(wrong, start=1):
+        if number in parsed:
+            q["explanation"] = parsed[number]
+        else:
+            missing.append(q)
+    return missing
+
+
+def explain_incorrect(question_results):
+    """
+    Fill in 'explanation' for every incorrect result that doesn't have one yet
+    (no stored answer key) with one batched LLM call.
+    Items the batch answer doesn't cover are explained one by one, concurrently
+    (at most GRADE_EXPLANATION_CONCURRENCY at a time). Never raises; an item that
+    still fails keeps an empty explanation.
+    """
+    wrong = [q for q in question_results if not q["isCorrect"] and not q["explanation"]]
+    if not wrong:
+        return
+
+    try:
+        parsed = parse_explanations(call_ai(build_explanations_prompt(wrong)), len(wrong))
+    except Exception:
+        parsed = {}
+
+    missing = _apply_batch(wrong, parsed)
+    explanations = bounded_map(_explain_one, missing, max_workers=settings.GRADE_EXPLANATION_CONCURRENCY)
+    for q, explanation in zip(missing, explanations):
+        q["explanation"] = explanation
+
+
+async def aexplain_incorrect(question_results):
+    """Async version of explain_incorrect, for the ASGI grading view."""
+    wrong = [q for q in question_results if not q["isCorrect"] and not q["explanation"]]
+    if not wrong:
+        return
+
+    try:
+        parsed = parse_explanations(await acall_ai(build_explanations_prompt(wrong)), len(wrong))
+    except Exception:
+        parsed = {}
+
+    missing = _apply_batch(wrong, parsed)
+    explanations = await gather_bounded(_aexplain_one, missing, max_workers=settings.GRADE_EXPLANATION_CONCURRENCY)
+    for q, explanation in zip(missing, explanations):
+        q["explanation"] = explanation
@@ -0,0 +1,261 @@
+import asyncio
+import logging
+import os
+import queue
+import shutil
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack
+from datetime import timedelta
+
+from asgiref.sync import async_to_sync, sync_to_async
+from django.conf import settings
+from django.db import close_old_connections, connections, transaction
+from django.utils import timezone
+
+from .ai_service import close_async_client
+from .models import LessonJob
+from . import metrics, pipeline, scheduler
+
+logger = logging.getLogger(__name__)
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def _get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=settings.LESSON_JOB_WORKERS,
+                thread_name_prefix="lesson-job",
+            )
+        return _executor
+
+
+def enqueue(job):
+    """
+    Hand a freshly created job to the in-process pool once the transaction commits.
+    With LESSON_JOB_WORKERS = 0 the job just waits in the table for
+    `manage.py run_lesson_worker`.
+    """
+    if settings.LESSON_JOB_WORKERS > 0:
+        transaction.on_commit(lambda: _get_executor().submit(run_job, job.pk))
+
+
+def claim(job_id):
+    """Atomically move a queued job to running. Only one worker can win."""
+    return LessonJob.objects.filter(pk=job_id, status=LessonJob.STATUS_QUEUED).update(
+        status=LessonJob.STATUS_RUNNING,
+        stage="extract",
+        started_at=timezone.now(),
+    ) == 1
+
+
+def claim_next():
+    """Claim the oldest queued job, or return None when the queue is empty."""
+    candidates = (
+        LessonJob.objects.filter(status=LessonJob.STATUS_QUEUED)
+        .order_by("created_at")
+        .values_list("pk", flat=True)[:10]
+    )
+    for job_id in candidates:
+        if claim(job_id):
+            return job_id
+    return None
+
+
+def requeue_stale(max_age=None):
+    """Put back jobs whose worker died mid-run (still `running` after max_age)."""
+    if max_age is None:
+        max_age = timedelta(seconds=settings.LESSON_JOB_STALE_AFTER)
+    return LessonJob.objects.filter(
+        status=LessonJob.STATUS_RUNNING,
+        started_at__lt=timezone.now() - max_age,
+    ).update(status=LessonJob.STATUS_QUEUED, stage=LessonJob.STATUS_QUEUED, progress=0)
+
+
+def run_job(job_id):
+    """Claim and process a job; used by the in-process pool."""
+    try:
+        if claim(job_id):
+            process(job_id)
+    finally:
+        connections.close_all()
+
+
+def _local_source(job):
+    """
+    (path, temp file) of the job's upload on local disk. Storages without local
+    paths are copied into a temp file, deleted when it is closed; else it is None.
+    """
+    try:
+        return job.upload.path, None
+    except NotImplementedError:
+        pass
+    tmp = tempfile.NamedTemporaryFile(suffix=os.path.splitext(job.source_name)[1])
+    with job.upload.open("rb") as source:
+        shutil.copyfileobj(source, tmp)
+    tmp.flush()
+    return tmp.name, tmp
+
+
+def _delete_upload(job):
+    if job.upload:
+        job.upload.delete(save=False)
+
+
+async def aprocess(job_id, on_event=None):
+    """
+    Run the pipeline for an already claimed job and record the outcome.
+    `await on_event(event)` receives the events described in activities.streaming.
+    """
+    jobs = LessonJob.objects.filter(pk=job_id)
+    job = await LessonJob.objects.select_related("created_by", "revises").aget(pk=job_id)
+
+    async def report(stage, progress, plan=None):
+        fields = {"stage": stage, "progress": progress}
+        if plan is not None:
+            fields["plan"] = plan
+        await jobs.aupdate(**fields)
+        if on_event is not None:
+            await on_event({"event": "stage", **fields})
+
+    on_slide = None
+    if on_event is not None:
+        slide_index = 0
+
+        async def on_slide(text):
+            nonlocal slide_index
+            await on_event({"event": "slide", "index": slide_index, "text": text})
+            slide_index += 1
+
+    with metrics.collect("lesson-job") as timings, scheduler.caller("bulk", job.created_by_id):
+        try:
+            with ExitStack() as stack:
+                if job.raw_topic:
+                    content = job.raw_topic.strip()
+                else:
+                    with metrics.timer("extract"):
+                        path, tmp = await sync_to_async(_local_source, thread_sensitive=False)(job)
+                        if tmp is not None:
+                            stack.enter_context(tmp)
+                        content = pipeline.extract_pages(job.source_name, path)
+
+                lesson = await pipeline.generate_lesson(
+                    job.title, content, job.created_by, report=report, source_hash=job.source_hash,
+                    on_slide=on_slide, lesson=job.revises,
+                )
+        except Exception as e:
+            logger.exception("Lesson job %s failed", job_id)
+            await sync_to_async(_delete_upload, thread_sensitive=False)(job)
+            await jobs.aupdate(
+                status=LessonJob.STATUS_FAILED,
+                stage="failed",
+                error=str(e),
+                upload="",
+                finished_at=timezone.now(),
+                timings=timings.as_dict() if timings else None,
+            )
+            if on_event is not None:
+                await on_event({"event": "failed", "error": str(e)})
+            return None
+
+    await sync_to_async(_delete_upload, thread_sensitive=False)(job)
+    await jobs.aupdate(
+        status=LessonJob.STATUS_DONE,
+        stage="done",
+        progress=100,
+        lesson=lesson,
+        upload="",
+        finished_at=timezone.now(),
+        timings=timings.as_dict() if timings else None,
+    )
+    if on_event is not None:
+        await on_event({"event": "done", "lesson": lesson.pk})
+    return lesson
+
+
+def process(job_id, on_event=None):
+    """Blocking entry point for worker threads and `run_lesson_worker`."""
+    close_old_connections()
+
+    async def run():
+        # Each call gets a fresh event loop; don't leave its HTTP client's connections behind
+        try:
+            return await aprocess(job_id, on_event)
+        finally:
+            await close_async_client()
+
+    return async_to_sync(run)()
+
+
+def stream_job(job_id):
+    """
+    Claim and run `job_id` in a background thread, yielding its events as they
+    happen. The job keeps running if the consumer stops early.
+    """
+    events = queue.Queue()
+
+    async def put(event):
+        events.put(event)
+
+    def run():
+        try:
+            if claim(job_id):
+                process(job_id, on_event=put)
+        finally:
+            connections.close_all()
+            events.put(None)
+
+    threading.Thread(target=run, name=f"lesson-stream-{job_id}", daemon=True).start()
+    while (event := events.get()) is not None:
+        yield event
+
+
+# Under ASGI the create view runs jobs as tasks on the server's event loop
+# instead of handing them to the thread pool.
+_tasks = set()
+_task_semaphore = None
+
+
+async def arun_job(job_id):
+    """Claim and process a job on the running event loop."""
+    global _task_semaphore
+    if _task_semaphore is None:
+        _task_semaphore = asyncio.Semaphore(settings.LESSON_JOB_ASYNC_CONCURRENCY)
+    async with _task_semaphore:
+        if await sync_to_async(claim)(job_id):
+            await aprocess(job_id)
+
+
+async def astream_job(job_id):
+    """Async stream_job: the job runs as a task on the running loop."""
+    events = asyncio.Queue()
+
+    async def run():
+        try:
+            if await sync_to_async(claim)(job_id):
+                await aprocess(job_id, on_event=events.put)
+        finally:
+            events.put_nowait(None)
+
+    task = asyncio.get_running_loop().create_task(run())
+    _tasks.add(task)
+    task.add_done_callback(_tasks.discard)
+    while (event := await events.get()) is not None:
+        yield event
+
+
+def enqueue_async(job):
+    """
+    Start `job` as a task on the running loop. With LESSON_JOB_WORKERS = 0 the
+    job is left for `manage.py run_lesson_worker`, as with `enqueue`.
+    """
+    if settings.LESSON_JOB_WORKERS <= 0:
+        return
+    task = asyncio.get_running_loop().create_task(arun_job(job.pk))
+    _tasks.add(task)
+    task.add_done_callback(_tasks.discard)
@@ -0,0 +1,78 @@
+import random
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from activities.utils import chunk_text
+
+WORDS = [
+    "cell", "membrane", "energy", "the", "of", "photosynthesis", "a", "process", "which",
+    "converts", "light", "into", "chemical", "mitochondria", "is", "and", "enzyme", "reaction",
+]
+
+
+def legacy_chunk_text(text, max_length=500):
+    # The original implementation, kept here as the baseline
+    words = text.split()
+    chunks, current = [], []
+
+    for word in words:
+        if len(" ".join(current + [word])) > max_length:
+            chunks.append(" ".join(current))
+            current = [word]
+        else:
+            current.append(word)
+
+    if current:
+        chunks.append(" ".join(current))
+
+    return chunks
+
+
+def sample_text(size, seed=0):
+    """Lesson-like text of about `size` characters with sentences and paragraphs."""
+    rnd = random.Random(seed)
+    parts, length = [], 0
+    while length < size:
+        sentence = " ".join(rnd.choice(WORDS) for _ in range(rnd.randint(6, 24))).capitalize() + "."
+        parts.append(sentence)
+        parts.append("\n\n" if rnd.random() < 0.15 else " ")
+        length += len(sentence) + 1
+    return "".join(parts)
+
+
+class Command(BaseCommand):
+    help = "Micro-benchmark chunk_text against the original implementation."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--size-mb", type=float, default=1.0, help="Size of the generated text.")
+        parser.add_argument("--max-length", type=int, default=400)
+        parser.add_argument("--repeat", type=int, default=3, help="Runs per variant; the best is reported.")
+
+    def handle(self, *args, **options):
+        size = int(options["size_mb"] * 1024 * 1024)
+        max_length = options["max_length"]
+        text = sample_text(size)
+        megabytes = len(text) / (1024 * 1024)
+
+        variants = [
+            ("legacy", lambda: legacy_chunk_text(text, max_length)),
+            ("compat", lambda: chunk_text(text, max_length, compat=True)),
+            ("sentences", lambda: chunk_text(text, max_length)),
+        ]
+        results = {}
+        for name, run in variants:
+            best = None
+            for _ in range(options["repeat"]):
+                start = time.perf_counter()
+                chunks = run()
+                elapsed = time.perf_counter() - start
+                best = elapsed if best is None else min(best, elapsed)
+            results[name] = chunks
+            self.stdout.write(
+                f"{name:<10} {best * 1000:9.1f} ms  {megabytes / best:8.2f} MB/s  {len(chunks)} chunks"
+            )
+
+        if results["compat"] != results["legacy"]:
+            raise CommandError("compat mode output differs from the original chunk_text")
+        self.stdout.write("compat output identical to legacy")
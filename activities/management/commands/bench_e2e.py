@@ -0,0 +1,303 @@
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+
+from asgiref.sync import async_to_sync
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, connections
+from django.test import override_settings
+from django.test.utils import setup_test_environment, teardown_test_environment
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import AccessToken
+
+from activities import jobs
+from activities.fake_llm import FakeLLMServer, lesson_text, quiz_text
+from activities.models import Lesson, LessonJob
+from activities.pipeline import SLIDE_LENGTH
+from activities.quiz import explain_options, parse_quiz, save_questions
+from activities.slides import save_slides
+from activities.utils import chunk_text
+
+SCENARIOS = ["create", "grade", "grade-batch", "list", "detail"]
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, max(0, round(fraction * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+def peak_rss_kb():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and kilobytes elsewhere
+    return peak // 1024 if sys.platform == "darwin" else peak
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True,
+            cwd=settings.BASE_DIR,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+class Command(BaseCommand):
+    help = (
+        "End-to-end benchmark: serve a fake LLM, then drive lesson creation, grading, "
+        "list and detail through the real views on a throwaway test database."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--scenarios", default=",".join(SCENARIOS))
+        parser.add_argument("--requests", type=int, default=40, help="Requests per scenario.")
+        parser.add_argument("--concurrency", type=int, default=8)
+        parser.add_argument("--latency", type=float, default=0.2, help="Fake LLM seconds before the first byte.")
+        parser.add_argument("--jitter", type=float, default=0.05)
+        parser.add_argument("--error-rate", type=float, default=0.0)
+        parser.add_argument("--token-delay", type=float, default=0.002, help="Fake LLM seconds per word.")
+        parser.add_argument("--lesson-words", type=int, default=600)
+        parser.add_argument("--no-stream", action="store_true",
+                            help="Create lessons through the queued job path instead of ?stream=ndjson.")
+        parser.add_argument("--output", default=None, help="JSON results file (default bench_results/e2e-<commit>.json).")
+        parser.add_argument("--compare", default=None, help="Earlier results file to print changes against.")
+
+    def handle(self, *args, **options):
+        scenarios = [s for s in options["scenarios"].split(",") if s]
+        unknown = set(scenarios) - set(SCENARIOS)
+        if unknown:
+            raise CommandError(f"Unknown scenario(s): {', '.join(sorted(unknown))}")
+
+        server = FakeLLMServer(
+            ("127.0.0.1", 0),
+            token_delay=options["token_delay"],
+            first_token_delay=options["latency"],
+            jitter=options["jitter"],
+            error_rate=options["error_rate"],
+            lesson_words=options["lesson_words"],
+            seed=0,
+        ).start()
+
+        setup_test_environment()
+        if connection.vendor == "sqlite":
+            if not connection.settings_dict["TEST"].get("NAME"):
+                # The default in-memory test database locks whole tables under concurrent writers
+                connection.settings_dict["TEST"]["NAME"] = os.path.join(tempfile.mkdtemp(), "bench_e2e.sqlite3")
+            # Readers alongside the writer (WAL); writers take the lock when their
+            # transaction starts and wait for it, rather than failing on upgrade
+            connection.settings_dict["OPTIONS"] = {
+                **connection.settings_dict["OPTIONS"],
+                "init_command": "PRAGMA journal_mode=WAL;",
+                "transaction_mode": "IMMEDIATE",
+                "timeout": 30,
+            }
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        try:
+            with override_settings(
+                LLM_API_URL=server.url,
+                LLM_API_KEY="bench",
+                LLM_CACHE_BACKEND="none",
+                LLM_BACKOFF_BASE=0.05,
+                LLM_BACKOFF_MAX=0.5,
+                LESSON_JOB_WORKERS=0,
+            ):
+                cache.clear()
+                results = self.run_scenarios(server, scenarios, options)
+        finally:
+            connections.close_all()
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            teardown_test_environment()
+            server.shutdown()
+
+        report = {
+            "commit": git_commit(),
+            "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+            "python": sys.version.split()[0],
+            "database": connection.vendor,
+            "options": {k: options[k] for k in (
+                "requests", "concurrency", "latency", "jitter", "error_rate", "token_delay", "lesson_words", "no_stream",
+            )},
+            "scenarios": results,
+        }
+        output = options["output"] or os.path.join("bench_results", f"e2e-{report['commit'] or 'local'}.json")
+        os.makedirs(os.path.dirname(output) or ".", exist_ok=True)
+        with open(output, "w") as f:
+            json.dump(report, f, indent=2)
+        self.stdout.write(f"Saved {output}")
+
+        if options["compare"]:
+            with open(options["compare"]) as f:
+                self.compare(json.load(f), report)
+
+        failed = {name: result["errors"] for name, result in results.items() if result["errors"]}
+        if failed:
+            raise CommandError("Failed requests: " + ", ".join(f"{name} {count}" for name, count in failed.items()))
+
+    # --- scenarios -----------------------------------------------------------
+
+    def run_scenarios(self, server, scenarios, options):
+        user = User.objects.create_user("bench", password="bench")
+        token = str(AccessToken.for_user(user))
+        lesson = self.seed_lesson(user, explain=True)
+        unexplained = self.seed_lesson(user, title="Seeded without explanations")
+        for i in range(30):
+            self.seed_lesson(user, title=f"Seeded {i}")
+
+        requests = {
+            "create": lambda client, n, start: self.create(client, n, start, stream=not options["no_stream"]),
+            "grade": lambda client, n, start: self.grade(client, lesson),
+            "grade-batch": lambda client, n, start: self.grade(client, unexplained),
+            "list": lambda client, n, start: self.expect(client.get("/activities/lessons/"), 200),
+            "detail": lambda client, n, start: self.expect(client.get(f"/activities/lessons/{lesson.pk}/"), 200),
+        }
+        results = {}
+        for name in scenarios:
+            results[name] = self.run(name, requests[name], server, token, options)
+        return results
+
+    def seed_lesson(self, user, title="Seeded lesson", explain=False):
+        """
+        A lesson as the pipeline saves it. With `explain`, its options are
+        explained by the (fake) LLM like a newly generated lesson's, so grading
+        needs no explanation call; without, it is like a lesson from before
+        explanations were stored, and grading explains wrong answers in a batch.
+        """
+        text = lesson_text(600)
+        slides = chunk_text(text, max_length=SLIDE_LENGTH)
+        quiz = quiz_text(12)
+        lesson = Lesson.objects.create(title=title, quiz=quiz, slide_count=len(slides), created_by=user)
+        save_slides(lesson, slides)
+        parsed = parse_quiz(quiz)
+        explanations = async_to_sync(explain_options)(parsed, text) if explain else None
+        save_questions(lesson, parsed, explanations)
+        return lesson
+
+    @staticmethod
+    def expect(response, status):
+        if response.status_code != status:
+            raise AssertionError(f"HTTP {response.status_code}")
+        return response
+
+    def create(self, client, n, start, stream):
+        """Create a lesson; returns seconds to the first streamed slide (None without streaming)."""
+        data = {"title": f"Bench {n}", "topic": f"Benchmark lesson {n} {uuid.uuid4().hex}"}
+        if not stream:
+            self.expect(client.post("/activities/lessons/create/", data), 202)
+            job_id = jobs.claim_next()
+            if job_id is not None:
+                jobs.process(job_id)
+                job = LessonJob.objects.get(pk=job_id)
+                if job.status != LessonJob.STATUS_DONE:
+                    raise AssertionError(f"job {job.status}: {job.error}")
+            return None
+        response = self.expect(client.post("/activities/lessons/create/?stream=ndjson", data), 200)
+        first_slide, last = None, None
+        for chunk in response.streaming_content:
+            for line in chunk.splitlines():
+                if not line.strip():
+                    continue
+                last = json.loads(line)
+                if last["event"] == "slide" and first_slide is None:
+                    first_slide = time.perf_counter() - start
+        if not last or last["event"] != "done":
+            raise AssertionError(f"stream ended with {last}")
+        return first_slide
+
+    def grade(self, client, lesson):
+        questions = [
+            {"id": q.pk, "question": q.text, "userAnswer": "A"}
+            for q in lesson.questions.all()
+        ]
+        self.expect(client.post(f"/activities/lessons/{lesson.pk}/grade-quiz/", {"questions": questions},
+                                format="json"), 200)
+
+    # --- driver --------------------------------------------------------------
+
+    def run(self, name, request, server, token, options):
+        total = options["requests"]
+        concurrency = max(1, options["concurrency"])
+        latencies, extras, errors = [], [], []
+        lock = threading.Lock()
+        local = threading.local()
+
+        def one(n):
+            if not hasattr(local, "client"):
+                local.client = APIClient()
+                local.client.credentials(HTTP_AUTHORIZATION=f"Bearer {token}")
+            start = time.perf_counter()
+            try:
+                extra = request(local.client, n, start)
+            except Exception as e:
+                with lock:
+                    errors.append(f"{type(e).__name__}: {e}")
+                return
+            finally:
+                connections.close_all()
+            elapsed = time.perf_counter() - start
+            with lock:
+                latencies.append(elapsed)
+                if isinstance(extra, float):
+                    extras.append(extra)
+
+        calls_before = server.requests
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            list(pool.map(one, range(total)))
+        wall = time.perf_counter() - started
+        llm_calls = server.requests - calls_before
+
+        latencies.sort()
+        extras.sort()
+        ms = lambda value: None if value is None else round(value * 1000, 1)
+        result = {
+            "requests": total,
+            "errors": len(errors),
+            "concurrency": concurrency,
+            "p50_ms": ms(percentile(latencies, 0.50)),
+            "p95_ms": ms(percentile(latencies, 0.95)),
+            "p99_ms": ms(percentile(latencies, 0.99)),
+            "mean_ms": ms(sum(latencies) / len(latencies)) if latencies else None,
+            "throughput_rps": round(len(latencies) / wall, 2) if wall else None,
+            "llm_calls_per_request": round(llm_calls / total, 2),
+            "peak_rss_kb": peak_rss_kb(),
+        }
+        if extras:
+            result["first_slide_p50_ms"] = ms(percentile(extras, 0.50))
+            result["first_slide_p95_ms"] = ms(percentile(extras, 0.95))
+        if errors:
+            result["first_error"] = errors[0]
+        self.stdout.write(
+            f"{name:<11} n={total} c={concurrency} p50={result['p50_ms']}ms p95={result['p95_ms']}ms "
+            f"p99={result['p99_ms']}ms {result['throughput_rps']} req/s "
+            f"llm/req={result['llm_calls_per_request']} errors={len(errors)} rss={result['peak_rss_kb']}KB"
+        )
+        if extras:
+            self.stdout.write(f"            first slide p50={result['first_slide_p50_ms']}ms p95={result['first_slide_p95_ms']}ms")
+        if errors:
+            self.stdout.write(f"            first error: {errors[0]}")
+        return result
+
+    def compare(self, before, after):
+        self.stdout.write(f"Compared with {before.get('commit')} ({before.get('timestamp')}):")
+        for name, new in after["scenarios"].items():
+            old = before.get("scenarios", {}).get(name)
+            if not old:
+                continue
+            changes = []
+            for key in ("p50_ms", "p95_ms", "p99_ms", "throughput_rps", "llm_calls_per_request"):
+                if old.get(key) and new.get(key) is not None:
+                    changes.append(f"{key} {100 * (new[key] - old[key]) / old[key]:+.1f}%")
+            self.stdout.write(f"  {name:<11} " + "  ".join(changes))
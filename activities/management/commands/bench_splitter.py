@@ -0,0 +1,105 @@
+import random
+from unittest import mock
+
+from asgiref.sync import async_to_sync
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.test import override_settings
+
+from activities.fake_llm import answer_for
+from activities.management.commands.bench_chunker import sample_text
+from activities.pipeline import (
+    PER_PASS_LIMIT, build_part_prompt, build_single_prompt, normalize_tree, part_role, plan_split, split_for_model,
+)
+from activities.tokens import get_estimator
+
+
+def dense_text(size, seed=0):
+    """Reference-style text heavy in numbers, symbols and long terms."""
+    rnd = random.Random(seed)
+    terms = ["Na+/K+-ATPase", "3.14159", "H2SO4", "(x^2 + y^2)", "1,024", "mRNA->protein",
+             "deoxyribonucleotide", "Eq.(4.2)", "0.05M", "CO2", "ΔG=-30.5kJ/mol", "[Ca2+]i"]
+    parts, length = [], 0
+    while length < size:
+        sentence = " ".join(rnd.choice(terms) for _ in range(rnd.randint(5, 14))) + "."
+        parts.append(sentence)
+        parts.append("\n\n" if rnd.random() < 0.2 else " ")
+        length += len(sentence) + 1
+    return "".join(parts)
+
+
+def sparse_text(size, seed=0):
+    """Slide-deck-like text: short lines of short words."""
+    rnd = random.Random(seed)
+    words = ["a", "is", "of", "the", "to", "and", "in", "on", "it", "we", "go", "up"]
+    parts, length = [], 0
+    while length < size:
+        line = "- " + " ".join(rnd.choice(words) for _ in range(rnd.randint(3, 8)))
+        parts.append(line)
+        parts.append("\n\n" if rnd.random() < 0.3 else "\n")
+        length += len(line) + 1
+    return "".join(parts)
+
+
+class Command(BaseCommand):
+    help = "Compare LLM calls and tokens per lesson for the fixed-size and token-budget splitters."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--sizes", default="20000,60000,150000", help="Document sizes in characters.")
+        parser.add_argument("--model", default=None, help="Model whose budget to use (default LLM_MODEL).")
+
+    def lesson_cost(self, parts, estimate):
+        """
+        (LLM calls, input tokens) for rewriting `parts` and normalizing the
+        result: every merge call of every level, as normalize_tree makes them
+        (parts stand in for their rewrites). Quiz and option explanations add
+        two calls; their tokens are the same for both splitters and left out.
+        """
+        if not parts:
+            return 0, 0
+        if len(parts) == 1:
+            prompts = [build_single_prompt(parts[0])]
+        else:
+            prompts = [build_part_prompt(part, part_role(idx, len(parts))) for idx, part in enumerate(parts, start=1)]
+
+            async def merge(prompt, *args, **kwargs):
+                prompts.append(prompt)
+                return answer_for(prompt)
+
+            with mock.patch("activities.pipeline.acall_ai", side_effect=merge):
+                async_to_sync(normalize_tree)(parts)
+        return len(prompts) + 2, sum(estimate(prompt) for prompt in prompts)
+
+    def handle(self, *args, **options):
+        estimate = get_estimator()
+        model = options["model"] or settings.LLM_MODEL
+        self.stdout.write(f"model={model} estimator={settings.LLM_TOKEN_ESTIMATOR}")
+
+        totals = {"fixed": [0, 0], "budget": [0, 0]}
+        for kind, make in (("prose", sample_text), ("dense", dense_text), ("sparse", sparse_text)):
+            for size in (int(s) for s in options["sizes"].split(",")):
+                text = make(size)
+                fixed = split_for_model(text, PER_PASS_LIMIT)
+                plan = plan_split(text, model)
+                overflow = sum(1 for p in fixed if estimate(p) > plan.budget)
+                # normalize_tree sizes merges for LLM_MODEL
+                with override_settings(LLM_MODEL=model):
+                    fixed_cost = self.lesson_cost(fixed, estimate)
+                    plan_cost = self.lesson_cost(plan.parts, estimate)
+                for name, cost in (("fixed", fixed_cost), ("budget", plan_cost)):
+                    totals[name][0] += cost[0]
+                    totals[name][1] += cost[1]
+                self.stdout.write(
+                    f"{kind:<6} {size:>7} chars  fixed: {len(fixed):>3} parts {fixed_cost[0]:>3} calls "
+                    f"{fixed_cost[1]:>7} tokens ({overflow} over budget)  "
+                    f"budget: {len(plan.parts):>3} parts of <= {plan.budget} tokens "
+                    f"{plan_cost[0]:>3} calls {plan_cost[1]:>7} tokens"
+                )
+
+        (fixed_calls, fixed_tokens), (plan_calls, plan_tokens) = totals["fixed"], totals["budget"]
+        self.stdout.write(
+            f"total  fixed: {fixed_calls} calls {fixed_tokens} tokens  "
+            f"budget: {plan_calls} calls {plan_tokens} tokens "
+            f"(calls {100 * (plan_calls - fixed_calls) / fixed_calls:+.0f}%, "
+            f"tokens {100 * (plan_tokens - fixed_tokens) / fixed_tokens:+.0f}%)"
+        )
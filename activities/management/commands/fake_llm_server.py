@@ -0,0 +1,33 @@
+from django.core.management.base import BaseCommand
+
+from activities.fake_llm import FakeLLMServer
+
+
+class Command(BaseCommand):
+    help = "Serve a fake chat-completions API (plain and streamed) for local development."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--host", default="127.0.0.1")
+        parser.add_argument("--port", type=int, default=8001)
+        parser.add_argument("--token-delay", type=float, default=0.02, help="Seconds between streamed words.")
+        parser.add_argument("--first-token-delay", type=float, default=0.2, help="Seconds before the first byte.")
+        parser.add_argument("--jitter", type=float, default=0.0, help="Random +/- seconds on the first-byte delay.")
+        parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of requests answered 429/503.")
+        parser.add_argument("--lesson-words", type=int, default=400, help="Length of generated lesson text.")
+
+    def handle(self, *args, **options):
+        server = FakeLLMServer(
+            (options["host"], options["port"]),
+            token_delay=options["token_delay"],
+            first_token_delay=options["first_token_delay"],
+            lesson_words=options["lesson_words"],
+            jitter=options["jitter"],
+            error_rate=options["error_rate"],
+        )
+        self.stdout.write(f"Fake LLM listening; set LLM_API_URL={server.url}")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
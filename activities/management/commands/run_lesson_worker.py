@@ -0,0 +1,61 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+from activities import jobs
+from users_accounts import blacklist
+
+
+class Command(BaseCommand):
+    help = "Process queued lesson generation jobs from the database."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--concurrency", type=int, default=settings.LESSON_JOB_WORKER_CONCURRENCY,
+                            help="Jobs processed at the same time by this worker.")
+        parser.add_argument("--poll", type=float, default=2.0,
+                            help="Seconds to wait between polls when the queue is empty.")
+        parser.add_argument("--once", action="store_true",
+                            help="Drain the queue and exit instead of polling forever.")
+
+    def handle(self, *args, **options):
+        concurrency = max(1, options["concurrency"])
+        requeued = jobs.requeue_stale()
+        if requeued:
+            self.stdout.write(f"Requeued {requeued} stale job(s)")
+        self.stdout.write(f"Lesson worker started (concurrency={concurrency})")
+
+        running = set()
+        next_purge = time.monotonic()
+        with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="lesson-worker") as pool:
+            while True:
+                if settings.TOKEN_PURGE_INTERVAL and time.monotonic() >= next_purge:
+                    self._purge_tokens()
+                    next_purge = time.monotonic() + settings.TOKEN_PURGE_INTERVAL
+                running = {f for f in running if not f.done()}
+                if len(running) < concurrency:
+                    job_id = jobs.claim_next()
+                    if job_id is not None:
+                        self.stdout.write(f"Processing job {job_id}")
+                        running.add(pool.submit(self._process, job_id))
+                        continue
+                    if options["once"] and not running:
+                        break
+                time.sleep(options["poll"])
+
+    def _purge_tokens(self):
+        try:
+            outstanding, blacklisted = blacklist.purge_expired()
+        except Exception as e:   # the queue matters more than the purge
+            self.stderr.write(f"Token purge failed: {e}")
+            return
+        if outstanding:
+            self.stdout.write(f"Purged {outstanding} expired token(s), {blacklisted} blacklisted")
+
+    def _process(self, job_id):
+        try:
+            jobs.process(job_id)
+        finally:
+            connections.close_all()
@@ -0,0 +1,322 @@
+"""
+Stage timers, Server-Timing headers and Prometheus metrics.
+
+Code wraps the steps worth measuring in `timer("stage")`. While a request is
+being handled (ServerTimingMiddleware) or a lesson job is running
+(`collect()`), each timed stage is added to that request's or job's timings,
+which go out as a `Server-Timing` header or are stored on the job. Every
+stage, request and LLM call is also counted in process-local histograms and
+counters served in the Prometheus text format by `metrics_view`.
+
+With METRICS_ENABLED off (the default) the middleware removes itself and
+`timer()` hands back a shared no-op context manager, so instrumented code pays
+for one settings lookup.
+
+The registry lives in each process: with several workers, scrape every worker
+(or run one per port) and let Prometheus sum them.
+"""
+import bisect
+import hmac
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.http import Http404, HttpResponse
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+LLM_BUCKETS = (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 40, 60, 120)
+
+_NOOP = nullcontext()
+
+
+class Timings:
+    """Stage durations of one request or job: name -> [seconds, count], in first-seen order."""
+
+    def __init__(self, endpoint="-"):
+        self.endpoint = endpoint
+        self.stages = {}
+        self._lock = threading.Lock()   # stages may finish in worker threads
+
+    def add(self, name, seconds):
+        with self._lock:
+            entry = self.stages.get(name)
+            if entry is None:
+                self.stages[name] = [seconds, 1]
+            else:
+                entry[0] += seconds
+                entry[1] += 1
+
+    def as_dict(self):
+        """{stage: milliseconds} for storing on a job."""
+        return {name: round(seconds * 1000, 1) for name, (seconds, _) in self.stages.items()}
+
+    def header(self, total=None):
+        """Value of a Server-Timing header."""
+        parts = []
+        for name, (seconds, count) in self.stages.items():
+            desc = f';desc="{count}x"' if count > 1 else ""
+            parts.append(f"{name}{desc};dur={seconds * 1000:.1f}")
+        if total is not None:
+            parts.append(f"total;dur={total * 1000:.1f}")
+        return ", ".join(parts)
+
+
+_current = ContextVar("activities_metrics_timings", default=None)
+
+
+def current_endpoint():
+    timings = _current.get()
+    return timings.endpoint if timings is not None else "-"
+
+
+# --- registry ---------------------------------------------------------------
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _label_text(names, values, extra=()):
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    pairs.extend(f'{n}="{v}"' for n, v in extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Counter:
+    def __init__(self, name, help, labels=()):
+        self.name, self.help, self.labels = name, help, tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *labels, amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            values = sorted(self._values.items())
+        for labels, value in values:
+            lines.append(f"{self.name}{_label_text(self.labels, labels)} {value}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, help, labels=(), buckets=DEFAULT_BUCKETS):
+        self.name, self.help, self.labels = name, help, tuple(labels)
+        self.buckets = tuple(buckets)
+        self._values = {}   # labels -> [per-bucket counts..., +Inf count, sum]
+        self._lock = threading.Lock()
+
+    def observe(self, value, *labels):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._values.get(labels)
+            if series is None:
+                series = self._values[labels] = [0] * (len(self.buckets) + 2)
+            series[index] += 1
+            series[-1] += value
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            values = sorted((labels, list(series)) for labels, series in self._values.items())
+        for labels, series in values:
+            cumulative = 0
+            for bound, count in zip(self.buckets + ("+Inf",), series):
+                cumulative += count
+                le = bound if bound == "+Inf" else repr(float(bound))
+                lines.append(f"{self.name}_bucket{_label_text(self.labels, labels, [('le', le)])} {cumulative}")
+            lines.append(f"{self.name}_sum{_label_text(self.labels, labels)} {series[-1]:.6f}")
+            lines.append(f"{self.name}_count{_label_text(self.labels, labels)} {cumulative}")
+        return lines
+
+
+class Gauge:
+    """Current values read at scrape time: `collect()` returns {label values: value}."""
+
+    def __init__(self, name, help, labels, collect):
+        self.name, self.help, self.labels = name, help, tuple(labels)
+        self.collect = collect
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} gauge"]
+        for labels, value in sorted(self.collect().items()):
+            lines.append(f"{self.name}{_label_text(self.labels, labels)} {value}")
+        return lines
+
+
+REQUEST_SECONDS = Histogram(
+    "studyfun_http_request_seconds", "Time to produce a response (headers, for streams).",
+    ["endpoint", "method", "status"],
+)
+STAGE_SECONDS = Histogram(
+    "studyfun_stage_seconds", "Time spent in an instrumented stage.", ["endpoint", "stage"],
+)
+LLM_SECONDS = Histogram(
+    "studyfun_llm_request_seconds", "LLM provider call time, retries included.",
+    ["endpoint", "outcome"], buckets=LLM_BUCKETS,
+)
+LLM_CALLS = Counter(
+    "studyfun_llm_calls_total", "LLM completions requested, by response cache result.",
+    ["endpoint", "cache"],
+)
+LLM_RETRIES = Counter(
+    "studyfun_llm_retries_total", "LLM requests retried, by status code or 'network'.",
+    ["endpoint", "reason"],
+)
+LLM_QUEUE_WAIT_SECONDS = Histogram(
+    "studyfun_llm_queue_wait_seconds", "Time LLM calls waited for admission.", ["priority"],
+)
+
+# Modules with metrics of their own append to this (see activities.scheduler)
+REGISTRY = [REQUEST_SECONDS, STAGE_SECONDS, LLM_SECONDS, LLM_CALLS, LLM_RETRIES, LLM_QUEUE_WAIT_SECONDS]
+
+
+def render():
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+# --- instrumentation --------------------------------------------------------
+
+@contextmanager
+def _timed(name):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        seconds = time.perf_counter() - start
+        timings = _current.get()
+        if timings is not None:
+            timings.add(name, seconds)
+        STAGE_SECONDS.observe(seconds, timings.endpoint if timings is not None else "-", name)
+
+
+def timer(name):
+    """Context manager timing the stage `name` (a no-op when metrics are off)."""
+    if not settings.METRICS_ENABLED:
+        return _NOOP
+    return _timed(name)
+
+
+@contextmanager
+def collect(endpoint):
+    """Collect timings for work outside a request (e.g. a lesson job); yields Timings or None."""
+    if not settings.METRICS_ENABLED:
+        yield None
+        return
+    timings = Timings(endpoint)
+    token = _current.set(timings)
+    try:
+        yield timings
+    finally:
+        _current.reset(token)
+
+
+def count_llm_call(cache):
+    """Count one completion; `cache` is "hit", "miss" or "off"."""
+    if settings.METRICS_ENABLED:
+        LLM_CALLS.inc(current_endpoint(), cache)
+
+
+def count_llm_retry(reason):
+    if settings.METRICS_ENABLED:
+        LLM_RETRIES.inc(current_endpoint(), str(reason))
+
+
+def observe_llm_queue_wait(seconds, priority):
+    if settings.METRICS_ENABLED:
+        LLM_QUEUE_WAIT_SECONDS.observe(seconds, priority)
+        timings = _current.get()
+        if timings is not None:
+            timings.add("llm-queue", seconds)
+
+
+@contextmanager
+def _llm_timed():
+    start = time.perf_counter()
+    outcome = "error"
+    try:
+        yield
+        outcome = "ok"
+    finally:
+        seconds = time.perf_counter() - start
+        timings = _current.get()
+        if timings is not None:
+            timings.add("llm", seconds)
+        LLM_SECONDS.observe(seconds, current_endpoint(), outcome)
+
+
+def llm_timer():
+    """Times a call to the LLM provider (a no-op when metrics are off)."""
+    if not settings.METRICS_ENABLED:
+        return _NOOP
+    return _llm_timed()
+
+
+# --- HTTP -------------------------------------------------------------------
+
+class ServerTimingMiddleware:
+    """
+    Collects stage timings per request, sends them as a Server-Timing header
+    and records the request duration. Removes itself when METRICS_ENABLED is off.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not settings.METRICS_ENABLED:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        timings, token, start = self._start(request)
+        try:
+            response = self.get_response(request)
+        finally:
+            _current.reset(token)
+        return self._finish(request, response, timings, start)
+
+    async def __acall__(self, request):
+        timings, token, start = self._start(request)
+        try:
+            response = await self.get_response(request)
+        finally:
+            _current.reset(token)
+        return self._finish(request, response, timings, start)
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        match = request.resolver_match
+        request._timings.endpoint = (match.url_name or match.view_name) if match else "-"
+
+    def _start(self, request):
+        timings = request._timings = Timings()
+        return timings, _current.set(timings), time.perf_counter()
+
+    def _finish(self, request, response, timings, start):
+        total = time.perf_counter() - start
+        response["Server-Timing"] = timings.header(total)
+        REQUEST_SECONDS.observe(total, timings.endpoint, request.method, response.status_code)
+        return response
+
+
+def metrics_view(request):
+    """Prometheus text exposition; 404 when metrics are off, bearer METRICS_TOKEN when set."""
+    if not settings.METRICS_ENABLED:
+        raise Http404
+    if settings.METRICS_TOKEN:
+        supplied = request.headers.get("Authorization", "").removeprefix("Bearer ").strip()
+        if not hmac.compare_digest(supplied, settings.METRICS_TOKEN):
+            return HttpResponse(status=401)
+    return HttpResponse(render(), content_type="text/plain; version=0.0.4; charset=utf-8")
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.5 on 2026-10-17 02:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('activities', '0004_llmcacheentry'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='lesson',
+            name='source_hash',
+            field=models.CharField(blank=True, db_index=True, max_length=64, null=True),
+        ),
+        migrations.AddField(
+            model_name='lessonjob',
+            name='source_hash',
+            field=models.CharField(blank=True, max_length=64, null=True),
+        ),
+    ]
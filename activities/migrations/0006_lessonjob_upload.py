@@ -0,0 +1,35 @@
+import os
+import uuid
+
+from django.core.files.base import ContentFile
+from django.db import migrations, models
+
+
+def move_uploads_to_storage(apps, schema_editor):
+    """Uploads of jobs that haven't finished yet go from the table to storage."""
+    LessonJob = apps.get_model("activities", "LessonJob")
+    pending = LessonJob.objects.filter(source_file__isnull=False).exclude(status__in=["done", "failed"])
+    for job in pending.iterator(chunk_size=10):
+        ext = os.path.splitext(job.source_name or "")[1].lower()
+        job.upload.save(uuid.uuid4().hex + ext, ContentFile(bytes(job.source_file)), save=False)
+        LessonJob.objects.filter(pk=job.pk).update(upload=job.upload.name)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('activities', '0005_source_hash'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='lessonjob',
+            name='upload',
+            field=models.FileField(blank=True, upload_to='lesson_uploads/'),
+        ),
+        migrations.RunPython(move_uploads_to_storage, migrations.RunPython.noop),
+        migrations.RemoveField(
+            model_name='lessonjob',
+            name='source_file',
+        ),
+    ]
@@ -0,0 +1,96 @@
+# Generated by Django 5.2.5 on 2026-10-17 02:11
+
+import re
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+# activities.quiz.parse_quiz as it was when this migration was written
+_QUESTION_LINE = re.compile(r"^(?:Q(?:uestion)?\s*)?(\d+)\s*[.):]\s*(.+)$", re.IGNORECASE)
+_OPTION_LINE = re.compile(r"^\(?([A-D])\s*[.):\]]\s*(.+)$", re.IGNORECASE)
+_CORRECT_LINE = re.compile(r"^(?:Correct(?:\s+answer)?|Answer)\s*[:\-]\s*\(?([A-D])\b", re.IGNORECASE)
+
+
+def parse_quiz(text):
+    questions = []
+    current = None
+    for raw_line in (text or "").splitlines():
+        line = raw_line.strip().replace("**", "").strip()
+        if not line:
+            continue
+        correct = _CORRECT_LINE.match(line)
+        if correct and current is not None:
+            current["correct"] = correct.group(1).upper()
+            continue
+        option = _OPTION_LINE.match(line)
+        if option and current is not None:
+            current["options"][option.group(1).upper()] = option.group(2).strip()
+            continue
+        question = _QUESTION_LINE.match(line)
+        if question:
+            current = {"text": question.group(2).strip(), "options": {}, "correct": None}
+            questions.append(current)
+        elif current is not None and not current["options"]:
+            current["text"] = f"{current['text']} {line}"
+    return [q for q in questions if q["options"] and q["correct"] in q["options"]]
+
+
+def parse_existing_quizzes(apps, schema_editor):
+    # Answer keys for lessons generated before questions were stored (no explanations)
+    Lesson = apps.get_model("activities", "Lesson")
+    Question = apps.get_model("activities", "Question")
+    Option = apps.get_model("activities", "Option")
+    for lesson in Lesson.objects.exclude(quiz__isnull=True).exclude(quiz="").only("id", "quiz").iterator():
+        for number, q in enumerate(parse_quiz(lesson.quiz), start=1):
+            question = Question.objects.create(
+                lesson_id=lesson.id, position=number, text=q["text"], correct_option=q["correct"],
+            )
+            Option.objects.bulk_create([
+                Option(question=question, label=label, text=text)
+                for label, text in sorted(q["options"].items())
+            ])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('activities', '0006_lessonjob_upload'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Question',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('position', models.PositiveIntegerField()),
+                ('text', models.TextField()),
+                ('correct_option', models.CharField(max_length=1)),
+                ('lesson', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='questions', to='activities.lesson')),
+            ],
+            options={
+                'ordering': ['position'],
+            },
+        ),
+        migrations.CreateModel(
+            name='Option',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('label', models.CharField(max_length=1)),
+                ('text', models.TextField()),
+                ('explanation', models.TextField(blank=True, default='')),
+                ('question', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='options', to='activities.question')),
+            ],
+            options={
+                'ordering': ['label'],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='question',
+            constraint=models.UniqueConstraint(fields=('lesson', 'position'), name='unique_question_position'),
+        ),
+        migrations.AddConstraint(
+            model_name='option',
+            constraint=models.UniqueConstraint(fields=('question', 'label'), name='unique_option_label'),
+        ),
+        migrations.RunPython(parse_existing_quizzes, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,38 @@
+# Generated by Django 5.2.5 on 2026-10-17 02:14
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+def fill_slide_count(apps, schema_editor):
+    Lesson = apps.get_model("activities", "Lesson")
+    batch = []
+    for lesson in Lesson.objects.only("id", "topic").iterator(chunk_size=500):
+        lesson.slide_count = len(lesson.topic) if isinstance(lesson.topic, list) else 0
+        batch.append(lesson)
+        if len(batch) >= 500:
+            Lesson.objects.bulk_update(batch, ["slide_count"])
+            batch = []
+    if batch:
+        Lesson.objects.bulk_update(batch, ["slide_count"])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('activities', '0007_question_option'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='lesson',
+            name='slide_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddIndex(
+            model_name='lesson',
+            index=models.Index(fields=['created_by', '-created_at', '-id'], name='lesson_owner_created_idx'),
+        ),
+        migrations.RunPython(fill_slide_count, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.5 on 2026-10-17 02:15
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('activities', '0008_lesson_slide_count'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='lesson',
+            name='version',
+            field=models.PositiveIntegerField(default=1),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.5 on 2026-10-17 02:28
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('activities', '0009_lesson_version'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='lessonjob',
+            name='plan',
+            field=models.JSONField(blank=True, null=True),
+        ),
+    ]
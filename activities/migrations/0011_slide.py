@@ -0,0 +1,55 @@
+# Generated by Django 5.2.5 on 2026-10-17 02:32
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def topic_to_slides(apps, schema_editor):
+    Lesson = apps.get_model("activities", "Lesson")
+    Slide = apps.get_model("activities", "Slide")
+    batch = []
+    for lesson_id, topic in Lesson.objects.values_list("id", "topic").iterator(chunk_size=200):
+        if not isinstance(topic, list):
+            continue
+        batch.extend(Slide(lesson_id=lesson_id, position=position, text=str(text)) for position, text in enumerate(topic))
+        if len(batch) >= 1000:
+            Slide.objects.bulk_create(batch)
+            batch = []
+    if batch:
+        Slide.objects.bulk_create(batch)
+
+
+def slides_to_topic(apps, schema_editor):
+    Lesson = apps.get_model("activities", "Lesson")
+    Slide = apps.get_model("activities", "Slide")
+    for lesson in Lesson.objects.only("id").iterator(chunk_size=200):
+        topic = list(Slide.objects.filter(lesson_id=lesson.pk).order_by("position").values_list("text", flat=True))
+        Lesson.objects.filter(pk=lesson.pk).update(topic=topic)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('activities', '0010_lessonjob_plan'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Slide',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('position', models.PositiveIntegerField()),
+                ('text', models.TextField()),
+                ('lesson', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='slides', to='activities.lesson')),
+            ],
+            options={
+                'ordering': ['position'],
+                'constraints': [models.UniqueConstraint(fields=('lesson', 'position'), name='unique_slide_position')],
+            },
+        ),
+        migrations.RunPython(topic_to_slides, slides_to_topic),
+        migrations.RemoveField(
+            model_name='lesson',
+            name='topic',
+        ),
+    ]
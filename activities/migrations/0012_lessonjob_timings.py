@@ -0,0 +1,18 @@
+# Generated by Django 5.2.5 on 2026-10-17 03:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('activities', '0011_slide'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='lessonjob',
+            name='timings',
+            field=models.JSONField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,44 @@
+# Generated by Django 5.2.5 on 2026-10-17 02:43
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+def create_gate(apps, schema_editor):
+    """The single row the scheduler locks (activities.scheduler)."""
+    LLMGate = apps.get_model("activities", "LLMGate")
+    LLMGate.objects.get_or_create(pk=1)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('activities', '0012_lessonjob_timings'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LLMGate',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('updated_at', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='LLMTicket',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('priority', models.PositiveSmallIntegerField()),
+                ('user_id', models.IntegerField(blank=True, null=True)),
+                ('tokens', models.PositiveIntegerField()),
+                ('state', models.CharField(choices=[('waiting', 'Waiting'), ('running', 'Running'), ('done', 'Done')], default='waiting', max_length=8)),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('seen_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('admitted_at', models.DateTimeField(blank=True, null=True)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['state', 'priority', 'created_at'], name='llm_ticket_queue_idx')],
+            },
+        ),
+        migrations.RunPython(create_gate, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,74 @@
+from django.db import migrations
+
+# The index as it was when this migration was written (see activities/search.py),
+# copied here so later changes to the app don't change what the migration does
+
+POSTGRES_INDEX = [
+    "ALTER TABLE activities_slide ADD COLUMN search tsvector "
+    "GENERATED ALWAYS AS (to_tsvector('english', text)) STORED",
+    "CREATE INDEX slide_search_idx ON activities_slide USING gin (search)",
+    "ALTER TABLE activities_lesson ADD COLUMN search tsvector "
+    "GENERATED ALWAYS AS (to_tsvector('english', coalesce(title, ''))) STORED",
+    "CREATE INDEX lesson_search_idx ON activities_lesson USING gin (search)",
+]
+POSTGRES_DROP = [
+    "DROP INDEX IF EXISTS lesson_search_idx",
+    "ALTER TABLE activities_lesson DROP COLUMN IF EXISTS search",
+    "DROP INDEX IF EXISTS slide_search_idx",
+    "ALTER TABLE activities_slide DROP COLUMN IF EXISTS search",
+]
+
+# (table, indexed column)
+SQLITE_SOURCES = [("activities_slide", "text"), ("activities_lesson", "title")]
+
+
+def sqlite_triggers(table, column):
+    fts = f"{table}_fts"
+    delete = f"INSERT INTO {fts}({fts}, rowid, {column}) VALUES ('delete', old.id, old.{column});"
+    insert = f"INSERT INTO {fts}(rowid, {column}) VALUES (new.id, new.{column});"
+    return [
+        f"CREATE TRIGGER IF NOT EXISTS {fts}_insert AFTER INSERT ON {table} BEGIN {insert} END",
+        f"CREATE TRIGGER IF NOT EXISTS {fts}_delete AFTER DELETE ON {table} BEGIN {delete} END",
+        f"CREATE TRIGGER IF NOT EXISTS {fts}_update AFTER UPDATE OF {column} ON {table} BEGIN {delete} {insert} END",
+    ]
+
+
+def create_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == "postgresql":
+        for sql in POSTGRES_INDEX:
+            schema_editor.execute(sql)
+    elif vendor == "sqlite":
+        for table, column in SQLITE_SOURCES:
+            fts = f"{table}_fts"
+            schema_editor.execute(
+                f"CREATE VIRTUAL TABLE {fts} USING fts5({column}, content='{table}', content_rowid='id', "
+                f"tokenize='porter unicode61')"
+            )
+            schema_editor.execute(f"INSERT INTO {fts}({fts}) VALUES ('rebuild')")
+            for sql in sqlite_triggers(table, column):
+                schema_editor.execute(sql)
+
+
+def drop_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == "postgresql":
+        for sql in POSTGRES_DROP:
+            schema_editor.execute(sql)
+    elif vendor == "sqlite":
+        for table, _ in SQLITE_SOURCES:
+            fts = f"{table}_fts"
+            for suffix in ("insert", "delete", "update"):
+                schema_editor.execute(f"DROP TRIGGER IF EXISTS {fts}_{suffix}")
+            schema_editor.execute(f"DROP TABLE IF EXISTS {fts}")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('activities', '0013_llm_scheduler'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_index, drop_index),
+    ]
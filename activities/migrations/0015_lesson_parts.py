@@ -0,0 +1,36 @@
+# Generated by Django 5.2.5 on 2026-10-17 03:09
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('activities', '0014_search_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='lessonjob',
+            name='revises',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='revision_jobs', to='activities.lesson'),
+        ),
+        migrations.CreateModel(
+            name='LessonPart',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(max_length=8)),
+                ('position', models.PositiveIntegerField()),
+                ('source_hash', models.CharField(max_length=64)),
+                ('anchor', models.CharField(blank=True, default='', max_length=64)),
+                ('units', models.PositiveIntegerField(default=0)),
+                ('output', models.TextField()),
+                ('lesson', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='parts', to='activities.lesson')),
+            ],
+            options={
+                'ordering': ['kind', 'position'],
+                'constraints': [models.UniqueConstraint(fields=('lesson', 'kind', 'position'), name='unique_lesson_part_position')],
+            },
+        ),
+    ]
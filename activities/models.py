@@ -1,12 +1,283 @@
 from django.db import models
 from django.contrib.auth.models import User
+from django.utils import timezone
 
 class Lesson(models.Model):
     title = models.CharField(max_length=200, null=True, blank=True)
-    topic = models.JSONField(null=True, blank=True)   # will hold ["chunk1 explained", "chunk2 explained", ...]
     quiz = models.TextField(blank=True, null=True)
     created_at = models.DateTimeField(auto_now_add=True)
     created_by = models.ForeignKey(User, on_delete=models.CASCADE, related_name="lessons")
+    source_hash = models.CharField(max_length=64, null=True, blank=True, db_index=True)   # sha256 of the uploaded file / text
+    slide_count = models.PositiveIntegerField(default=0)   # number of slides, kept so listings don't count them
+    version = models.PositiveIntegerField(default=1)   # bumped on every update; used for ETags
+
+    class Meta:
+        indexes = [
+            # Owner-scoped listing, newest first (cursor pagination on created_at, id)
+            models.Index(fields=["created_by", "-created_at", "-id"], name="lesson_owner_created_idx"),
+        ]
+
+    def save(self, *args, **kwargs):
+        # Bumped in the database, so concurrent or stale saves never reuse a version
+        adding = self._state.adding
+        if not adding:
+            self.version = models.F("version") + 1
+        update_fields = kwargs.get("update_fields")
+        if update_fields is not None:
+            kwargs["update_fields"] = set(update_fields) | {"version"}
+        super().save(*args, **kwargs)
+        if not adding:
+            self.refresh_from_db(fields=["version"])
+
+    @property
+    def topic(self):
+        """Slide texts in order (slides used to be stored as this JSON array)."""
+        return [slide.text for slide in self.slides.all()]
 
     def __str__(self):
         return self.title
+
+
+class Slide(models.Model):
+    lesson = models.ForeignKey(Lesson, on_delete=models.CASCADE, related_name="slides")
+    position = models.PositiveIntegerField()   # 0-based, the index in the old topic array
+    text = models.TextField()
+
+    class Meta:
+        ordering = ["position"]
+        constraints = [
+            # Also the index behind ranged slide reads
+            models.UniqueConstraint(fields=["lesson", "position"], name="unique_slide_position"),
+        ]
+
+    def __str__(self):
+        return f"{self.lesson_id}:{self.position}"
+
+
+class Question(models.Model):
+    """One multiple-choice question parsed from Lesson.quiz when the lesson is generated."""
+    lesson = models.ForeignKey(Lesson, on_delete=models.CASCADE, related_name="questions")
+    position = models.PositiveIntegerField()   # 1-based order in the quiz
+    text = models.TextField()
+    correct_option = models.CharField(max_length=1)   # "A".."D"
+
+    class Meta:
+        ordering = ["position"]
+        constraints = [
+            models.UniqueConstraint(fields=["lesson", "position"], name="unique_question_position"),
+        ]
+
+    def __str__(self):
+        return self.text
+
+
+class Option(models.Model):
+    question = models.ForeignKey(Question, on_delete=models.CASCADE, related_name="options")
+    label = models.CharField(max_length=1)   # "A".."D"
+    text = models.TextField()
+    explanation = models.TextField(blank=True, default="")   # why this option is right / wrong
+
+    class Meta:
+        ordering = ["label"]
+        constraints = [
+            models.UniqueConstraint(fields=["question", "label"], name="unique_option_label"),
+        ]
+
+    def __str__(self):
+        return f"{self.label}) {self.text}"
+
+class LessonPart(models.Model):
+    """
+    Output of one LLM step of a lesson's generation, keyed by a hash of the
+    step's input, so regenerating the lesson from a revised document only
+    sends changed text to the LLM (see activities.parts).
+    """
+    KIND_SINGLE = "single"     # the whole document rewritten in one pass
+    KIND_REWRITE = "rewrite"   # one part of a multi-pass rewrite
+    KIND_MERGE = "merge"       # one normalization merge of rewritten fragments
+
+    lesson = models.ForeignKey(Lesson, on_delete=models.CASCADE, related_name="parts")
+    kind = models.CharField(max_length=8)
+    position = models.PositiveIntegerField()   # order among the lesson's parts of this kind
+    source_hash = models.CharField(max_length=64)   # sha256 of the step's input text
+    anchor = models.CharField(max_length=64, blank=True, default="")   # rewrite parts: sha256 of their first split unit
+    units = models.PositiveIntegerField(default=0)   # rewrite parts: split units they were packed from
+    output = models.TextField()
+
+    class Meta:
+        ordering = ["kind", "position"]
+        constraints = [
+            models.UniqueConstraint(fields=["lesson", "kind", "position"], name="unique_lesson_part_position"),
+        ]
+
+    def __str__(self):
+        return f"{self.lesson_id}:{self.kind}:{self.position}"
+
+
+class LessonJob(models.Model):
+    """
+    A queued lesson generation. The create endpoint stores the upload (in
+    default_storage) and returns straight away; a worker runs the pipeline and
+    links the lesson.
+    """
+    STATUS_QUEUED = "queued"
+    STATUS_RUNNING = "running"
+    STATUS_DONE = "done"
+    STATUS_FAILED = "failed"
+    STATUS_CHOICES = [
+        (STATUS_QUEUED, "Queued"),
+        (STATUS_RUNNING, "Running"),
+        (STATUS_DONE, "Done"),
+        (STATUS_FAILED, "Failed"),
+    ]
+
+    title = models.CharField(max_length=200)
+    raw_topic = models.TextField(blank=True, null=True)
+    source_name = models.CharField(max_length=255, blank=True, null=True)
+    upload = models.FileField(upload_to="lesson_uploads/", blank=True)   # deleted once the job finishes
+    source_hash = models.CharField(max_length=64, null=True, blank=True)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=STATUS_QUEUED)
+    stage = models.CharField(max_length=20, default=STATUS_QUEUED)
+    progress = models.PositiveSmallIntegerField(default=0)   # 0-100
+    error = models.TextField(blank=True, null=True)
+    plan = models.JSONField(null=True, blank=True)   # split plan: parts and estimated tokens
+    timings = models.JSONField(null=True, blank=True)   # milliseconds per stage, when METRICS_ENABLED
+    lesson = models.ForeignKey(Lesson, null=True, blank=True, on_delete=models.SET_NULL, related_name="jobs")
+    # Lesson a revised document is regenerated into, in place
+    revises = models.ForeignKey(Lesson, null=True, blank=True, on_delete=models.SET_NULL, related_name="revision_jobs")
+    created_by = models.ForeignKey(User, on_delete=models.CASCADE, related_name="lesson_jobs")
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [models.Index(fields=["status", "created_at"])]
+
+    def __str__(self):
+        return f"{self.title} ({self.status})"
+
+
+class LLMCacheEntry(models.Model):
+    """Cached LLM completion, keyed by a hash of (model, temperature, prompt)."""
+    key = models.CharField(max_length=64, primary_key=True)
+    response = models.TextField()
+    created_at = models.DateTimeField(default=timezone.now, db_index=True)
+
+    def __str__(self):
+        return self.key
+
+
+class LLMTicket(models.Model):
+    """
+    A place in the LLM admission queue shared by all worker processes
+    (see activities.scheduler). Finished tickets are kept for a minute to
+    account for the tokens-per-minute budget.
+    """
+    STATE_WAITING = "waiting"
+    STATE_RUNNING = "running"
+    STATE_DONE = "done"
+    STATE_CHOICES = [
+        (STATE_WAITING, "Waiting"),
+        (STATE_RUNNING, "Running"),
+        (STATE_DONE, "Done"),
+    ]
+
+    priority = models.PositiveSmallIntegerField()   # lower goes first
+    user_id = models.IntegerField(null=True, blank=True)   # for per-user fairness; not a key, tickets are short-lived
+    tokens = models.PositiveIntegerField()   # estimated until done, then prompt + answer
+    state = models.CharField(max_length=8, choices=STATE_CHOICES, default=STATE_WAITING)
+    created_at = models.DateTimeField(default=timezone.now)
+    seen_at = models.DateTimeField(default=timezone.now)   # last poll of the waiting caller
+    admitted_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [models.Index(fields=["state", "priority", "created_at"], name="llm_ticket_queue_idx")]
+
+    def __str__(self):
+        return f"{self.state} p{self.priority} ({self.tokens} tokens)"
+
+
+class LLMGate(models.Model):
+    """Single row locked while admission decisions are made, so workers take turns."""
+    updated_at = models.DateTimeField(default=timezone.now)
+
+
+class QuizAttempt(models.Model):
+    """One graded submission of a lesson's quiz."""
+    lesson = models.ForeignKey(Lesson, on_delete=models.CASCADE, related_name="quiz_attempts")
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name="quiz_attempts")
+    score = models.PositiveIntegerField()   # correct answers
+    total = models.PositiveIntegerField()   # questions answered
+    percentage = models.FloatField()
+    created_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        indexes = [
+            # A user's history, newest first, overall or for one lesson
+            models.Index(fields=["user", "-created_at", "-id"], name="quiz_attempt_user_idx"),
+            models.Index(fields=["user", "lesson", "-created_at", "-id"], name="quiz_attempt_user_lesson_idx"),
+        ]
+
+    def __str__(self):
+        return f"{self.user_id} on {self.lesson_id}: {self.score}/{self.total}"
+
+
+class QuizAnswer(models.Model):
+    attempt = models.ForeignKey(QuizAttempt, on_delete=models.CASCADE, related_name="answers")
+    # Null when the quiz had no stored answer key, or was regenerated since
+    question = models.ForeignKey(Question, null=True, blank=True, on_delete=models.SET_NULL, related_name="answers")
+    position = models.PositiveIntegerField()   # 1-based order in the submission
+    question_text = models.TextField(blank=True, default="")
+    user_answer = models.CharField(max_length=255, blank=True, default="")
+    correct_answer = models.CharField(max_length=255, blank=True, default="")
+    is_correct = models.BooleanField()
+
+    class Meta:
+        ordering = ["position"]
+        constraints = [
+            models.UniqueConstraint(fields=["attempt", "position"], name="unique_quiz_answer_position"),
+        ]
+
+    def __str__(self):
+        return f"{self.attempt_id}:{self.position}"
+
+
+# Running totals, updated in the same transaction as each attempt (see activities.attempts)
+
+class LessonQuizStats(models.Model):
+    lesson = models.OneToOneField(Lesson, primary_key=True, on_delete=models.CASCADE, related_name="quiz_stats")
+    attempts = models.PositiveIntegerField(default=0)
+    correct = models.PositiveIntegerField(default=0)
+    answered = models.PositiveIntegerField(default=0)
+    percentage_sum = models.FloatField(default=0)
+    best_percentage = models.FloatField(default=0)
+    last_attempt_at = models.DateTimeField(null=True, blank=True)
+
+    @property
+    def mean_percentage(self):
+        return self.percentage_sum / self.attempts if self.attempts else None
+
+
+class UserQuizStats(models.Model):
+    user = models.OneToOneField(User, primary_key=True, on_delete=models.CASCADE, related_name="quiz_stats")
+    attempts = models.PositiveIntegerField(default=0)
+    correct = models.PositiveIntegerField(default=0)
+    answered = models.PositiveIntegerField(default=0)
+    percentage_sum = models.FloatField(default=0)
+    best_percentage = models.FloatField(default=0)
+    last_attempt_at = models.DateTimeField(null=True, blank=True)
+
+    @property
+    def mean_percentage(self):
+        return self.percentage_sum / self.attempts if self.attempts else None
+
+
+class QuestionQuizStats(models.Model):
+    question = models.OneToOneField(Question, primary_key=True, on_delete=models.CASCADE, related_name="quiz_stats")
+    lesson = models.ForeignKey(Lesson, on_delete=models.CASCADE, related_name="question_stats")   # copied for per-lesson reads
+    answered = models.PositiveIntegerField(default=0)
+    missed = models.PositiveIntegerField(default=0)
+
+    @property
+    def miss_rate(self):
+        return self.missed / self.answered if self.answered else None
@@ -0,0 +1,15 @@
+from rest_framework.pagination import CursorPagination, LimitOffsetPagination
+
+
+class LessonCursorPagination(CursorPagination):
+    # Cursor (keyset) paging stays fast however deep the client pages
+    page_size = 20
+    page_size_query_param = "page_size"
+    max_page_size = 100
+    ordering = ("-created_at", "-id")
+
+
+class SlidePagination(LimitOffsetPagination):
+    # ?offset=&limit= over slide positions; max_limit bounds each response
+    default_limit = 20
+    max_limit = 100
@@ -0,0 +1,100 @@
+"""
+Per-lesson memo of generation steps, for regenerating a lesson from a revised
+document.
+
+Every generation records what its LLM steps produced (LessonPart rows): the
+rewrite of each part and each normalization merge, keyed by a hash of the
+step's input (for a part, also whether it is the first, a middle or the last
+part, which its prompt mentions). When a revised document is regenerated into the same lesson,
+the split lines its parts up with the old ones (pipeline.plan_split anchors),
+and steps whose input hasn't changed take their old output instead of an LLM
+call. The rows of the new run then replace the old ones.
+"""
+import hashlib
+
+from django.db import transaction
+
+from .models import LessonPart
+
+BULK_BATCH_SIZE = 200
+
+
+def digest(text):
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def _role(position, count):
+    """pipeline.part_role of a stored rewrite part (0-based position of `count`)."""
+    if position == 0:
+        return "first"
+    return "last" if position == count - 1 else "middle"
+
+
+def _key(kind, source_hash, role=None):
+    # A part's rewrite prompt says whether it opens, continues or closes the lesson
+    if kind == LessonPart.KIND_REWRITE:
+        return kind, source_hash, role
+    return kind, source_hash
+
+
+class PartMemo:
+    """Outputs of an earlier run by (kind, input hash), and what this run produced."""
+
+    def __init__(self, previous=()):
+        previous = list(previous)
+        rewrites = sum(1 for part in previous if part.kind == LessonPart.KIND_REWRITE)
+        self.previous = {}
+        self.anchors = {}   # first-unit hash -> [(unit count, part hash)] of earlier rewrite parts
+        for part in previous:
+            self.previous[_key(part.kind, part.source_hash, _role(part.position, rewrites))] = part.output
+            if part.kind == LessonPart.KIND_REWRITE and part.anchor:
+                self.anchors.setdefault(part.anchor, []).append((part.units, part.source_hash))
+        self.recorded = {}   # (kind, position) -> LessonPart
+        self.reused = 0
+        self.generated = 0
+        self._merges = 0
+
+    def lookup(self, kind, source_hash, role=None):
+        """
+        Earlier output for this input, or None (each answer is counted as
+        reused or generated). Rewrite parts also give their role
+        (pipeline.part_role), which their prompt depends on.
+        """
+        output = self.previous.get(_key(kind, source_hash, role))
+        if output is None:
+            self.generated += 1
+        else:
+            self.reused += 1
+        return output
+
+    def record(self, kind, position, source_hash, output, anchor="", units=0):
+        if kind == LessonPart.KIND_MERGE:
+            position, self._merges = self._merges, self._merges + 1
+        self.recorded[(kind, position)] = LessonPart(
+            kind=kind, position=position, source_hash=source_hash, output=output, anchor=anchor, units=units,
+        )
+
+
+def load_memo(lesson):
+    return PartMemo(lesson.parts.only("kind", "source_hash", "anchor", "units", "output"))
+
+
+def save_parts(lesson, memo):
+    """Replace the stored parts of `lesson` with the ones recorded in `memo`."""
+    with transaction.atomic():
+        LessonPart.objects.filter(lesson=lesson).delete()
+        rows = [part for _, part in sorted(memo.recorded.items(), key=lambda item: item[0])]
+        for part in rows:
+            part.lesson = lesson
+        LessonPart.objects.bulk_create(rows, batch_size=BULK_BATCH_SIZE)
+
+
+def copy_parts(source, target):
+    """Copy the stored parts of one lesson onto another."""
+    LessonPart.objects.bulk_create(
+        (LessonPart(lesson=target, kind=kind, position=position, source_hash=source_hash,
+                    anchor=anchor, units=units, output=output)
+         for kind, position, source_hash, anchor, units, output in source.parts.values_list(
+             "kind", "position", "source_hash", "anchor", "units", "output").iterator()),
+        batch_size=BULK_BATCH_SIZE,
+    )
@@ -0,0 +1,101 @@
+"""
+Page-by-page PDF text extraction.
+
+Kept free of Django imports so page ranges can be extracted in spawned
+worker processes.
+"""
+import logging
+import multiprocessing
+import os
+import signal
+import threading
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+import PyPDF2
+
+logger = logging.getLogger(__name__)
+
+
+class PageTimeout(Exception):
+    pass
+
+
+def _raise_timeout(signum, frame):
+    raise PageTimeout()
+
+
+def extract_page(page, time_limit=None, max_chars=None):
+    """
+    Text of one page; a page that takes longer than `time_limit` seconds is
+    skipped and text beyond `max_chars` is dropped.
+
+    The limit is checked between the page's content-stream operators, so it
+    holds on any thread. On a main thread (e.g. in a worker process) an alarm
+    also interrupts a page stuck before its operators are read.
+    """
+    check = None
+    use_alarm = False
+    if time_limit:
+        deadline = time.monotonic() + time_limit
+
+        def check(*args):
+            if time.monotonic() > deadline:
+                raise PageTimeout()
+
+        use_alarm = hasattr(signal, "SIGALRM") and threading.current_thread() is threading.main_thread()
+    if use_alarm:
+        previous = signal.signal(signal.SIGALRM, _raise_timeout)
+        signal.setitimer(signal.ITIMER_REAL, time_limit)
+    try:
+        text = page.extract_text(visitor_operand_before=check) or ""
+    except PageTimeout:
+        logger.warning("Skipped a PDF page that took longer than %ss to extract", time_limit)
+        text = ""
+    finally:
+        if use_alarm:
+            signal.setitimer(signal.ITIMER_REAL, 0)
+            signal.signal(signal.SIGALRM, previous)
+    if max_chars and len(text) > max_chars:
+        text = text[:max_chars]
+    return text
+
+
+def extract_range(path, start, stop, time_limit=None, max_chars=None):
+    reader = PyPDF2.PdfReader(path)
+    return [extract_page(reader.pages[i], time_limit, max_chars) for i in range(start, stop)]
+
+
+def iter_pdf_pages(source, processes=0, pages_per_task=25, time_limit=None, max_chars=None):
+    """
+    Yield the non-empty text of each page in order.
+
+    `source` is a path or a binary file object. With a path and `processes` > 1,
+    page ranges are extracted in a process pool; only a few ranges are in
+    flight at once so memory stays bounded.
+    """
+    reader = PyPDF2.PdfReader(source)
+    page_count = len(reader.pages)
+    is_path = isinstance(source, (str, os.PathLike))
+
+    if processes <= 1 or not is_path or page_count <= pages_per_task:
+        for page in reader.pages:
+            text = extract_page(page, time_limit, max_chars)
+            if text:
+                yield text
+        return
+
+    del reader
+    ranges = deque((start, min(start + pages_per_task, page_count)) for start in range(0, page_count, pages_per_task))
+    # spawn: the caller may be a threaded web/worker process where fork is unsafe
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=processes, mp_context=context) as pool:
+        in_flight = deque()
+        while ranges or in_flight:
+            while ranges and len(in_flight) < processes * 2:
+                start, stop = ranges.popleft()
+                in_flight.append(pool.submit(extract_range, source, start, stop, time_limit, max_chars))
+            for text in in_flight.popleft().result():
+                if text:
+                    yield text
@@ -0,0 +1,799 @@
+import asyncio
+import itertools
+import logging
+import os
+import re
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import transaction
+
+from . import metrics
+from .ai_service import acall_ai, astream_ai, worth_retrying
+from .models import Lesson, LessonPart
+from .parts import PartMemo, copy_parts, digest, load_memo, save_parts
+from .pdf_extract import iter_pdf_pages
+from .pptx_extract import iter_pptx_slides
+from .quiz import copy_questions, explain_options, parse_quiz, replace_questions, save_questions
+from .slides import copy_slides, save_slides, sync_slides
+from .tokens import get_estimator, merge_budget, part_budget
+from .utils import ChunkStream, chunk_text, gather_bounded
+
+# Fixed per-pass character limit of split_for_model. Generation now sizes parts
+# by token budget (plan_split); this stays as the baseline for bench_splitter.
+PER_PASS_LIMIT = 12000
+
+# Characters per slide
+SLIDE_LENGTH = 400
+
+logger = logging.getLogger(__name__)
+
+SUPPORTED_EXTENSIONS = [".pdf", ".pptx", ".ppt"]
+
+PARAGRAPH_BREAK = re.compile(r'\n{2,}|\r\n{2,}')
+
+
+def iter_pages_from_pdf(source):
+    return iter_pdf_pages(
+        source,
+        processes=settings.PDF_EXTRACT_PROCESSES,
+        pages_per_task=settings.PDF_PAGES_PER_TASK,
+        time_limit=settings.PDF_PAGE_TIME_LIMIT,
+        max_chars=settings.PDF_MAX_PAGE_CHARS,
+    )
+
+
+def iter_slides_from_pptx(source):
+    return iter_pptx_slides(source, include_notes=settings.PPTX_INCLUDE_NOTES)
+
+
+def extract_pages(file_name, source):
+    """
+    Iterate over the text of an uploaded document, page by page where the format
+    allows it. `source` is a path or binary file object. Callers validate the
+    extension against SUPPORTED_EXTENSIONS before queuing the job.
+
+    Decks come one block per slide, each ending in a blank line, so the
+    splitter packs whole slides into a part.
+    """
+    ext = os.path.splitext(file_name)[1].lower()
+    if ext == ".pdf":
+        return iter_pages_from_pdf(source)
+    return iter_slides_from_pptx(source)
+
+
+def _iter_paragraphs(pages):
+    """
+    Paragraphs of the pages as if they had been joined with a single space,
+    without building the joined string.
+    """
+    carry = None
+    for page in pages:
+        pieces = PARAGRAPH_BREAK.split(page)
+        if carry is not None:
+            pieces[0] = carry + " " + pieces[0]
+        yield from pieces[:-1]
+        carry = pieces[-1]
+    if carry is not None:
+        yield carry
+
+
+def split_for_model(content, max_chars: int):
+    """
+    Split content into chunks <= max_chars trying to respect paragraph boundaries.
+
+    `content` is a string or an iterable of page strings; pages are consumed
+    lazily and behave as if joined with a single space. Returns [] when there is
+    no text at all.
+    """
+    pages = iter([content] if isinstance(content, str) else content)
+
+    # Short documents are sent whole, exactly as extracted
+    head = []
+    head_len = 0
+    for page in pages:
+        head.append(page)
+        head_len += len(page) + 1
+        if head_len > max_chars + 1 and len(" ".join(head).strip()) > max_chars:
+            break
+    else:
+        text = " ".join(head).strip()
+        return [text] if text else []
+
+    chunks = []
+    current = []
+    current_len = 0
+    for p in _iter_paragraphs(itertools.chain(head, pages)):
+        p = p.strip()
+        if not p:
+            continue
+        # +2 for the blank line joiner
+        add_len = len(p) + 2
+        if current_len + add_len > max_chars and current:
+            chunks.append("\n\n".join(current))
+            current = [p]
+            current_len = len(p)
+        else:
+            current.append(p)
+            current_len += add_len
+    if current:
+        chunks.append("\n\n".join(current))
+    # Final safety split (hard cut) if any residual > max_chars
+    fixed = []
+    for c in chunks:
+        if len(c) <= max_chars:
+            fixed.append(c)
+        else:
+            for i in range(0, len(c), max_chars):
+                fixed.append(c[i:i+max_chars])
+    return fixed
+
+
+_SENTENCE_BREAK = re.compile(r"(?<=[.!?])\s+|(?<=[.!?][\"')\]])\s+")
+
+
+class SplitPlan:
+    """
+    The parts chosen for a document, with estimated input tokens per part and,
+    for documents split into several parts, each part's (first unit hash,
+    unit count) so a later revision can be lined up with it.
+    """
+
+    def __init__(self, model, budget, parts, tokens, units=None, reused=0):
+        self.model = model
+        self.budget = budget
+        self.parts = parts
+        self.tokens = tokens
+        self.units = units or [("", 0)] * len(parts)
+        self.reused = reused   # parts that reproduce a part of the previous version
+
+    def as_dict(self):
+        data = {
+            "model": self.model,
+            "budget_tokens": self.budget,
+            "parts": len(self.parts),
+            "part_tokens": self.tokens,
+            "total_tokens": sum(self.tokens),
+        }
+        if self.reused:
+            data["unchanged_parts"] = self.reused
+        return data
+
+
+def _units(paragraph, budget, estimate):
+    """
+    (text, tokens, joiner) pieces of a paragraph no larger than `budget`:
+    the whole paragraph when it fits, else runs of whole sentences, and only
+    for a sentence that is itself too long, runs of words.
+    """
+    tokens = estimate(paragraph)
+    if tokens <= budget:
+        yield paragraph, tokens, "\n\n"
+        return
+    joiner = "\n\n"
+    for sentence in _SENTENCE_BREAK.split(paragraph):
+        tokens = estimate(sentence)
+        if tokens <= budget:
+            yield sentence, tokens, joiner
+        else:
+            run, run_tokens = [], 0
+            for word in sentence.split():
+                word_tokens = estimate(word) + 1
+                if run and run_tokens + word_tokens > budget:
+                    yield " ".join(run), run_tokens, joiner
+                    joiner = " "
+                    run, run_tokens = [], 0
+                run.append(word)
+                run_tokens += word_tokens
+            if run:
+                yield " ".join(run), run_tokens, joiner
+        joiner = " "
+
+
+def _split_units(pages, budget, estimate):
+    for paragraph in _iter_paragraphs(pages):
+        paragraph = paragraph.strip()
+        if paragraph:
+            yield from _units(paragraph, budget, estimate)
+
+
+def _join_units(units):
+    """Text and tokens of a part made of `units` (each joiner counts one token)."""
+    text = units[0][0] + "".join(joiner + text for text, _, joiner in units[1:])
+    return text, sum(tokens for _, tokens, _ in units) + len(units) - 1
+
+
+def _pack(units, budget):
+    """Greedily pack units into runs that fit the budget."""
+    current, current_tokens = [], 0
+    for unit in units:
+        tokens = unit[1] + (1 if current else 0)
+        if current and current_tokens + tokens > budget:
+            yield current
+            current, current_tokens = [], 0
+            tokens = unit[1]
+        current.append(unit)
+        current_tokens += tokens
+    if current:
+        yield current
+
+
+def _align(units, budget, anchors):
+    """
+    Runs of units: wherever the units reproduce a part of the previous version
+    (found by its first unit's hash, then checked whole), that part again;
+    the units in between are packed afresh. Returns (runs, reused count).
+    """
+    runs, pending, reused = [], [], 0
+    i = 0
+    while i < len(units):
+        match = 0
+        for count, source_hash in anchors.get(digest(units[i][0]), ()):
+            if i + count <= len(units) and digest(_join_units(units[i:i + count])[0]) == source_hash:
+                match = count
+                break
+        if not match:
+            pending.append(units[i])
+            i += 1
+            continue
+        runs.extend(_pack(pending, budget))
+        pending = []
+        runs.append(units[i:i + match])
+        reused += 1
+        i += match
+    runs.extend(_pack(pending, budget))
+    return runs, reused
+
+
+def plan_split(content, model=None, anchors=None):
+    """
+    Split content (a string or an iterable of pages) into as few rewrite
+    parts as the model's token budget allows and return a SplitPlan.
+
+    A document that fits the budget from tokens.part_budget is sent whole;
+    longer ones are cut into parts of up to that size (normalize_tree joins
+    them with merges that fit the model however large the parts are).
+    Paragraphs are packed greedily; a paragraph is only split between
+    sentences, and a sentence only between words, when it doesn't fit a part
+    on its own.
+
+    `anchors` (PartMemo.anchors of the previous version of the lesson) keeps
+    the parts of unchanged stretches of a revised document exactly as they
+    were, so an edit changes the parts around it and not every part after it.
+    """
+    estimate = get_estimator()
+    model = model or settings.LLM_MODEL
+    prompt_tokens = max(estimate(build_single_prompt("")), *(estimate(build_part_prompt("", r)) for r in PART_ROLES))
+    budget = part_budget(prompt_tokens, model)
+    pages = iter([content] if isinstance(content, str) else content)
+
+    # Short documents are sent whole, exactly as extracted
+    head = []
+    head_tokens = 0
+    for page in pages:
+        head.append(page)
+        head_tokens += estimate(page)
+        if head_tokens > budget:
+            break
+    else:
+        text = " ".join(head).strip()
+        if not text:
+            return SplitPlan(model, budget, [], [])
+        return SplitPlan(model, budget, [text], [estimate(text)])
+
+    units = _split_units(itertools.chain(head, pages), budget, estimate)
+    reused = 0
+    if anchors:
+        runs, reused = _align(list(units), budget, anchors)
+    else:
+        runs = _pack(units, budget)
+    parts, part_tokens, part_units = [], [], []
+    for run in runs:
+        text, tokens = _join_units(run)
+        parts.append(text)
+        part_tokens.append(tokens)
+        part_units.append((digest(run[0][0]), len(run)))
+    return SplitPlan(model, budget, parts, part_tokens, part_units, reused)
+
+
+async def _noop_report(stage, progress, **details):
+    pass
+
+
+async def _complete(prompt, on_slide=None):
+    """
+    Completion text for `prompt`. With `on_slide`, the answer is streamed and
+    `await on_slide(text)` is called for each slide as soon as it is final.
+    """
+    if on_slide is None:
+        return (await acall_ai(prompt)).strip()
+    slides = ChunkStream(max_length=SLIDE_LENGTH, batch_size=16)
+    pieces = []
+    async for piece in astream_ai(prompt):
+        pieces.append(piece)
+        for slide in slides.feed(piece):
+            await on_slide(slide)
+    for slide in slides.close():
+        await on_slide(slide)
+    return "".join(pieces).strip()
+
+
+def build_single_prompt(text):
+    # Single pass (original flow)
+    return f"""
+You are an expert educator. Rewrite the following lesson in clear, simple English suitable for students.
+
+Requirements:
+- Preserve logical structure (keep/normalize headings).
+- Break long paragraphs into smaller ones (2–4 sentences each).
+- Keep key scientific / technical terms but add a short parenthetical explanation the first time they appear.
+- Neutral, encouraging tone.
+- Keep essential definitions and relationships.
+- Do NOT omit important concepts.
+- Return ONLY the rewritten lesson text (no extra commentary, no concluding summary section).
+
+Original Lesson:
+{text}
+"""
+
+
+async def rewrite_single(text, on_slide=None):
+    return await _complete(build_single_prompt(text), on_slide)
+
+
+PART_ROLES = ("first", "middle", "last")
+
+
+def part_role(idx, total_parts):
+    """Where 1-based part `idx` of a multi-part rewrite sits: "first", "middle" or "last"."""
+    if idx == 1:
+        return "first"
+    return "last" if idx == total_parts else "middle"
+
+
+def build_part_prompt(part, role):
+    # Only the role is mentioned, so a part's rewrite doesn't depend on how many parts there are
+    if role == "first":
+        role_instructions = "This is the first part of the lesson. More parts will follow."
+        intro_rule = "Do NOT write an overall introduction or conclusion."
+    elif role == "last":
+        role_instructions = "This is the final part of the lesson."
+        intro_rule = "Do NOT add a final conclusion or summary; just rewrite this part."
+    else:
+        role_instructions = "This is a middle part of the lesson."
+        intro_rule = "Do NOT add an introduction or conclusion; continue seamlessly."
+
+    return f"""
+You are an expert educator rewriting a large lesson in sequential parts.
+
+{role_instructions}
+
+Guidelines:
+- Preserve existing logical/heading structure (adjust numbering if needed).
+- Break long paragraphs (2–4 sentences).
+- First occurrence of key technical terms: add short parenthetical explanation.
+- Keep definitions, relationships, and important concepts.
+- Maintain neutral, encouraging tone.
+- {intro_rule}
+- Do NOT reference other parts explicitly.
+- Return ONLY rewritten content of this part (no extra commentary).
+
+Original Part Text:
+{part}
+"""
+
+
+async def rewrite_part(part, role):
+    return (await acall_ai(build_part_prompt(part, role))).strip()
+
+
+# Seams of one merge call are numbered in the prompt and the answer with this marker line
+MERGE_MARKER = "=== Seam {} ==="
+_MERGE_MARKER = re.compile(r"^=== Seam (\d+) ===[ \t]*$", re.MULTILINE)
+_SEAM_LABELS = ("[End of one section]", "[Start of the next section]")
+_EARLIER_HEADINGS = "Earlier headings:"
+
+
+def build_merge_prompt(seams):
+    """`seams` are (earlier headings, end of one section, start of the next) triples."""
+    blocks = [
+        f"{MERGE_MARKER.format(number)}\n\n{_EARLIER_HEADINGS} {'; '.join(headings) or '(none)'}\n\n"
+        f"{_SEAM_LABELS[0]}\n\n{end}\n\n{_SEAM_LABELS[1]}\n\n{start}"
+        for number, (headings, end, start) in enumerate(seams, start=1)
+    ]
+    joined = "\n\n".join(blocks)
+    return f"""
+You are an expert editor joining a lesson whose sections were rewritten separately.
+
+Task:
+Each seam below is the end of one section followed by the start of the next.
+Rewrite every seam as one continuous passage.
+
+Rules:
+- Remove duplicate introductions, and any heading that repeats one of the seam's earlier headings.
+- Smooth the transition between the two sections; leave the rest of the text as it is.
+- Preserve all concepts.
+- Keep parenthetical explanations already present.
+- Do NOT add a concluding summary section.
+- Return ONLY the rewritten seams, in order, each under its marker line exactly as given
+  (e.g. {MERGE_MARKER.format(1)}), without the bracketed labels or the earlier headings.
+
+{joined}
+"""
+
+
+def _paragraphs(text):
+    return [p.strip() for p in PARAGRAPH_BREAK.split(text) if p.strip()]
+
+
+def parse_merge(answer, count):
+    """
+    Paragraphs of each of the `count` rewritten seams in a merge answer, or
+    None when it doesn't have exactly those seams. A single seam may come back
+    without its marker.
+    """
+    pieces = _MERGE_MARKER.split(answer)
+    numbers, texts = pieces[1::2], pieces[2::2]
+    if not numbers and count == 1:
+        texts = [answer]
+    elif numbers != [str(n) for n in range(1, count + 1)]:
+        return None
+    return [
+        [p for p in _paragraphs(text) if p not in _SEAM_LABELS and not p.startswith(_EARLIER_HEADINGS)]
+        for text in texts
+    ]
+
+
+def _heading(paragraph):
+    """The paragraph's first line if it looks like a heading, else None."""
+    line = paragraph.split("\n", 1)[0].strip()
+    if line.startswith("#"):
+        return line.lstrip("#").strip() or None
+    if len(line) <= 60 and line[-1] not in ".?!,;:" and not line.startswith(("-", "*", "•")):
+        return line
+    return None
+
+
+def _edge(paragraphs, budget, estimate):
+    """How many of `paragraphs`, from the start, fit `budget` tokens together."""
+    count, tokens = 0, 0
+    for paragraph in paragraphs:
+        tokens += estimate(paragraph) + 1
+        if tokens > budget:
+            break
+        count += 1
+    return count
+
+
+class _Seams:
+    """
+    A lesson rewritten in parts, as the paragraphs of each part and the seams
+    between neighbouring parts. The paragraphs at the end of part i and the
+    start of part i + 1 that fit a window belong to seam i, which a merge
+    rewrites as one passage; the rest of each part is final as rewritten.
+    """
+
+    def __init__(self, parts, window, estimate):
+        self.parts = [_paragraphs(part) for part in parts]
+        last = len(self.parts) - 1
+        self.heads, self.tails = [], []
+        for i, paragraphs in enumerate(self.parts):
+            # A part of several paragraphs keeps at least one for the seam after it
+            head = _edge(paragraphs[:max(1, len(paragraphs) - 1)], window, estimate) if 0 < i < last else 0
+            if i == last and i > 0:
+                head = _edge(paragraphs, window, estimate)
+            tail = _edge(paragraphs[head:][::-1], window, estimate) if i < last else 0
+            self.heads.append(head)
+            self.tails.append(tail)
+        self.merged = [None] * last   # rewritten paragraphs of each seam
+
+    def body(self, i):
+        return self.parts[i][self.heads[i]:len(self.parts[i]) - self.tails[i]]
+
+    def seam(self, i):
+        """(end of part i, start of part i + 1), as merged or else as rewritten."""
+        return self.parts[i][len(self.parts[i]) - self.tails[i]:], self.parts[i + 1][:self.heads[i + 1]]
+
+    def pieces(self):
+        """Paragraph lists in lesson order, None for a seam not merged yet."""
+        for i in range(len(self.parts)):
+            yield self.body(i)
+            if i < len(self.merged):
+                yield self.merged[i]
+
+    def span(self, first, last):
+        """Paragraphs of parts first..last with the seams between them merged."""
+        paragraphs = self.parts[first][:self.heads[first]]
+        for i in range(first, last + 1):
+            paragraphs = paragraphs + self.body(i)
+            if i < last:
+                paragraphs = paragraphs + self.merged[i]
+        return paragraphs + self.parts[last][len(self.parts[last]) - self.tails[last]:]
+
+
+def _outline(headings, budget, estimate):
+    """The last distinct headings that fit `budget` tokens, in order."""
+    kept, tokens = [], 0
+    for heading in reversed(list(dict.fromkeys(headings))):
+        tokens += estimate(heading) + 1
+        if tokens > budget:
+            break
+        kept.append(heading)
+    return kept[::-1]
+
+
+async def _emit_slides(text, on_slide):
+    for slide in chunk_text(text, max_length=SLIDE_LENGTH):
+        await on_slide(slide)
+
+
+async def normalize_tree(simplified_parts, on_slide=None, report=_noop_report, memo=None):
+    """
+    Join rewritten parts into one lesson with merges that stay within
+    tokens.merge_budget however long the parts are: a merge rewrites only the
+    seams between neighbouring parts (the end of one and the start of the
+    next) and is told the headings used before each seam, so it can drop
+    repeated headings and introductions and smooth the transition.
+
+    Seams are merged level by level, the groups of a level in parallel: first
+    between the parts of each group of LESSON_NORMALIZE_FAN_IN, then between
+    those groups, and so on, so a higher level sees the headings of the
+    already merged text on its left. With `on_slide`, slides are emitted in
+    lesson order as soon as the merges before them have completed.
+
+    With `memo`, a seam merged the same way before takes the earlier result.
+    """
+    estimate = get_estimator()
+    fan_in = max(2, settings.LESSON_NORMALIZE_FAN_IN)
+    # Each of a call's seams gets an equal share: 3/4 for its text, 1/4 for its headings
+    share = merge_budget(estimate(build_merge_prompt([]))) // (fan_in - 1)
+    seams = _Seams(simplified_parts, max(1, share * 3 // 8), estimate)
+
+    slides = ChunkStream(max_length=SLIDE_LENGTH, batch_size=16)
+    emitted, started = 0, False
+    emitting = asyncio.Lock()
+
+    async def emit_ready():
+        nonlocal emitted, started
+        if on_slide is None:
+            return
+        async with emitting:
+            for paragraphs in itertools.islice(seams.pieces(), emitted, None):
+                if paragraphs is None:
+                    break
+                for paragraph in paragraphs:
+                    for slide in slides.feed(("\n\n" if started else "") + paragraph):
+                        await on_slide(slide)
+                    started = True
+                emitted += 1
+
+    async def merge(pending):
+        prompt = build_merge_prompt([
+            (headings, "\n\n".join(end), "\n\n".join(start)) for _, _, headings, end, start in pending
+        ])
+        merged = parse_merge(await acall_ai(prompt), len(pending))
+        if merged is None:
+            logger.warning("Malformed merge answer for %s seams; keeping them unmerged", len(pending))
+            merged = [end + start for _, _, _, end, start in pending]
+        for (i, key, *_), paragraphs in zip(pending, merged):
+            seams.merged[i] = paragraphs
+            if memo is not None and key is not None:
+                memo.record(LessonPart.KIND_MERGE, None, key, "\n\n".join(paragraphs))
+        await emit_ready()
+
+    await emit_ready()
+    nodes = [(i, i) for i in range(len(seams.parts))]   # (first part, last part)
+    level = 0
+    while len(nodes) > 1:
+        groups = [nodes[k:k + fan_in] for k in range(0, len(nodes), fan_in)]
+        calls = []
+        for group in groups:
+            pending, headings = [], []
+            for (first, last), _ in zip(group, group[1:]):
+                headings += filter(None, map(_heading, seams.span(first, last)))
+                end, start = seams.seam(last)
+                outline = _outline(headings, share // 4, estimate)
+                if not start:
+                    seams.merged[last] = end
+                    continue
+                key = digest("\n\n".join(["; ".join(outline), *end, *start])) if memo is not None else None
+                output = memo.lookup(LessonPart.KIND_MERGE, key) if memo is not None else None
+                if output is not None:
+                    seams.merged[last] = _paragraphs(output)
+                    memo.record(LessonPart.KIND_MERGE, None, key, output)
+                    continue
+                pending.append((last, key, outline, end, start))
+            if pending:
+                calls.append(pending)
+
+        level += 1
+        await report("normalize", min(79, 70 + 3 * level))
+        logger.info("Normalization level %s: %s fragments in %s groups, %s merge calls",
+                    level, len(nodes), len(groups), len(calls))
+        await emit_ready()
+        await gather_bounded(
+            merge, calls,
+            max_workers=settings.LESSON_REWRITE_CONCURRENCY,
+            retries=settings.LESSON_REWRITE_RETRIES,
+            retry_if=worth_retrying,
+        )
+        nodes = [(group[0][0], group[-1][1]) for group in groups]
+
+    await emit_ready()
+    if on_slide is not None:
+        for slide in slides.close():
+            await on_slide(slide)
+    return "\n\n".join(itertools.chain.from_iterable(seams.pieces()))
+
+
+async def generate_quiz(explained_full):
+    # Generate quiz from unified simplified lesson
+    quiz_prompt = f"""
+Create a comprehensive multiple-choice quiz that tests deep understanding of the lesson below.
+
+Requirements:
+- 12–20 questions.
+- Each question has 4 options labeled A, B, C, D.
+- After each question (or its options), clearly mark the correct option using: Correct: B
+- Mix question types: definition, application, scenario, cause-effect, comparison.
+- Avoid trivial recall; emphasize reasoning.
+- Do not repeat wording verbatim.
+- Keep formatting clean and consistent.
+
+Lesson:
+{explained_full}
+"""
+    return (await acall_ai(quiz_prompt)).strip()
+
+
+def _save_lesson(title, slides, quiz, parsed_quiz, explanations, source_hash, user, memo):
+    with transaction.atomic():
+        lesson = Lesson.objects.create(
+            title=title,
+            quiz=quiz,
+            source_hash=source_hash,
+            slide_count=len(slides),
+            created_by=user,
+        )
+        save_slides(lesson, slides)
+        save_questions(lesson, parsed_quiz, explanations)
+        save_parts(lesson, memo)
+    return lesson
+
+
+def _update_lesson(lesson, title, slides, quiz, parsed_quiz, explanations, source_hash, memo):
+    """Regenerated content into an existing lesson; `parsed_quiz` None keeps its questions."""
+    with transaction.atomic():
+        lesson.title = title
+        lesson.source_hash = source_hash
+        lesson.slide_count = len(slides)
+        fields = ["title", "source_hash", "slide_count"]
+        if parsed_quiz is not None:
+            lesson.quiz = quiz
+            fields.append("quiz")
+        lesson.save(update_fields=fields)
+        sync_slides(lesson, slides)
+        if parsed_quiz is not None:
+            replace_questions(lesson, parsed_quiz, explanations)
+        save_parts(lesson, memo)
+    return lesson
+
+
+async def generate_lesson(title, content, user, report=_noop_report, source_hash=None, on_slide=None, lesson=None):
+    """
+    Run the full generation pipeline (split -> rewrite -> normalize -> quiz -> save)
+    over extracted content (a string or an iterable of pages) and return the saved Lesson.
+
+    LLM calls go through the async client so parts can be in flight together;
+    extraction/splitting and database writes run in worker threads.
+    `await report(stage, progress)` is called as the pipeline advances; progress is 0-100.
+    The "plan" stage also passes `plan` (see SplitPlan.as_dict).
+    With `on_slide`, the final lesson text is streamed and `await on_slide(text)`
+    gets each slide while it is still being written (the saved slides are the same).
+
+    With `lesson`, the content is a revision of that lesson's document: steps
+    whose input is unchanged reuse the lesson's stored outputs (see
+    activities.parts), the quiz is only regenerated if the lesson text
+    changed, and the lesson is updated in place.
+    """
+    memo = PartMemo() if lesson is None else await sync_to_async(load_memo)(lesson)
+
+    await report("split", 10)
+    # Pages are read lazily, so this includes extracting the uploaded document
+    with metrics.timer("split"):
+        plan = await sync_to_async(plan_split, thread_sensitive=False)(content, anchors=memo.anchors)
+    logger.info("Split plan for %r: %s", title, plan.as_dict())
+    parts = plan.parts
+    if not parts:
+        raise ValueError("Empty content")
+    await report("plan", 15, plan=plan.as_dict())
+    total_parts = len(parts)
+
+    if total_parts == 1:
+        await report("rewrite", 20)
+        key = digest(parts[0])
+        with metrics.timer("rewrite"):
+            explained_full = memo.lookup(LessonPart.KIND_SINGLE, key)
+            if explained_full is None:
+                explained_full = await rewrite_single(parts[0], on_slide)
+            elif on_slide is not None:
+                await _emit_slides(explained_full, on_slide)
+        memo.record(LessonPart.KIND_SINGLE, 0, key, explained_full)
+    else:
+        async def rewrite(numbered):
+            idx, part = numbered
+            key = digest(part)
+            role = part_role(idx, total_parts)
+            output = memo.lookup(LessonPart.KIND_REWRITE, key, role)
+            if output is None:
+                output = await rewrite_part(part, role)
+            anchor, units = plan.units[idx - 1]
+            memo.record(LessonPart.KIND_REWRITE, idx - 1, key, output, anchor, units)
+            return output
+
+        # Multi-pass: parts are independent until normalization, so rewrite them
+        # concurrently; gather_bounded keeps the original part order.
+        await report("rewrite", 20)
+        with metrics.timer("rewrite"):
+            simplified_parts = await gather_bounded(
+                rewrite,
+                enumerate(parts, start=1),
+                max_workers=settings.LESSON_REWRITE_CONCURRENCY,
+                retries=settings.LESSON_REWRITE_RETRIES,
+                retry_if=worth_retrying,
+                on_done=lambda done: report("rewrite", 20 + (50 * done) // total_parts),
+            )
+        await report("normalize", 70)
+        with metrics.timer("normalize"):
+            explained_full = await normalize_tree(simplified_parts, on_slide, report, memo)
+
+    # Chunk final simplified lesson for slides
+    slides = chunk_text(explained_full, max_length=SLIDE_LENGTH) or [explained_full]
+
+    if lesson is not None and not memo.generated:
+        # Nothing was rewritten, so the lesson text and its quiz are as they were
+        logger.info("Revision of lesson %s reused every step", lesson.pk)
+        await report("save", 95)
+        with metrics.timer("save"):
+            return await sync_to_async(_update_lesson)(lesson, title, slides, None, None, None, source_hash, memo)
+
+    await report("quiz", 80)
+    with metrics.timer("quiz"):
+        quiz = await generate_quiz(explained_full)
+
+    # Answer keys and per-option explanations, so grading needs no LLM call
+    await report("explain", 88)
+    parsed_quiz = parse_quiz(quiz)
+    try:
+        with metrics.timer("explain"):
+            explanations = await explain_options(parsed_quiz, explained_full)
+    except Exception:
+        logger.exception("Option explanations failed for lesson %r", title)
+        explanations = {}
+
+    await report("save", 95)
+    with metrics.timer("save"):
+        if lesson is not None:
+            logger.info("Revision of lesson %s: %s steps reused, %s regenerated", lesson.pk, memo.reused, memo.generated)
+            return await sync_to_async(_update_lesson)(
+                lesson, title, slides, quiz, parsed_quiz, explanations, source_hash, memo,
+            )
+        return await sync_to_async(_save_lesson)(
+            title, slides, quiz, parsed_quiz, explanations, source_hash, user, memo,
+        )
+
+
+def clone_lesson(source, title, user):
+    """New lesson for `user` with the generated content of `source`."""
+    with transaction.atomic():
+        lesson = Lesson.objects.create(
+            title=title,
+            quiz=source.quiz,
+            source_hash=source.source_hash,
+            slide_count=source.slide_count,
+            created_by=user,
+        )
+        copy_slides(source, lesson)
+        copy_questions(source, lesson)
+        copy_parts(source, lesson)
+    return lesson
@@ -0,0 +1,82 @@
+"""
+Slide-by-slide PowerPoint text extraction.
+
+Each slide becomes one block: its title, then the text of every other shape,
+descending into groups and tables, then the speaker notes. Blank lines inside
+a slide are dropped so that the only paragraph breaks the splitter sees are
+between slides.
+"""
+import re
+
+from pptx import Presentation
+from pptx.enum.shapes import MSO_SHAPE_TYPE, PP_PLACEHOLDER
+
+_SPACES = re.compile(r"[ \t\u00a0]+")
+_TITLE_TYPES = (PP_PLACEHOLDER.TITLE, PP_PLACEHOLDER.CENTER_TITLE, PP_PLACEHOLDER.VERTICAL_TITLE)
+
+
+def _clean(text):
+    # Soft line breaks come through as vertical tabs
+    text = text.replace("\x0b", "\n").replace("\r", "")
+    lines = (_SPACES.sub(" ", line).strip() for line in text.split("\n"))
+    return "\n".join(line for line in lines if line)
+
+
+def _table_lines(table):
+    for row in table.rows:
+        cells = []
+        for cell in row.cells:
+            if cell.is_spanned:   # covered by a merged neighbour
+                continue
+            text = _clean(cell.text).replace("\n", " ")
+            if text:
+                cells.append(text)
+        if cells:
+            yield " | ".join(cells)
+
+
+def _is_title(shape):
+    return shape.is_placeholder and shape.placeholder_format.type in _TITLE_TYPES
+
+
+def _shape_lines(shapes):
+    # Shapes come in the deck's own order; sorting by position would mean
+    # resolving inherited placeholder positions, which is slow on big decks
+    for shape in shapes:
+        if shape.shape_type == MSO_SHAPE_TYPE.GROUP:
+            yield from _shape_lines(shape.shapes)
+        elif shape.has_table:
+            yield from _table_lines(shape.table)
+        elif shape.has_text_frame:
+            text = _clean(shape.text_frame.text)
+            if text:
+                yield text
+
+
+def slide_text(slide, include_notes=True):
+    """Text block of one slide ("" when it has none)."""
+    titles, lines = [], []
+    for shape in slide.shapes:
+        if shape.has_text_frame and _is_title(shape):
+            titles.append(_clean(shape.text_frame.text).replace("\n", " "))
+        else:
+            lines.extend(_shape_lines([shape]))
+    lines[:0] = [title for title in titles if title]
+    if include_notes and slide.has_notes_slide:
+        frame = slide.notes_slide.notes_text_frame
+        notes = _clean(frame.text) if frame is not None else ""
+        if notes:
+            lines.append("Notes: " + notes.replace("\n", " "))
+    return "\n".join(lines)
+
+
+def iter_pptx_slides(source, include_notes=True):
+    """
+    Yield the text block of every slide that has text, each ending in a blank
+    line so slides stay separate paragraphs when the blocks are joined.
+    `source` is a path or binary file object.
+    """
+    for slide in Presentation(source).slides:
+        text = slide_text(slide, include_notes)
+        if text:
+            yield text + "\n\n"
@@ -0,0 +1,159 @@
+import json
+import logging
+import re
+
+from django.db import transaction
+
+from .ai_service import acall_ai
+from .models import Option, Question
+
+logger = logging.getLogger(__name__)
+
+_QUESTION_LINE = re.compile(r"^(?:Q(?:uestion)?\s*)?(\d+)\s*[.):]\s*(.+)$", re.IGNORECASE)
+_OPTION_LINE = re.compile(r"^\(?([A-D])\s*[.):\]]\s*(.+)$", re.IGNORECASE)
+_CORRECT_LINE = re.compile(r"^(?:Correct(?:\s+answer)?|Answer)\s*[:\-]\s*\(?([A-D])\b", re.IGNORECASE)
+
+
+def parse_quiz(text):
+    """
+    Parse the generated quiz text into
+    [{"text": ..., "options": {"A": ..., ...}, "correct": "B"}, ...].
+    Questions without options or a recognisable correct option are dropped.
+    """
+    questions = []
+    current = None
+    for raw_line in (text or "").splitlines():
+        line = raw_line.strip().replace("**", "").strip()
+        if not line:
+            continue
+        correct = _CORRECT_LINE.match(line)
+        if correct and current is not None:
+            current["correct"] = correct.group(1).upper()
+            continue
+        option = _OPTION_LINE.match(line)
+        if option and current is not None:
+            current["options"][option.group(1).upper()] = option.group(2).strip()
+            continue
+        question = _QUESTION_LINE.match(line)
+        if question:
+            current = {"text": question.group(2).strip(), "options": {}, "correct": None}
+            questions.append(current)
+        elif current is not None and not current["options"]:
+            # Question text wrapped onto another line
+            current["text"] = f"{current['text']} {line}"
+    return [q for q in questions if q["options"] and q["correct"] in q["options"]]
+
+
+async def explain_options(parsed, lesson_text):
+    """
+    One LLM call explaining every option of every question. Returns
+    {question_number: {label: explanation}}; missing entries are simply absent.
+    """
+    if not parsed:
+        return {}
+    questions = ""
+    for number, q in enumerate(parsed, start=1):
+        options = "\n".join(f"   {label}) {text}" for label, text in sorted(q["options"].items()))
+        questions += f"""
+{number}. {q['text']}
+{options}
+   Correct: {q['correct']}
+"""
+    prompt = f"""
+For every question of the quiz below, explain each option in 1-2 sentences:
+why the correct option is right, and why each other option is wrong.
+Base the explanations on the lesson.
+
+Return ONLY a JSON array with one object per question, in the same order, like:
+[{{"number": 1, "explanations": {{"A": "...", "B": "...", "C": "...", "D": "..."}}}}]
+
+Lesson:
+{lesson_text}
+
+Quiz:
+{questions}
+"""
+    answer = await acall_ai(prompt)
+    start, end = answer.find("["), answer.rfind("]")
+    if start == -1 or end <= start:
+        return {}
+    try:
+        items = json.loads(answer[start:end + 1])
+    except ValueError:
+        return {}
+
+    explanations = {}
+    for position, item in enumerate(items if isinstance(items, list) else [], start=1):
+        if not isinstance(item, dict) or not isinstance(item.get("explanations"), dict):
+            continue
+        try:
+            number = int(item.get("number", position))
+        except (TypeError, ValueError):
+            continue
+        explanations[number] = {
+            str(label).strip().upper()[:1]: str(text).strip()
+            for label, text in item["explanations"].items()
+        }
+    return explanations
+
+
+def save_questions(lesson, parsed, explanations=None):
+    """Store parsed questions and their options for a lesson."""
+    explanations = explanations or {}
+    with transaction.atomic():
+        questions = Question.objects.bulk_create([
+            Question(lesson=lesson, position=number, text=q["text"], correct_option=q["correct"])
+            for number, q in enumerate(parsed, start=1)
+        ])
+        Option.objects.bulk_create([
+            Option(
+                question=question,
+                label=label,
+                text=text,
+                explanation=explanations.get(question.position, {}).get(label, ""),
+            )
+            for question, q in zip(questions, parsed)
+            for label, text in sorted(q["options"].items())
+        ])
+    return questions
+
+
+def replace_questions(lesson, parsed, explanations=None):
+    """Replace all questions of a lesson (e.g. after its quiz was edited)."""
+    with transaction.atomic():
+        Question.objects.filter(lesson=lesson).delete()
+        return save_questions(lesson, parsed, explanations)
+
+
+def kept_explanations(lesson, parsed):
+    """
+    Stored explanations for the parsed questions that are unchanged on `lesson`
+    (same text, options and answer), in the shape save_questions takes.
+    """
+    stored = {}
+    for question in lesson.questions.prefetch_related("options"):
+        options = {option.label: option.text for option in question.options.all()}
+        stored[(question.text, question.correct_option, tuple(sorted(options.items())))] = {
+            option.label: option.explanation for option in question.options.all() if option.explanation
+        }
+    explanations = {}
+    for number, q in enumerate(parsed, start=1):
+        found = stored.get((q["text"], q["correct"], tuple(sorted(q["options"].items()))))
+        if found:
+            explanations[number] = found
+    return explanations
+
+
+def copy_questions(source, target):
+    """Copy the questions, options and explanations of one lesson onto another."""
+    with transaction.atomic():
+        originals = list(source.questions.prefetch_related("options"))
+        copies = Question.objects.bulk_create([
+            Question(lesson=target, position=q.position, text=q.text, correct_option=q.correct_option)
+            for q in originals
+        ])
+        Option.objects.bulk_create([
+            Option(question=copy, label=o.label, text=o.text, explanation=o.explanation)
+            for original, copy in zip(originals, copies)
+            for o in original.options.all()
+        ])
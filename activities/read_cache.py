@@ -0,0 +1,84 @@
+import hashlib
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from rest_framework import status
+from rest_framework.response import Response
+
+# Cached lesson responses are keyed by a "generation" per lesson (detail) and per
+# owner (list). Any write moves the generation on, so stale entries are never read
+# again and simply expire. Generations are timestamps rather than counters so a
+# cache restart can't bring back an old value (and with it an old ETag).
+
+
+def _generation(key):
+    generation = cache.get(key)
+    if generation is None:
+        generation = time.time_ns()
+        cache.add(key, generation, None)
+        generation = cache.get(key, generation)
+    return generation
+
+
+def _lesson_generation_key(lesson_id):
+    return f"lessons:gen:lesson:{lesson_id}"
+
+
+def _owner_generation_key(user_id):
+    return f"lessons:gen:owner:{user_id}"
+
+
+def invalidate_lesson(lesson_id, owner_id):
+    """Drop cached detail responses for a lesson and list responses of its owner (after commit)."""
+    def bump():
+        now = time.time_ns()
+        cache.set_many({_lesson_generation_key(lesson_id): now, _owner_generation_key(owner_id): now}, None)
+
+    transaction.on_commit(bump)
+
+
+def detail_key(user_id, lesson_id):
+    return f"lessons:detail:{lesson_id}:{_generation(_lesson_generation_key(lesson_id))}:u{user_id}"
+
+
+def slides_key(user_id, lesson_id, query_string):
+    query = hashlib.md5(query_string.encode("utf-8")).hexdigest()
+    return f"lessons:slides:{lesson_id}:{_generation(_lesson_generation_key(lesson_id))}:u{user_id}:{query}"
+
+
+def list_key(user_id, query_string):
+    query = hashlib.md5(query_string.encode("utf-8")).hexdigest()
+    return f"lessons:list:{user_id}:{_generation(_owner_generation_key(user_id))}:{query}"
+
+
+def lesson_etag(lesson):
+    return f'"lesson-{lesson.pk}-v{lesson.version}"'
+
+
+def list_etag(key):
+    return '"' + hashlib.md5(key.encode("utf-8")).hexdigest() + '"'
+
+
+def get(key):
+    return cache.get(key)
+
+
+def put(key, etag, data):
+    entry = {"etag": etag, "data": data}
+    cache.set(key, entry, settings.LESSON_READ_CACHE_TTL)
+    return entry
+
+
+def conditional_response(request, entry):
+    """200 with the cached data, or 304 when the client already has this ETag."""
+    etag = entry["etag"]
+    if_none_match = request.headers.get("If-None-Match", "")
+    if etag in [tag.strip() for tag in if_none_match.split(",")] or if_none_match.strip() == "*":
+        response = Response(status=status.HTTP_304_NOT_MODIFIED)
+    else:
+        response = Response(entry["data"], status=status.HTTP_200_OK)
+    response["ETag"] = etag
+    response["Cache-Control"] = "private, no-cache"
+    return response
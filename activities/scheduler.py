@@ -0,0 +1,301 @@
+"""
+Admission control for LLM calls, shared by every worker process through the
+database.
+
+Each call that goes to the provider first takes a ticket (an LLMTicket row)
+and waits until it is admitted. Admission keeps at most LLM_MAX_CONCURRENCY
+calls running and, with LLM_TOKENS_PER_MINUTE set, the tokens of calls admitted
+in the last minute under that budget. Waiting tickets are admitted by priority
+("interactive" grading before "bulk" lesson generation), then to the user with
+the fewest calls running, then first come first served, so one user's large
+upload can't hold everybody else back.
+
+Decisions are made inside a transaction that first locks the single LLMGate
+row (created by migration 0013): SELECT ... FOR UPDATE where the database has
+row locks, a write to it on SQLite, which takes the database's write lock.
+A finishing call makes one straight away, so a freed slot goes to the next
+waiter without delay; waiters also poll, first after LLM_SCHEDULER_POLL
+seconds and then backing off to LLM_SCHEDULER_POLL_MAX, and only take the
+gate while their ticket is still waiting. Tickets of callers that died are
+dropped: running ones after LLM_SCHEDULER_LEASE seconds, waiting ones once
+they stop polling. A live waiter whose ticket was dropped anyway (its process
+stalled) takes a new one and keeps waiting; it never goes ahead unadmitted.
+
+The scheduler is off by default: it costs a ticket row and a few locking
+transactions per call, so turn it on where several processes share a
+provider limit.
+
+`caller(priority, user_id)` sets who the calls in a block are made for.
+"""
+import asyncio
+import math
+import random
+import time
+from collections import Counter
+from contextlib import asynccontextmanager, contextmanager
+from contextvars import ContextVar
+from datetime import timedelta
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Count, Sum
+from django.utils import timezone
+
+from . import metrics
+from .models import LLMGate, LLMTicket
+from .tokens import estimate_tokens, model_budget
+
+PRIORITIES = {"interactive": 0, "bulk": 10}
+
+TOKEN_WINDOW = timedelta(minutes=1)
+
+# Waiting tickets considered per admission round
+_SCAN_LIMIT = 500
+
+_caller = ContextVar("activities_llm_caller", default=("bulk", None))
+
+
+class AdmissionTimeout(RuntimeError):
+    """An LLM call waited longer than LLM_SCHEDULER_TIMEOUT for admission."""
+
+
+def enabled():
+    return settings.LLM_MAX_CONCURRENCY > 0 or settings.LLM_TOKENS_PER_MINUTE > 0
+
+
+@contextmanager
+def caller(priority, user_id=None):
+    """LLM calls in this block are queued with `priority` for `user_id`."""
+    if priority not in PRIORITIES:
+        raise ValueError(f"Unknown LLM priority {priority!r}")
+    token = _caller.set((priority, user_id))
+    try:
+        yield
+    finally:
+        _caller.reset(token)
+
+
+def estimate_call_tokens(prompt, model=None):
+    """Prompt tokens plus the expected answer, capped by the model's output limit."""
+    prompt_tokens = estimate_tokens(prompt)
+    answer = min(model_budget(model)["output"], math.ceil(prompt_tokens * settings.LLM_REWRITE_EXPANSION))
+    return prompt_tokens + answer
+
+
+# --- admission ----------------------------------------------------------------
+
+def _purge(now):
+    LLMTicket.objects.filter(state=LLMTicket.STATE_DONE, admitted_at__lt=now - TOKEN_WINDOW).delete()
+    LLMTicket.objects.filter(
+        state=LLMTicket.STATE_RUNNING, admitted_at__lt=now - timedelta(seconds=settings.LLM_SCHEDULER_LEASE),
+    ).delete()
+    LLMTicket.objects.filter(
+        state=LLMTicket.STATE_WAITING, seen_at__lt=now - timedelta(seconds=settings.LLM_SCHEDULER_STALE_AFTER),
+    ).delete()
+
+
+def select_admissions(waiting, running_users, running, window_tokens, max_concurrency, tokens_per_minute):
+    """
+    Ids of the waiting tickets to admit now. `waiting` holds (id, priority,
+    user_id, tokens) in arrival order, `running_users` the user_id of every
+    running ticket. Tickets go by priority, then to the user with the fewest
+    calls running; admission stops at the first ticket that doesn't fit, so a
+    large call isn't overtaken forever. A call larger than the whole token
+    budget is let through once the window is empty.
+    """
+    per_user = Counter(running_users)
+    pending = list(waiting)
+    admitted = []
+    while pending and (max_concurrency <= 0 or running < max_concurrency):
+        best = min(range(len(pending)), key=lambda i: (pending[i][1], per_user[pending[i][2]], i))
+        ticket_id, _, user_id, tokens = pending[best]
+        if tokens_per_minute > 0 and window_tokens > 0 and window_tokens + tokens > tokens_per_minute:
+            break
+        admitted.append(ticket_id)
+        del pending[best]
+        running += 1
+        window_tokens += tokens
+        per_user[user_id] += 1
+    return admitted
+
+
+def _admit_round(ticket_id=None):
+    """Make admission decisions; returns the state of `ticket_id` (None if it was dropped)."""
+    now = timezone.now()
+    if ticket_id is not None:
+        # Admitted by another round since the last poll: no need to take the gate
+        state = LLMTicket.objects.filter(pk=ticket_id).values_list("state", flat=True).first()
+        if state != LLMTicket.STATE_WAITING:
+            return state
+    with transaction.atomic():
+        # Take the gate first: later reads see every other worker's decisions
+        if connection.features.has_select_for_update:
+            LLMGate.objects.select_for_update().get(pk=1)
+        elif not LLMGate.objects.filter(pk=1).update(updated_at=now):
+            raise LLMGate.DoesNotExist("LLMGate matching query does not exist.")
+        LLMTicket.objects.filter(pk=ticket_id, state=LLMTicket.STATE_WAITING).update(seen_at=now)
+        _purge(now)
+
+        tickets = LLMTicket.objects.all()
+        running_users = list(
+            tickets.filter(state=LLMTicket.STATE_RUNNING).values_list("user_id", flat=True)
+        )
+        window_tokens = tickets.filter(admitted_at__gte=now - TOKEN_WINDOW).aggregate(total=Sum("tokens"))["total"] or 0
+        waiting = list(
+            tickets.filter(state=LLMTicket.STATE_WAITING)
+            .order_by("priority", "created_at", "id")
+            .values_list("id", "priority", "user_id", "tokens")[:_SCAN_LIMIT]
+        )
+        admit = select_admissions(
+            waiting, running_users, len(running_users), window_tokens,
+            settings.LLM_MAX_CONCURRENCY, settings.LLM_TOKENS_PER_MINUTE,
+        )
+        if admit:
+            tickets.filter(pk__in=admit).update(state=LLMTicket.STATE_RUNNING, admitted_at=now)
+        if ticket_id is None:
+            return None
+        return tickets.filter(pk=ticket_id).values_list("state", flat=True).first()
+
+
+def _delays():
+    """Seconds between admission polls: LLM_SCHEDULER_POLL, doubling up to LLM_SCHEDULER_POLL_MAX."""
+    delay = settings.LLM_SCHEDULER_POLL
+    while True:
+        yield delay * random.uniform(0.8, 1.2)   # jitter keeps waiters from polling in step
+        delay = min(delay * 2, settings.LLM_SCHEDULER_POLL_MAX)
+
+
+def _take_ticket(tokens):
+    priority, user_id = _caller.get()
+    ticket = LLMTicket.objects.create(priority=PRIORITIES[priority], user_id=user_id, tokens=tokens)
+    return ticket.pk, priority
+
+
+def _finish(ticket_id, tokens):
+    LLMTicket.objects.filter(pk=ticket_id).update(
+        state=LLMTicket.STATE_DONE, tokens=tokens, admitted_at=timezone.now(),
+    )
+    # Hand the freed slot on now rather than at the next waiter's poll
+    _admit_round()
+
+
+def _abandon(ticket_id):
+    LLMTicket.objects.filter(pk=ticket_id, state=LLMTicket.STATE_WAITING).delete()
+
+
+def _waited(priority, start):
+    metrics.observe_llm_queue_wait(time.monotonic() - start, priority)
+
+
+class Slot:
+    """An admitted call. Set `output` to the answer so the token budget is charged exactly."""
+
+    def __init__(self, ticket_id, prompt_tokens):
+        self.ticket_id = ticket_id
+        self.prompt_tokens = prompt_tokens
+        self.output = ""
+
+    def used_tokens(self):
+        return self.prompt_tokens + (estimate_tokens(self.output) if self.output else 0)
+
+
+@contextmanager
+def admit(prompt, model=None):
+    """Block until the call for `prompt` may go out (a no-op when the scheduler is off)."""
+    if not enabled():
+        yield Slot(None, 0)
+        return
+    tokens = estimate_call_tokens(prompt, model)
+    ticket_id, priority = _take_ticket(tokens)
+    start = time.monotonic()
+    deadline = start + settings.LLM_SCHEDULER_TIMEOUT
+    delays = _delays()
+    try:
+        while (state := _admit_round(ticket_id)) != LLMTicket.STATE_RUNNING:
+            if state is None:
+                # Dropped as stale (this process stalled past LLM_SCHEDULER_STALE_AFTER): queue again
+                ticket_id, _ = _take_ticket(tokens)
+                continue
+            if time.monotonic() > deadline:
+                raise AdmissionTimeout(f"No LLM capacity after {settings.LLM_SCHEDULER_TIMEOUT}s")
+            time.sleep(next(delays))
+    except BaseException:
+        _abandon(ticket_id)
+        raise
+    _waited(priority, start)
+    slot = Slot(ticket_id, estimate_tokens(prompt))
+    try:
+        yield slot
+    finally:
+        _finish(ticket_id, slot.used_tokens())
+
+
+@asynccontextmanager
+async def aadmit(prompt, model=None):
+    """Async admit(): waits without holding a thread."""
+    if not enabled():
+        yield Slot(None, 0)
+        return
+    tokens = estimate_call_tokens(prompt, model)
+    ticket_id, priority = await sync_to_async(_take_ticket)(tokens)
+    start = time.monotonic()
+    deadline = start + settings.LLM_SCHEDULER_TIMEOUT
+    delays = _delays()
+    try:
+        while (state := await sync_to_async(_admit_round)(ticket_id)) != LLMTicket.STATE_RUNNING:
+            if state is None:
+                ticket_id, _ = await sync_to_async(_take_ticket)(tokens)
+                continue
+            if time.monotonic() > deadline:
+                raise AdmissionTimeout(f"No LLM capacity after {settings.LLM_SCHEDULER_TIMEOUT}s")
+            await asyncio.sleep(next(delays))
+    except BaseException:
+        await asyncio.shield(sync_to_async(_abandon)(ticket_id))
+        raise
+    _waited(priority, start)
+    slot = Slot(ticket_id, estimate_tokens(prompt))
+    try:
+        yield slot
+    finally:
+        await asyncio.shield(sync_to_async(_finish)(ticket_id, slot.used_tokens()))
+
+
+def waiting_counts():
+    """Waiting tickets per priority name."""
+    names = {value: name for name, value in PRIORITIES.items()}
+    rows = (
+        LLMTicket.objects.filter(state=LLMTicket.STATE_WAITING)
+        .values_list("priority").annotate(count=Count("id")).order_by()
+    )
+    counts = {name: 0 for name in PRIORITIES}
+    for priority, count in rows:
+        counts[names.get(priority, str(priority))] = count
+    return counts
+
+
+def running_count():
+    lease = timezone.now() - timedelta(seconds=settings.LLM_SCHEDULER_LEASE)
+    return LLMTicket.objects.filter(state=LLMTicket.STATE_RUNNING, admitted_at__gte=lease).count()
+
+
+def window_tokens():
+    """Tokens of calls admitted or finished in the last minute."""
+    since = timezone.now() - TOKEN_WINDOW
+    return LLMTicket.objects.filter(admitted_at__gte=since).aggregate(total=Sum("tokens"))["total"] or 0
+
+
+metrics.REGISTRY.extend([
+    metrics.Gauge(
+        "studyfun_llm_queue_waiting", "LLM calls waiting for admission, all workers.", ["priority"],
+        lambda: {(name,): count for name, count in waiting_counts().items()} if enabled() else {},
+    ),
+    metrics.Gauge(
+        "studyfun_llm_queue_running", "LLM calls admitted and not finished, all workers.", [],
+        lambda: {(): running_count()} if enabled() else {},
+    ),
+    metrics.Gauge(
+        "studyfun_llm_window_tokens", "Tokens charged to the last minute's LLM budget.", [],
+        lambda: {(): window_tokens()} if enabled() else {},
+    ),
+])
@@ -0,0 +1,176 @@
+"""
+Full-text search over a user's lesson titles and slides.
+
+The index lives in the database and is kept current by the database itself,
+so bulk slide inserts, replacements and cascading deletes need no extra code:
+
+- PostgreSQL: stored generated `search` tsvector columns on activities_slide
+  and activities_lesson (English configuration), each with a GIN index.
+- SQLite: external-content FTS5 tables (porter stemming) kept in step by
+  triggers. A migration that rebuilds a table drops its triggers, so they are
+  put back after every migrate (see apps.py). FTS5 finds every user's
+  matches before the owner filter applies, which is fine for local use.
+
+Hits are ranked per slide (ts_rank / bm25); a lesson ranks by its best hit,
+with title matches weighted TITLE_WEIGHT, and comes back with the positions
+of its best-matching slides.
+"""
+import operator
+import re
+from functools import reduce
+
+from django.db import NotSupportedError, connection
+from django.db.models import Q
+
+from .models import Lesson, Slide
+
+TITLE_WEIGHT = 2.0
+MAX_TERMS = 16
+SNIPPET_RADIUS = 80
+
+_WORD = re.compile(r"\w+")
+
+# --- index ----------------------------------------------------------------------
+
+# Created by migration 0014. SQLite sources (table, indexed column) and their triggers:
+_SQLITE_SOURCES = [("activities_slide", "text"), ("activities_lesson", "title")]
+
+
+def _sqlite_triggers(table, column):
+    fts = f"{table}_fts"
+    delete = f"INSERT INTO {fts}({fts}, rowid, {column}) VALUES ('delete', old.id, old.{column});"
+    insert = f"INSERT INTO {fts}(rowid, {column}) VALUES (new.id, new.{column});"
+    return [
+        f"CREATE TRIGGER IF NOT EXISTS {fts}_insert AFTER INSERT ON {table} BEGIN {insert} END",
+        f"CREATE TRIGGER IF NOT EXISTS {fts}_delete AFTER DELETE ON {table} BEGIN {delete} END",
+        f"CREATE TRIGGER IF NOT EXISTS {fts}_update AFTER UPDATE OF {column} ON {table} BEGIN {delete} {insert} END",
+    ]
+
+
+def restore_triggers(using="default", **kwargs):
+    """post_migrate: recreate SQLite triggers lost when a migration rebuilt a table."""
+    from django.db import connections
+
+    conn = connections[using]
+    if conn.vendor != "sqlite":
+        return
+    with conn.cursor() as cursor:
+        existing = set(conn.introspection.table_names(cursor))
+        for table, column in _SQLITE_SOURCES:
+            if f"{table}_fts" in existing:
+                for sql in _sqlite_triggers(table, column):
+                    cursor.execute(sql)
+
+
+# --- queries ----------------------------------------------------------------------
+
+def terms(query):
+    return [word.lower() for word in _WORD.findall(query)][:MAX_TERMS]
+
+
+# The tsquery is written out in each condition rather than taken from a CTE so the
+# planner sees it: for a rare word it reads the GIN index, for a common one it
+# goes through the owner's lessons and checks the stored vectors of their slides
+_POSTGRES_HITS = """
+    hits AS MATERIALIZED (
+        SELECT s.lesson_id AS lesson_id, s.position AS position,
+               ts_rank(s.search, plainto_tsquery('english', %(q)s)) AS rank
+        FROM activities_slide s JOIN activities_lesson l ON l.id = s.lesson_id
+        WHERE s.search @@ plainto_tsquery('english', %(q)s) AND l.created_by_id = %(user)s
+        UNION ALL
+        SELECT l.id, NULL, ts_rank(l.search, plainto_tsquery('english', %(q)s)) * %(title_weight)s
+        FROM activities_lesson l
+        WHERE l.search @@ plainto_tsquery('english', %(q)s) AND l.created_by_id = %(user)s
+    )"""
+
+# bm25() is lower-is-better, so it is negated to rank like ts_rank
+_SQLITE_HITS = """
+    hits AS MATERIALIZED (
+        SELECT s.lesson_id AS lesson_id, s.position AS position, -bm25(activities_slide_fts) AS rank
+        FROM activities_slide_fts
+        JOIN activities_slide s ON s.id = activities_slide_fts.rowid
+        JOIN activities_lesson l ON l.id = s.lesson_id
+        WHERE activities_slide_fts MATCH %(q)s AND l.created_by_id = %(user)s
+        UNION ALL
+        SELECT l.id, NULL, -bm25(activities_lesson_fts) * %(title_weight)s
+        FROM activities_lesson_fts JOIN activities_lesson l ON l.id = activities_lesson_fts.rowid
+        WHERE activities_lesson_fts MATCH %(q)s AND l.created_by_id = %(user)s
+    )"""
+
+# Best `limit` lessons, then up to `per_lesson` best slides of each
+_RANKED = """
+    lessons AS (
+        SELECT lesson_id, MAX(rank) AS best, SUM(CASE WHEN position IS NULL THEN 0 ELSE 1 END) AS matches
+        FROM hits GROUP BY lesson_id ORDER BY best DESC, lesson_id DESC LIMIT %(limit)s
+    ),
+    top AS (
+        SELECT h.lesson_id, h.position,
+               ROW_NUMBER() OVER (PARTITION BY h.lesson_id ORDER BY h.rank DESC, h.position) AS n
+        FROM hits h JOIN lessons ON lessons.lesson_id = h.lesson_id
+        WHERE h.position IS NOT NULL
+    )
+    SELECT lessons.lesson_id, lessons.best, lessons.matches, top.position
+    FROM lessons LEFT JOIN top ON top.lesson_id = lessons.lesson_id AND top.n <= %(per_lesson)s
+    ORDER BY lessons.best DESC, lessons.lesson_id DESC, top.n"""
+
+
+def _ranked_rows(user_id, words, limit, per_lesson):
+    params = {"user": user_id, "title_weight": TITLE_WEIGHT, "limit": limit, "per_lesson": per_lesson}
+    if connection.vendor == "postgresql":
+        sql = "WITH" + _POSTGRES_HITS + "," + _RANKED
+        params["q"] = " ".join(words)
+    elif connection.vendor == "sqlite":
+        sql = "WITH" + _SQLITE_HITS + "," + _RANKED
+        params["q"] = " ".join(f'"{word}"' for word in words)   # every term, each taken literally
+    else:
+        raise NotSupportedError(f"Lesson search needs PostgreSQL or SQLite, not {connection.vendor}")
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        return cursor.fetchall()
+
+
+def snippet(text, words, radius=SNIPPET_RADIUS):
+    """A stretch of `text` around the first query term (its start when none is found as typed)."""
+    text = " ".join(text.split())
+    # Stemming matches other forms of a word; looking for its first letters finds most of them
+    stems = sorted({word[:5] for word in words}, key=len, reverse=True)
+    found = re.search(r"\b(?:" + "|".join(map(re.escape, stems)) + ")", text, re.IGNORECASE) if stems else None
+    start = max(0, found.start() - radius) if found else 0
+    end = min(len(text), (found.end() if found else 0) + radius)
+    return ("…" if start else "") + text[start:end].strip() + ("…" if end < len(text) else "")
+
+
+def search_lessons(user, query, limit=20, per_lesson=3):
+    """
+    Ranked lessons of `user` matching every word of `query`:
+    [{"id", "title", "score", "matches", "slides": [{"position", "snippet"}]}].
+    `matches` counts all matching slides; `slides` holds the best `per_lesson`.
+    """
+    words = terms(query)
+    if not words:
+        return []
+    rows = _ranked_rows(user.pk, words, limit, per_lesson)
+
+    results, order = {}, []
+    for lesson_id, best, matches, position in rows:
+        if lesson_id not in results:
+            results[lesson_id] = {
+                "id": lesson_id, "title": None, "score": round(float(best), 4), "matches": matches, "slides": [],
+            }
+            order.append(lesson_id)
+        if position is not None:
+            results[lesson_id]["slides"].append({"position": position})
+
+    titles = dict(Lesson.objects.filter(id__in=order).values_list("id", "title"))
+    wanted = [Q(lesson_id=lesson_id, position=slide["position"])
+              for lesson_id in order for slide in results[lesson_id]["slides"]]
+    texts = {}
+    if wanted:
+        slides = Slide.objects.filter(reduce(operator.or_, wanted)).values_list("lesson_id", "position", "text")
+        texts = {(lesson_id, position): text for lesson_id, position, text in slides}
+    for lesson_id in order:
+        result = results[lesson_id]
+        result["title"] = titles.get(lesson_id)
+        for slide in result["slides"]:
+            slide["snippet"] = snippet(texts.get((lesson_id, slide["position"]), ""), words)
+    return [results[lesson_id] for lesson_id in order]
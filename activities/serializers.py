@@ -1,8 +1,122 @@
+from django.db import transaction
 from rest_framework import serializers
-from .models import Lesson
+from .models import (
+    Lesson, LessonJob, LessonQuizStats, Option, Question, QuestionQuizStats, QuizAnswer, QuizAttempt, Slide,
+    UserQuizStats,
+)
+from .quiz import kept_explanations, parse_quiz, replace_questions
+from .slides import replace_slides
+
+
+class OptionSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = Option
+        fields = ["label", "text"]
+
+
+# Answer keys and explanations stay server-side; grading looks them up by question id
+class QuestionSerializer(serializers.ModelSerializer):
+    options = OptionSerializer(many=True, read_only=True)
+
+    class Meta:
+        model = Question
+        fields = ["id", "position", "text", "options"]
+
 
 class LessonSerializer(serializers.ModelSerializer):
+    # Slide texts in order; same shape as when slides were a JSON array on the lesson
+    topic = serializers.ListField(
+        child=serializers.CharField(allow_blank=True, trim_whitespace=False),
+        allow_null=True, required=False,
+    )
+    questions = QuestionSerializer(many=True, read_only=True)
+
     class Meta:
         model = Lesson
-        fields = ["id", "title", "topic", "quiz", "created_at", "created_by"]
+        fields = ["id", "title", "topic", "quiz", "questions", "created_at", "created_by"]
         read_only_fields = ["id", "created_at", "created_by"]
+
+    def update(self, instance, validated_data):
+        with transaction.atomic():
+            if "topic" in validated_data:
+                texts = validated_data.pop("topic") or []
+                replace_slides(instance, texts)
+                validated_data["slide_count"] = len(texts)
+            # Grading uses the stored questions, so an edited quiz is parsed into new ones;
+            # unchanged questions keep their explanations
+            if "quiz" in validated_data and validated_data["quiz"] != instance.quiz:
+                parsed = parse_quiz(validated_data["quiz"])
+                replace_questions(instance, parsed, kept_explanations(instance, parsed))
+            return super().update(instance, validated_data)
+
+
+class SlideSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = Slide
+        fields = ["position", "text"]
+        read_only_fields = fields
+
+
+# Compact representation for listings: no topic / quiz payload
+class LessonListSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = Lesson
+        fields = ["id", "title", "created_at", "slide_count"]
+        read_only_fields = fields
+
+
+class LessonJobSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = LessonJob
+        fields = ["id", "title", "status", "stage", "progress", "error", "plan", "timings", "lesson", "revises",
+                  "created_at", "started_at", "finished_at"]
+        read_only_fields = fields
+
+
+class QuizAttemptSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = QuizAttempt
+        fields = ["id", "lesson", "score", "total", "percentage", "created_at"]
+        read_only_fields = fields
+
+
+class QuizAnswerSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = QuizAnswer
+        fields = ["position", "question", "question_text", "user_answer", "correct_answer", "is_correct"]
+        read_only_fields = fields
+
+
+class QuizAttemptDetailSerializer(QuizAttemptSerializer):
+    answers = QuizAnswerSerializer(many=True, read_only=True)
+
+    class Meta(QuizAttemptSerializer.Meta):
+        fields = QuizAttemptSerializer.Meta.fields + ["answers"]
+        read_only_fields = fields
+
+
+_TOTALS = ["attempts", "correct", "answered", "mean_percentage", "best_percentage", "last_attempt_at"]
+
+
+class QuestionQuizStatsSerializer(serializers.ModelSerializer):
+    position = serializers.IntegerField(source="question.position", read_only=True)
+    text = serializers.CharField(source="question.text", read_only=True)
+
+    class Meta:
+        model = QuestionQuizStats
+        fields = ["question", "position", "text", "answered", "missed", "miss_rate"]
+        read_only_fields = fields
+
+
+class LessonQuizStatsSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = LessonQuizStats
+        fields = ["lesson"] + _TOTALS
+        read_only_fields = fields
+
+
+class UserQuizStatsSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = UserQuizStats
+        fields = _TOTALS
+        read_only_fields = fields
@@ -0,0 +1,11 @@
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from . import read_cache
+from .models import Lesson
+
+
+@receiver(post_save, sender=Lesson)
+@receiver(post_delete, sender=Lesson)
+def invalidate_lesson_reads(sender, instance, **kwargs):
+    read_cache.invalidate_lesson(instance.pk, instance.created_by_id)
@@ -0,0 +1,55 @@
+from django.db import transaction
+
+from .models import Slide
+
+BULK_BATCH_SIZE = 500
+
+
+def save_slides(lesson, texts):
+    """Store slide texts for a lesson that has none yet."""
+    return Slide.objects.bulk_create(
+        (Slide(lesson=lesson, position=position, text=text) for position, text in enumerate(texts)),
+        batch_size=BULK_BATCH_SIZE,
+    )
+
+
+def replace_slides(lesson, texts):
+    """Replace all slides of a lesson. Callers update and save lesson.slide_count."""
+    with transaction.atomic():
+        Slide.objects.filter(lesson=lesson).delete()
+        save_slides(lesson, texts)
+
+
+def sync_slides(lesson, texts):
+    """
+    Make the slides of a lesson `texts`, writing only the positions whose text
+    changed. Callers update and save lesson.slide_count. Returns the number of
+    slides written or deleted.
+    """
+    with transaction.atomic():
+        existing = {
+            position: (slide_id, text)
+            for slide_id, position, text in Slide.objects.filter(lesson=lesson).values_list("id", "position", "text")
+        }
+        changed = [
+            Slide(id=existing[position][0], text=text)
+            for position, text in enumerate(texts)
+            if position in existing and existing[position][1] != text
+        ]
+        Slide.objects.bulk_update(changed, ["text"], batch_size=BULK_BATCH_SIZE)
+        removed, _ = Slide.objects.filter(lesson=lesson, position__gte=len(texts)).delete()
+        added = Slide.objects.bulk_create(
+            (Slide(lesson=lesson, position=position, text=text)
+             for position, text in enumerate(texts) if position not in existing),
+            batch_size=BULK_BATCH_SIZE,
+        )
+    return len(changed) + removed + len(added)
+
+
+def copy_slides(source, target):
+    """Copy the slides of one lesson onto another."""
+    Slide.objects.bulk_create(
+        (Slide(lesson=target, position=position, text=text)
+         for position, text in source.slides.values_list("position", "text").iterator()),
+        batch_size=BULK_BATCH_SIZE,
+    )
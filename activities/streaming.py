@@ -0,0 +1,54 @@
+"""
+Event streams for lesson creation (`?stream=sse` or `?stream=ndjson`).
+
+Events are dicts with an "event" key: "job" (the created job), "stage"
+(stage/progress updates), "slide" (index and text, sent while the lesson is
+still being written), then "done" (lesson id) or "failed" (error).
+"""
+import json
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.http import StreamingHttpResponse
+
+CONTENT_TYPES = {
+    "sse": "text/event-stream",
+    "ndjson": "application/x-ndjson",
+}
+
+
+def requested_format(request):
+    """"sse" or "ndjson" when the client asked for a stream, else None."""
+    value = request.GET.get("stream", "").lower()
+    return value if value in CONTENT_TYPES else None
+
+
+def encode(event, fmt):
+    data = json.dumps(event, cls=DjangoJSONEncoder)
+    if fmt == "sse":
+        return f"event: {event['event']}\ndata: {data}\n\n"
+    return data + "\n"
+
+
+def lesson_events(lesson):
+    """Events for a lesson that already exists (e.g. a reused upload)."""
+    for index, text in lesson.slides.values_list("position", "text").iterator():
+        yield {"event": "slide", "index": index, "text": text}
+    yield {"event": "done", "lesson": lesson.pk}
+
+
+def response(events, fmt):
+    """StreamingHttpResponse over a sync or async iterable of events."""
+    if hasattr(events, "__aiter__"):
+        async def body():
+            async for event in events:
+                yield encode(event, fmt)
+    else:
+        def body():
+            for event in events:
+                yield encode(event, fmt)
+
+    streaming = StreamingHttpResponse(body(), content_type=CONTENT_TYPES[fmt])
+    streaming["Cache-Control"] = "no-cache"
+    # Tell nginx-style proxies not to buffer the stream
+    streaming["X-Accel-Buffering"] = "no"
+    return streaming
@@ -1,3 +1,918 @@
-from django.test import TestCase
+import asyncio
+import io
+import itertools
+import json
+import os
+import random
+import re
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock
 
-# Create your tests here.
+import httpx
+import requests
+from asgiref.sync import async_to_sync
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.exceptions import ImproperlyConfigured
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import connections
+from django.test import RequestFactory, SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+from pptx import Presentation
+from pptx.util import Inches
+from rest_framework.test import APIClient
+
+from . import ai_service, async_views, jobs, metrics, pipeline, quiz, scheduler, search
+from .ai_cache import MemoryCache
+from .ai_service import LLMClient, worth_retrying
+from .attempts import record_attempt
+from .fake_llm import FakeLLMServer, answer_for
+from .grading import UNKNOWN_QUESTION, parse_explanations, score_answers
+from .models import (
+    Lesson, LessonJob, LessonPart, LessonQuizStats, LLMGate, LLMTicket, Question, QuestionQuizStats,
+)
+from .parts import PartMemo, digest
+from .pdf_extract import iter_pdf_pages
+from .pptx_extract import iter_pptx_slides
+from .slides import replace_slides, save_slides
+from .tokens import get_estimator, model_budget
+from .uploads import HashingUploadHandler
+from .utils import bounded_map, chunk_text, gather_bounded, iter_chunks
+
+
+def make_lesson(user, slides=(), questions=0, **fields):
+    """A lesson saved the way the pipeline saves one, with `questions` keyed A."""
+    slides = list(slides)
+    lesson = Lesson.objects.create(created_by=user, slide_count=len(slides), **fields)
+    save_slides(lesson, slides)
+    if questions:
+        quiz.save_questions(lesson, [
+            {"text": f"Question {n}?", "correct": "A", "options": {"A": "yes", "B": "no"}}
+            for n in range(1, questions + 1)
+        ])
+    return lesson
+
+
+async def fake_acall_ai(prompt, *args, **kwargs):
+    return answer_for(prompt, lesson_words=60, quiz_questions=3)
+
+
+def document(seed, pages=40, edit=None):
+    """Random prose of `pages` pages; `edit` adds a sentence to one page."""
+    rnd = random.Random(seed)
+    words = [f"word{i}" for i in range(3000)]
+    out = []
+    for page in range(pages):
+        paragraphs = [
+            " ".join(" ".join(rnd.choices(words, k=12)).capitalize() + "." for _ in range(6))
+            for _ in range(6)
+        ]
+        if page == edit:
+            paragraphs[2] += " An added sentence about something new entirely, with more words here."
+        out.append("\n\n".join(paragraphs))
+    return "\n\n".join(out)
+
+
+def make_pdf(pages):
+    """A minimal PDF with one line of Helvetica text per page."""
+    objects = [b"<< /Type /Catalog /Pages 2 0 R >>", None, b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>"]
+    kids = []
+    for text in pages:
+        stream = b"BT /F1 12 Tf 72 720 Td (%s) Tj ET" % text.encode()
+        objects.append(b"<< /Length %d >>\nstream\n%s\nendstream" % (len(stream), stream))
+        objects.append(
+            b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] /Contents %d 0 R"
+            b" /Resources << /Font << /F1 3 0 R >> >> >>" % len(objects)
+        )
+        kids.append(b"%d 0 R" % len(objects))
+    objects[1] = b"<< /Type /Pages /Kids [%s] /Count %d >>" % (b" ".join(kids), len(kids))
+    out, offsets = b"%PDF-1.4\n", []
+    for number, body in enumerate(objects, start=1):
+        offsets.append(len(out))
+        out += b"%d 0 obj\n%s\nendobj\n" % (number, body)
+    xref = len(out)
+    out += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    out += b"".join(b"%010d 00000 n \n" % offset for offset in offsets)
+    return out + b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, xref)
+
+
+class FakeLLMTestMixin:
+    """Runs a FakeLLMServer for the test and points the LLM clients at it."""
+
+    fake_llm_options = {}
+
+    def setUp(self):
+        super().setUp()
+        options = {"token_delay": 0, "first_token_delay": 0, "lesson_words": 120, **self.fake_llm_options}
+        self.llm = FakeLLMServer(("127.0.0.1", 0), **options).start()
+        ai_service._client = None
+        ai_service._async_clients.clear()
+        self.llm_settings = override_settings(
+            LLM_API_URL=self.llm.url, LLM_API_KEY="test-key", LLM_CACHE_BACKEND="none", LLM_MAX_RETRIES=0,
+        )
+        self.llm_settings.enable()
+
+    def tearDown(self):
+        self.llm_settings.disable()
+        self.llm.shutdown()
+        ai_service._client = None
+        super().tearDown()
+
+
+# --- jobs and lesson creation ----------------------------------------------------
+
+@override_settings(LESSON_JOB_WORKERS=0)
+class LessonJobTests(TransactionTestCase):
+    def setUp(self):
+        self.user = User.objects.create_user("jobs")
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_create_runs_as_job(self):
+        response = self.client.post(reverse("lesson-create"), {"title": "T", "topic": "Some text to teach."})
+        self.assertEqual(response.status_code, 202)
+        job_id = response.data["id"]
+        self.assertEqual(jobs.claim_next(), job_id)
+        with mock.patch("activities.pipeline.acall_ai", side_effect=fake_acall_ai), \
+                mock.patch("activities.quiz.acall_ai", side_effect=fake_acall_ai):
+            jobs.process(job_id)
+        response = self.client.get(reverse("lesson-job-detail", args=[job_id]))
+        self.assertEqual(response.data["status"], "done", response.data)
+        lesson = Lesson.objects.get(pk=response.data["lesson"])
+        self.assertEqual(lesson.questions.count(), 3)
+        self.assertEqual(lesson.slide_count, len(lesson.topic))
+
+    def test_upload_is_stored_until_the_job_finishes(self):
+        upload = SimpleUploadedFile("notes.pdf", make_pdf(["Cells are small.", "Cells divide."]))
+        with tempfile.TemporaryDirectory() as media, override_settings(MEDIA_ROOT=media):
+            response = self.client.post(reverse("lesson-create"), {"title": "T", "file": upload}, format="multipart")
+            self.assertEqual(response.status_code, 202)
+            job = LessonJob.objects.get()
+            self.assertTrue(job.upload.name.endswith(".pdf"))
+            self.assertTrue(os.path.exists(job.upload.path))
+            self.assertTrue(jobs.claim(job.pk))
+            with mock.patch("activities.pipeline.acall_ai", side_effect=fake_acall_ai), \
+                    mock.patch("activities.quiz.acall_ai", side_effect=fake_acall_ai):
+                jobs.process(job.pk)
+            self.assertFalse(os.path.exists(job.upload.path))
+            job.refresh_from_db()
+            self.assertEqual((job.status, job.upload.name), ("done", ""))
+
+    def test_invalid_requests(self):
+        self.assertEqual(self.client.post(reverse("lesson-create"), {"title": "T"}).status_code, 400)
+        self.assertEqual(self.client.post(reverse("lesson-create"), {"topic": "x"}).status_code, 400)
+        self.assertFalse(LessonJob.objects.exists())
+
+
+class LessonDedupeTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user("owner")
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def create(self, title, topic):
+        return self.client.post(reverse("lesson-create"), {"title": title, "topic": topic})
+
+    def test_same_text_copies_own_lesson(self):
+        self.assertEqual(self.create("A", "hello").status_code, 202)
+        job = LessonJob.objects.get()
+        make_lesson(self.user, ["slide"], questions=2, title="A", source_hash=job.source_hash)
+        response = self.create("B", "hello")
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.data["title"], "B")
+        self.assertEqual(response.data["topic"], ["slide"])
+        self.assertEqual(Lesson.objects.get(pk=response.data["id"]).questions.count(), 2)
+
+    def test_other_users_unedited_lessons_are_copied(self):
+        other = User.objects.create_user("other")
+        self.assertEqual(self.create("A", "hello").status_code, 202)
+        make_lesson(other, ["theirs"], title="A", source_hash=LessonJob.objects.get().source_hash)
+        response = self.create("B", "hello")
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.data["topic"], ["theirs"])
+        self.assertEqual(Lesson.objects.get(pk=response.data["id"]).created_by, self.user)
+
+    def test_other_users_edited_lessons_are_not_copied(self):
+        other = User.objects.create_user("other")
+        self.assertEqual(self.create("A", "hello").status_code, 202)
+        lesson = make_lesson(other, ["theirs"], title="A", source_hash=LessonJob.objects.get().source_hash)
+        lesson.title = "Edited"
+        lesson.save()
+        self.assertEqual(self.create("B", "hello").status_code, 202)
+
+    def test_missing_fingerprint_matches_nothing(self):
+        # Lessons from before fingerprints have no hash; neither does an upload without a digest
+        make_lesson(self.user, ["old"], title="Old", source_hash=None)
+        with mock.patch.object(HashingUploadHandler, "file_complete", return_value=None):
+            response = self.client.post(
+                reverse("lesson-create"), {"title": "C", "file": SimpleUploadedFile("c.pdf", b"%PDF")},
+                format="multipart",
+            )
+        self.assertEqual(response.status_code, 202)
+        self.assertIsNone(LessonJob.objects.get().source_hash)
+
+# --- LLM client, cache and retries ------------------------------------------------
+
+@override_settings(LLM_MAX_CONCURRENCY=0)
+class LLMClientTests(FakeLLMTestMixin, SimpleTestCase):
+    def test_keeps_connection_alive(self):
+        client = LLMClient(api_url=self.llm.url)
+        client.complete("hello")
+        client.complete("again")
+        self.assertEqual(self.llm.requests, 2)
+        self.assertEqual(len(client.session.adapters["http://"].poolmanager.pools), 1)
+
+    def test_gives_up_after_max_retries(self):
+        self.llm.error_rate = 1.0
+        client = LLMClient(api_url=self.llm.url, backoff_base=0, max_retries=2)
+        with self.assertRaises(requests.HTTPError):
+            client.complete("hello")
+        self.assertEqual(self.llm.requests, 3)
+
+    def test_needs_api_key(self):
+        with override_settings(LLM_API_KEY=""), self.assertRaises(ImproperlyConfigured):
+            LLMClient(api_url=self.llm.url)
+
+    def test_retry_after(self):
+        self.assertEqual(LLMClient.parse_retry_after("3"), 3.0)
+        self.assertIsNone(LLMClient.parse_retry_after("soon"))
+
+    def test_response_cache(self):
+        with override_settings(LLM_CACHE_BACKEND="memory"), mock.patch("activities.ai_cache._cache", MemoryCache()):
+            self.assertEqual(ai_service.call_ai("hello"), ai_service.call_ai("hello"))
+            self.assertEqual(self.llm.requests, 1)
+            ai_service.call_ai("hello", bypass_cache=True)
+            self.assertEqual(self.llm.requests, 2)
+
+
+class MemoryCacheTests(SimpleTestCase):
+    def test_evicts_least_recently_used(self):
+        memory = MemoryCache(max_entries=2)
+        memory.set("a", "1")
+        memory.set("b", "2")
+        memory.get("a")
+        memory.set("c", "3")
+        self.assertIsNone(memory.get("b"))
+        self.assertEqual((memory.get("a"), memory.get("c")), ("1", "3"))
+        self.assertEqual(memory.stats()["evictions"], 1)
+
+
+class RetryTests(SimpleTestCase):
+    def test_worth_retrying(self):
+        self.assertFalse(worth_retrying(requests.ConnectionError()))
+        self.assertFalse(worth_retrying(requests.HTTPError()))
+        self.assertFalse(worth_retrying(httpx.ReadTimeout("slow")))
+        self.assertTrue(worth_retrying(KeyError("choices")))
+
+    def test_retry_if(self):
+        calls = []
+
+        def fail(item):
+            calls.append(item)
+            raise ValueError(item)
+
+        with self.assertRaises(ValueError):
+            bounded_map(fail, [1], retries=2, retry_delay=0, retry_if=lambda e: False)
+        with self.assertRaises(ValueError):
+            bounded_map(fail, [2], retries=2, retry_delay=0)
+        self.assertEqual(calls, [1, 2, 2, 2])
+
+    def test_bounded_map_order_and_cap(self):
+        live, peak, lock = [0], [0], threading.Lock()
+
+        def work(x):
+            with lock:
+                live[0] += 1
+                peak[0] = max(peak[0], live[0])
+            time.sleep(0.01 * (5 - x % 5))
+            with lock:
+                live[0] -= 1
+            return x * 2
+
+        done = []
+        self.assertEqual(bounded_map(work, range(10), max_workers=3, on_done=done.append), [x * 2 for x in range(10)])
+        self.assertLessEqual(peak[0], 3)
+        self.assertEqual(done, list(range(1, 11)))
+
+
+class PartRetryTests(FakeLLMTestMixin, SimpleTestCase):
+    fake_llm_options = {"error_rate": 1.0}
+
+    def test_failing_provider_is_retried_by_the_client_only(self):
+        async def rewrite():
+            try:
+                await gather_bounded(
+                    lambda part: pipeline.rewrite_part(part, "first"), ["text"],
+                    retries=2, retry_delay=0, retry_if=worth_retrying,
+                )
+            finally:
+                await ai_service.close_async_client()
+
+        with override_settings(LLM_MAX_RETRIES=2, LLM_BACKOFF_BASE=0, LLM_MAX_CONCURRENCY=0):
+            with self.assertRaises(httpx.HTTPStatusError):
+                asyncio.run(rewrite())
+        self.assertEqual(self.llm.requests, 3)
+
+
+# --- document extraction ------------------------------------------------------------
+
+class PdfExtractTests(SimpleTestCase):
+    def pdf(self, pages):
+        tmp = tempfile.NamedTemporaryFile(suffix=".pdf")
+        tmp.write(make_pdf(pages))
+        tmp.flush()
+        self.addCleanup(tmp.close)
+        return tmp.name
+
+    def test_pages_in_order(self):
+        path = self.pdf([f"Page {n}" for n in range(30)] + [""])
+        self.assertEqual(list(iter_pdf_pages(path)), [f"Page {n}" for n in range(30)])
+        self.assertEqual(list(iter_pdf_pages(path, max_chars=5))[:2], ["Page ", "Page "])
+
+    def test_process_pool_keeps_page_order(self):
+        path = self.pdf([f"Page {n}" for n in range(30)])
+        pages = list(iter_pdf_pages(path, processes=2, pages_per_task=4))
+        self.assertEqual(pages, [f"Page {n}" for n in range(30)])
+
+    def test_time_limit_outside_the_main_thread(self):
+        path = self.pdf(["Slow page"])
+        clock = mock.patch("activities.pdf_extract.time", **{"monotonic.side_effect": itertools.count(0, 5)})
+        with clock, self.assertLogs("activities.pdf_extract", "WARNING"), ThreadPoolExecutor(1) as pool:
+            self.assertEqual(pool.submit(lambda: list(iter_pdf_pages(path, time_limit=1))).result(), [])
+        with ThreadPoolExecutor(1) as pool:
+            self.assertEqual(pool.submit(lambda: list(iter_pdf_pages(path, time_limit=1))).result(), ["Slow page"])
+
+
+class PptxExtractTests(SimpleTestCase):
+    def deck(self):
+        deck = Presentation()
+        slide = deck.slides.add_slide(deck.slide_layouts[1])
+        slide.shapes.title.text = "Cells"
+        slide.placeholders[1].text_frame.text = "Cells are small.\n\nThey   divide."
+        group = slide.shapes.add_group_shape()
+        group.shapes.add_textbox(Inches(1), Inches(5), Inches(3), Inches(1)).text_frame.text = "Grouped"
+        table = slide.shapes.add_table(2, 2, Inches(1), Inches(6), Inches(4), Inches(1)).table
+        for row, col in itertools.product(range(2), repeat=2):
+            table.cell(row, col).text = f"r{row}c{col}"
+        slide.notes_slide.notes_text_frame.text = "Say hello."
+        deck.slides.add_slide(deck.slide_layouts[6])   # no text
+        deck.slides.add_slide(deck.slide_layouts[0]).shapes.title.text = "Summary"
+        out = io.BytesIO()
+        deck.save(out)
+        out.seek(0)
+        return out
+
+    def test_one_block_per_slide(self):
+        self.assertEqual(list(iter_pptx_slides(self.deck())), [
+            "Cells\nCells are small.\nThey divide.\nGrouped\nr0c0 | r0c1\nr1c0 | r1c1\nNotes: Say hello.\n\n",
+            "Summary\n\n",
+        ])
+
+    def test_notes_are_optional(self):
+        with override_settings(PPTX_INCLUDE_NOTES=False):
+            blocks = list(pipeline.extract_pages("deck.pptx", self.deck()))
+        self.assertEqual(len(blocks), 2)
+        self.assertNotIn("Notes:", "".join(blocks))
+
+
+# --- splitting, chunking and normalization ---------------------------------------------
+
+class ChunkTextTests(SimpleTestCase):
+    def test_keeps_words_and_limits(self):
+        rnd = random.Random(3)
+        for _ in range(200):
+            text = "".join(rnd.choice(["word ", "end. ", "Q? ", "\n\n", "longerword "]) for _ in range(rnd.randint(0, 300)))
+            limit = rnd.randint(10, 80)
+            chunks = chunk_text(text, limit)
+            self.assertEqual(" ".join(chunks).split(), text.split())
+            for chunk in chunks:
+                self.assertTrue(len(chunk) <= limit or " " not in chunk)
+            # Streamed in pieces, the text is cut the same way
+            cuts = sorted(rnd.sample(range(len(text) + 1), min(len(text) + 1, 5)))
+            pieces = [text[a:b] for a, b in zip([0] + cuts, cuts + [len(text)])]
+            self.assertEqual(list(iter_chunks(iter(pieces), limit)), chunks)
+
+    def test_cuts_at_sentences(self):
+        text = "First sentence here. Second one is here. Third sentence is a bit longer than that."
+        self.assertEqual(chunk_text(text, 50), ["First sentence here. Second one is here.",
+                                                "Third sentence is a bit longer than that."])
+
+
+class PlanSplitTests(SimpleTestCase):
+    def test_parts_fit_budget(self):
+        text = document(1, pages=20)
+        plan = pipeline.plan_split(text)
+        estimate = get_estimator()
+        self.assertGreater(len(plan.parts), 1)
+        self.assertTrue(all(estimate(part) <= plan.budget for part in plan.parts))
+        self.assertEqual(" ".join(plan.parts).split(), text.split())
+
+    def test_short_and_empty(self):
+        self.assertEqual(pipeline.plan_split(" hi ").parts, ["hi"])
+        self.assertEqual(pipeline.plan_split(["", " "]).parts, [])
+
+
+class NormalizeTreeTests(SimpleTestCase):
+    def normalize(self, parts, answer=answer_for, on_slide=None):
+        prompts = []
+
+        async def merge(prompt, *args, **kwargs):
+            prompts.append(prompt)
+            return answer(prompt)
+
+        with mock.patch("activities.pipeline.acall_ai", side_effect=merge):
+            return async_to_sync(pipeline.normalize_tree)(parts, on_slide), prompts
+
+    @override_settings(LESSON_NORMALIZE_FAN_IN=4)
+    def test_merges_level_by_level(self):
+        parts = [f"Fragment {i}. " + "word " * 40 for i in range(16)]
+        text, prompts = self.normalize(parts)
+        # Three seams per call: four groups of four parts, then the four groups
+        self.assertEqual([len(re.findall(r"^=== Seam \d+ ===$", p, re.MULTILINE)) for p in prompts], [3] * 5)
+        self.assertEqual(text.split(), "\n\n".join(parts).split())
+
+    def test_planned_parts_fit_the_merge_budget(self):
+        # Parts as plan_split cuts them, each close to the whole rewrite budget
+        parts = pipeline.plan_split(document(2, pages=40)).parts
+        self.assertGreater(len(parts), 4)
+        text, prompts = self.normalize(parts)
+        self.assertEqual(len(prompts), -(-(len(parts) - 1) // 3))
+        estimate = get_estimator()
+        budget = model_budget()
+        for prompt in prompts:
+            self.assertLessEqual(estimate(prompt), budget["context"] - budget["output"])
+            self.assertLessEqual(estimate(answer_for(prompt)), budget["output"])
+        self.assertEqual(text.split(), " ".join(parts).split())
+
+    @override_settings(LESSON_NORMALIZE_FAN_IN=2)
+    def test_higher_levels_drop_repeated_headings(self):
+        def drop_repeats(prompt):
+            # A model dropping every heading the seam's earlier headings already have
+            seams = []
+            for block in re.split(r"^=== Seam ", prompt, flags=re.MULTILINE)[1:]:
+                earlier = block.split("Earlier headings: ", 1)[1].split("\n", 1)[0].split("; ")
+                end, start = block.split("[End of one section]\n\n", 1)[1].split("[Start of the next section]\n\n")
+                start = "\n\n".join(p for p in start.strip().split("\n\n") if p not in earlier)
+                seams.append(f"=== Seam {block.split(' ', 1)[0]} ===\n\n{end.strip()}\n\n{start}")
+            return "\n\n".join(seams)
+
+        parts = [f"Overview\n\nSection {i} text." for i in range(4)]
+        text, prompts = self.normalize(parts, drop_repeats)
+        # Seams 1-2 and 3-4, then 2-3 once the first pair is merged
+        self.assertEqual(len(prompts), 3)
+        self.assertEqual(text, "Overview\n\n" + "\n\n".join(f"Section {i} text." for i in range(4)))
+
+    @override_settings(LESSON_NORMALIZE_FAN_IN=2)
+    def test_slides_stream_in_order_as_merges_complete(self):
+        slides, seen = [], []
+
+        async def on_slide(slide):
+            slides.append(slide)
+
+        def answer(prompt):
+            seen.append(len(slides))
+            return answer_for(prompt)
+
+        parts = ["\n\n".join([f"Part {i}."] + ["word " * 100] * 30) for i in range(4)]
+        text, prompts = self.normalize(parts, answer, on_slide)
+        self.assertEqual(slides, chunk_text(text, max_length=pipeline.SLIDE_LENGTH))
+        # The first part's own text goes out before any merge, and the first
+        # group's seam before the last merge
+        self.assertGreater(seen[0], 0)
+        self.assertGreater(seen[-1], seen[0])
+
+
+# --- slides, listing and read caching ----------------------------------------------------
+
+class LessonReadTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user("reader")
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_list_is_owner_scoped_and_paginated(self):
+        for i in range(25):
+            make_lesson(self.user, ["a"] * i, title=f"t{i}")
+        make_lesson(User.objects.create_user("other"), title="theirs")
+        response = self.client.get(reverse("lesson-list"))
+        self.assertEqual(len(response.data["results"]), 20)
+        self.assertEqual(set(response.data["results"][0]), {"id", "title", "created_at", "slide_count"})
+        self.assertEqual(response.data["results"][0]["slide_count"], 24)
+        rest = self.client.get(response.data["next"]).data["results"]
+        self.assertEqual(len(rest), 5)
+        self.assertNotIn("theirs", [lesson["title"] for lesson in rest])
+
+    def test_etag(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            lesson = make_lesson(self.user, ["a"], title="t")
+        url = reverse("lesson-detail", args=[lesson.pk])
+        etag = self.client.get(url)["ETag"]
+        with self.assertNumQueries(0):
+            self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.patch(url, {"title": "new"}, format="json")
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data["title"], "new")
+
+    def test_stale_saves_still_bump_the_version(self):
+        lesson = make_lesson(self.user, title="t")
+        stale = Lesson.objects.get(pk=lesson.pk)
+        lesson.save(update_fields=["title"])
+        stale.save(update_fields=["title"])
+        self.assertEqual((lesson.version, stale.version), (2, 3))
+        self.assertEqual(Lesson.objects.get(pk=lesson.pk).version, 3)
+
+    def test_slide_ranges(self):
+        lesson = make_lesson(self.user, [f"s{i}" for i in range(300)], title="t")
+        url = reverse("lesson-slides", args=[lesson.pk])
+        response = self.client.get(url, {"offset": 100, "limit": 3})
+        self.assertEqual(response.data["count"], 300)
+        self.assertEqual([slide["text"] for slide in response.data["results"]], ["s100", "s101", "s102"])
+        self.assertEqual(len(self.client.get(url, {"limit": 1000}).data["results"]), 100)
+        response = self.client.patch(reverse("lesson-detail", args=[lesson.pk]), {"topic": ["x", "y"]}, format="json")
+        self.assertEqual(response.data["topic"], ["x", "y"])
+        lesson.refresh_from_db()
+        self.assertEqual(lesson.slide_count, 2)
+
+
+class SearchTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user("searcher")
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_owner_scoped_with_snippets(self):
+        lesson = make_lesson(self.user, ["Plants use light.", "Chlorophyll absorbs light in photosynthesis."],
+                             title="Photosynthesis")
+        make_lesson(User.objects.create_user("other"), ["photosynthesis"], title="Photosynthesis")
+        response = self.client.get(reverse("lesson-search"), {"q": "photosynthesis"})
+        self.assertEqual([hit["id"] for hit in response.data["results"]], [lesson.pk])
+        self.assertIn("Chlorophyll", response.data["results"][0]["slides"][0]["snippet"])
+        self.assertEqual(self.client.get(reverse("lesson-search")).status_code, 400)
+
+    def test_follows_slide_changes(self):
+        lesson = make_lesson(self.user, ["alpha"], title="Old")
+        replace_slides(lesson, ["beta", "gamma beta"])
+        self.assertEqual(search.search_lessons(self.user, "alpha"), [])
+        self.assertEqual(search.search_lessons(self.user, "beta")[0]["matches"], 2)
+        lesson.delete()
+        self.assertEqual(search.search_lessons(self.user, "beta"), [])
+
+
+# --- quiz keys and grading ------------------------------------------------------------
+
+QUIZ = "1. What?\nA) a\nB) b\nCorrect: A\n\n2. Why?\nA) x\nB) y\nCorrect: B\n"
+
+
+class QuizParseTests(SimpleTestCase):
+    def test_parse(self):
+        parsed = quiz.parse_quiz("**1. What?**\nA) a\nB) b\nCorrect answer: B\n\n2. Why?\nA) x\nB) y\nAnswer: A\n\n"
+                                 "3. A question without options")
+        self.assertEqual(len(parsed), 2)
+        self.assertEqual(parsed[0]["correct"], "B")
+        self.assertEqual(parsed[1]["options"]["A"], "x")
+
+    def test_parse_explanations(self):
+        self.assertEqual(parse_explanations('[{"number":2,"explanation":"b"},{"number":1,"explanation":"a"}]', 2),
+                         {1: "a", 2: "b"})
+        self.assertEqual(parse_explanations("1. first\nmore\n2) second\n9. no", 2), {1: "first more", 2: "second"})
+
+
+class GradingTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user("student")
+        self.lesson = Lesson.objects.create(title="L", created_by=self.user, quiz=QUIZ)
+        quiz.save_questions(self.lesson, quiz.parse_quiz(QUIZ), {1: {"A": "a is right"}})
+        self.questions = list(self.lesson.questions.order_by("position"))
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_unmatched_question_is_not_trusted(self):
+        correct, results = score_answers(self.lesson, [
+            {"question": "Made up?", "userAnswer": "C", "correctAnswer": "C"},
+        ])
+        self.assertEqual(correct, 0)
+        self.assertFalse(results[0]["isCorrect"])
+        self.assertEqual(results[0]["explanation"], UNKNOWN_QUESTION)
+
+    def test_duplicate_answers_count_once(self):
+        correct, results = score_answers(self.lesson, [{"id": self.questions[0].pk, "userAnswer": "A"}] * 5)
+        self.assertEqual((correct, len(results)), (1, 1))
+
+    def test_matches_by_text_and_uses_stored_key(self):
+        correct, results = score_answers(self.lesson, [
+            {"question": "why?", "userAnswer": "A", "correctAnswer": "A"},
+        ])
+        self.assertEqual(correct, 0)
+        self.assertEqual((results[0]["questionId"], results[0]["correctAnswer"]), (self.questions[1].pk, "B"))
+
+    def test_lesson_without_key_uses_submitted_answers(self):
+        lesson = Lesson.objects.create(title="No key", created_by=self.user)
+        correct, _ = score_answers(lesson, [
+            {"question": "q", "userAnswer": "C", "correctAnswer": "C"},
+            {"question": "r", "userAnswer": "", "correctAnswer": ""},
+        ])
+        self.assertEqual(correct, 1)
+
+    def test_grading_with_stored_explanations_calls_no_llm(self):
+        body = {"feedback": False, "questions": [{"question": "What?", "userAnswer": "B"}]}
+        with mock.patch("activities.ai_service.get_client") as get_client:
+            response = self.client.post(reverse("grade-quiz", args=[self.lesson.pk]), body, format="json")
+        get_client.assert_not_called()
+        result = response.data["questionResults"][0]
+        self.assertEqual((result["correctAnswer"], result["explanation"]), ("A", "a is right"))
+
+    def test_wrong_answers_explained_in_one_call(self):
+        lesson = Lesson.objects.create(title="No key", created_by=self.user)
+        prompts = []
+
+        def llm(prompt, *args, **kwargs):
+            prompts.append(prompt)
+            return json.dumps([{"number": n, "explanation": f"Because {n}."} for n in range(1, 5)])
+
+        body = {"questions": [{"question": f"q{i}", "userAnswer": "A", "correctAnswer": "B"} for i in range(4)]}
+        with mock.patch("activities.grading.call_ai", side_effect=llm), \
+                mock.patch("activities.views.call_ai", return_value="Well done."):
+            response = self.client.post(reverse("grade-quiz", args=[lesson.pk]), body, format="json")
+        self.assertEqual(len(prompts), 1)
+        self.assertEqual([result["explanation"] for result in response.data["questionResults"]],
+                         [f"Because {n}." for n in range(1, 5)])
+
+
+class QuizEditTests(TestCase):
+    def test_editing_quiz_replaces_answer_keys(self):
+        user = User.objects.create_user("editor")
+        client = APIClient()
+        client.force_authenticate(user)
+        lesson = Lesson.objects.create(title="L", created_by=user, quiz=QUIZ)
+        quiz.save_questions(lesson, quiz.parse_quiz(QUIZ), {1: {"A": "because"}})
+        response = client.patch(reverse("lesson-detail", args=[lesson.pk]),
+                                {"quiz": QUIZ.replace("Correct: B", "Correct: A")}, format="json")
+        self.assertEqual(response.status_code, 200)
+        questions = list(Question.objects.filter(lesson=lesson).order_by("position"))
+        self.assertEqual([question.correct_option for question in questions], ["A", "A"])
+        # An unchanged question keeps its explanations
+        self.assertEqual(questions[0].options.get(label="A").explanation, "because")
+
+
+# --- attempts and statistics -----------------------------------------------------------
+
+class QuizAttemptTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user("student")
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.lesson = make_lesson(self.user, questions=4, title="L")
+
+    def grade(self, answers, user=None):
+        client = self.client
+        if user is not None:
+            client = APIClient()
+            client.force_authenticate(user)
+        questions = self.lesson.questions.order_by("position")
+        body = {"feedback": False, "questions": [
+            {"id": question.pk, "userAnswer": answer} for question, answer in zip(questions, answers)
+        ]}
+        response = client.post(reverse("grade-quiz", args=[self.lesson.pk]), body, format="json")
+        self.assertEqual(response.status_code, 200)
+        return response.data
+
+    def test_stats_follow_grades(self):
+        first = self.grade(["A", "A", "B", "B"])
+        self.grade(["A", "A", "A", "A"], user=User.objects.create_user("other"))
+        self.grade(["B", "A", "A", "B"])
+
+        stats = self.client.get(reverse("lesson-quiz-stats", args=[self.lesson.pk])).data
+        self.assertEqual((stats["attempts"], stats["correct"], stats["answered"]), (3, 8, 12))
+        self.assertAlmostEqual(stats["mean_percentage"], 200 / 3)
+        self.assertEqual(stats["best_percentage"], 100)
+        self.assertEqual([question["missed"] for question in stats["questions"]], [1, 0, 1, 2])
+
+        stats = self.client.get(reverse("user-quiz-stats")).data
+        self.assertEqual((stats["attempts"], stats["mean_percentage"]), (2, 50))
+
+        attempt = self.client.get(reverse("quiz-attempt-detail", args=[first["attemptId"]])).data
+        self.assertEqual([answer["is_correct"] for answer in attempt["answers"]], [True, True, False, False])
+        self.assertEqual(len(self.client.get(reverse("quiz-attempt-list")).data["results"]), 2)
+
+    def test_stats_reads_are_constant(self):
+        for _ in range(3):
+            self.grade(["A", "B", "A", "B"])
+        url = reverse("lesson-quiz-stats", args=[self.lesson.pk])
+        # The lesson, its totals and its question totals, however many attempts
+        with self.assertNumQueries(3):
+            self.client.get(url)
+
+    def test_recording_is_a_fixed_number_of_queries(self):
+        questions = list(self.lesson.questions.all())
+        _, results = score_answers(self.lesson, [{"id": question.pk, "userAnswer": "B"} for question in questions])
+        with self.assertNumQueries(10):
+            record_attempt(self.lesson, self.user, 0, results)
+        self.assertEqual(LessonQuizStats.objects.get(lesson=self.lesson).attempts, 1)
+        self.assertEqual(QuestionQuizStats.objects.get(question=questions[0]).missed, 1)
+
+    def test_regenerated_quiz_drops_question_stats(self):
+        self.grade(["A", "B", "A", "B"])
+        quiz.replace_questions(self.lesson, [{"text": "New?", "correct": "B", "options": {"A": "a", "B": "b"}}])
+        self.assertFalse(QuestionQuizStats.objects.filter(lesson=self.lesson).exists())
+        self.assertEqual(LessonQuizStats.objects.get(lesson=self.lesson).attempts, 1)
+
+
+# --- incremental regeneration --------------------------------------------------------------
+
+class PartMemoTests(SimpleTestCase):
+    def test_rewrites_are_keyed_by_role_not_part_count(self):
+        memo = PartMemo([
+            LessonPart(kind=LessonPart.KIND_REWRITE, position=i, source_hash=f"h{i}", output=f"o{i}")
+            for i in range(4)
+        ])
+        self.assertEqual(memo.lookup(LessonPart.KIND_REWRITE, "h0", "first"), "o0")
+        self.assertEqual(memo.lookup(LessonPart.KIND_REWRITE, "h2", "middle"), "o2")
+        self.assertEqual(memo.lookup(LessonPart.KIND_REWRITE, "h3", "last"), "o3")
+        self.assertIsNone(memo.lookup(LessonPart.KIND_REWRITE, "h3", "middle"))
+        self.assertIsNone(memo.lookup(LessonPart.KIND_REWRITE, "h1", "first"))
+
+    def test_split_follows_previous_parts(self):
+        before, after = document(2), document(2, edit=5)
+        plan = pipeline.plan_split(before)
+        memo = PartMemo([
+            LessonPart(kind=LessonPart.KIND_REWRITE, position=i, source_hash=digest(text), anchor=anchor, units=units)
+            for i, (text, (anchor, units)) in enumerate(zip(plan.parts, plan.units))
+        ])
+        revised = pipeline.plan_split(after, anchors=memo.anchors)
+        self.assertGreaterEqual(len(set(plan.parts) & set(revised.parts)), len(plan.parts) - 1)
+        self.assertEqual(" ".join(revised.parts).split(), after.split())
+
+
+@override_settings(LESSON_JOB_WORKERS=0, LLM_MAX_CONCURRENCY=0)
+class RevisionTests(FakeLLMTestMixin, TransactionTestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create_user("reviser")
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def run_job(self, data):
+        response = self.client.post(reverse("lesson-create"), data)
+        self.assertEqual(response.status_code, 202)
+        job_id = jobs.claim_next()
+        jobs.process(job_id)
+        job = LessonJob.objects.get(pk=job_id)
+        self.assertEqual(job.status, "done", job.error)
+        return job
+
+    def test_revised_document_rewrites_changed_parts_only(self):
+        calls = self.llm.requests
+        job = self.run_job({"title": "T", "topic": document(1)})
+        full = self.llm.requests - calls
+        lesson = job.lesson
+        parts = job.plan["parts"]
+        self.assertGreater(parts, 3)
+
+        calls = self.llm.requests
+        revision = self.run_job({"title": "T v2", "topic": document(1, edit=20), "lesson": lesson.pk})
+        self.assertEqual(revision.lesson_id, lesson.pk)
+        self.assertEqual(revision.plan["unchanged_parts"], parts - 1)
+        self.assertLess(self.llm.requests - calls, full / 2)
+        self.assertEqual(Lesson.objects.count(), 1)
+
+        # The same document again changes nothing
+        response = self.client.post(reverse("lesson-create"),
+                                    {"title": "T", "topic": document(1, edit=20), "lesson": lesson.pk})
+        self.assertEqual(response.status_code, 200)
+
+    def test_only_own_lessons_can_be_revised(self):
+        lesson = make_lesson(User.objects.create_user("other"), title="theirs")
+        response = self.client.post(reverse("lesson-create"), {"title": "x", "topic": "y", "lesson": lesson.pk})
+        self.assertEqual(response.status_code, 404)
+
+
+# --- streaming and async views ------------------------------------------------------------
+
+class StreamTests(FakeLLMTestMixin, TransactionTestCase):
+    fake_llm_options = {"lesson_words": 400}
+
+    def test_slides_stream_as_generated(self):
+        user = User.objects.create_user("streamer")
+        client = APIClient()
+        client.force_authenticate(user)
+        response = client.post(reverse("lesson-create") + "?stream=ndjson", {"title": "T", "topic": "abc"})
+        self.assertEqual(response["Content-Type"], "application/x-ndjson")
+        events = [json.loads(line) for line in b"".join(response.streaming_content).decode().splitlines()]
+        self.assertEqual(events[0]["event"], "job")
+        self.assertEqual(events[-1]["event"], "done", events[-1])
+        lesson = Lesson.objects.get(pk=events[-1]["lesson"])
+        self.assertEqual([event["text"] for event in events if event["event"] == "slide"], lesson.topic)
+
+
+class AsyncViewTests(TestCase):
+    def test_unauthenticated(self):
+        factory = RequestFactory()
+        for headers in ({}, {"HTTP_AUTHORIZATION": "Bearer junk"}):
+            request = factory.post("/", data="{}", content_type="application/json", **headers)
+            response = async_to_sync(async_views.grade_quiz)(request, pk=1)
+            self.assertEqual(response.status_code, 401)
+            self.assertTrue(response.has_header("WWW-Authenticate"))
+
+
+# --- metrics ----------------------------------------------------------------------
+
+class TimingsTests(SimpleTestCase):
+    def test_header_sums_repeated_stages(self):
+        timings = metrics.Timings()
+        timings.add("llm", 0.25)
+        timings.add("parse", 0.002)
+        timings.add("llm", 0.5)
+        self.assertEqual(timings.header(1), 'llm;desc="2x";dur=750.0, parse;dur=2.0, total;dur=1000.0')
+        self.assertEqual(timings.as_dict(), {"llm": 750.0, "parse": 2.0})
+
+
+@override_settings(LESSON_JOB_WORKERS=0)
+class MetricsTests(FakeLLMTestMixin, TransactionTestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create_user("measured")
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_off_by_default(self):
+        self.assertIs(metrics.timer("parse"), metrics.timer("split"))
+        self.assertNotIn("Server-Timing", self.client.get(reverse("lesson-list")))
+        self.assertEqual(self.client.get(reverse("metrics")).status_code, 404)
+
+    @override_settings(METRICS_ENABLED=True, METRICS_TOKEN="scrape")
+    def test_request_and_job_timings(self):
+        response = self.client.post(reverse("lesson-create"), {"title": "T", "topic": "Cells are small. " * 20})
+        self.assertEqual(response.status_code, 202)
+        self.assertRegex(response["Server-Timing"], r"parse;dur=[\d.]+, .*total;dur=[\d.]+$")
+
+        jobs.process(jobs.claim_next())
+        job = LessonJob.objects.get()
+        self.assertEqual(job.status, LessonJob.STATUS_DONE, job.error)
+        self.assertLessEqual({"split", "rewrite", "quiz", "save", "llm"}, set(job.timings))
+
+        self.assertEqual(self.client.get(reverse("metrics")).status_code, 401)
+        response = self.client.get(reverse("metrics"), HTTP_AUTHORIZATION="Bearer scrape")
+        text = response.content.decode()
+        self.assertIn('studyfun_llm_calls_total{endpoint="lesson-job",cache="off"}', text)
+        self.assertIn('studyfun_stage_seconds_count{endpoint="lesson-job",stage="rewrite"}', text)
+        self.assertIn('studyfun_http_request_seconds_count{endpoint="lesson-create",method="POST",status="202"}', text)
+
+
+# --- scheduler --------------------------------------------------------------------
+
+class SelectAdmissionsTests(SimpleTestCase):
+    def test_priority_fairness_and_budget(self):
+        # (id, priority, user, tokens)
+        waiting = [(1, 10, 7, 5), (2, 10, 7, 5), (3, 10, 8, 5), (4, 0, 9, 5)]
+        self.assertEqual(scheduler.select_admissions(waiting, [], 0, 0, 3, 0), [4, 1, 3])
+        self.assertEqual(scheduler.select_admissions(waiting, [7], 1, 0, 3, 0), [4, 3])
+        self.assertEqual(scheduler.select_admissions(waiting, [], 0, 0, 0, 12), [4, 1])
+        # A call over the whole budget goes alone
+        self.assertEqual(scheduler.select_admissions([(1, 10, 1, 500)], [], 0, 0, 0, 100), [1])
+        self.assertEqual(scheduler.select_admissions([(1, 10, 1, 500)], [], 0, 1, 0, 100), [])
+
+
+@override_settings(LLM_MAX_CONCURRENCY=1, LLM_SCHEDULER_POLL=0.02, LLM_SCHEDULER_POLL_MAX=0.05)
+class SchedulerTests(TransactionTestCase):
+    def setUp(self):
+        # Flushing between TransactionTestCases drops the row migration 0013 creates
+        LLMGate.objects.get_or_create(pk=1)
+
+    def test_off_by_default(self):
+        with override_settings(LLM_MAX_CONCURRENCY=0, LLM_TOKENS_PER_MINUTE=0):
+            with scheduler.admit("hello"):
+                pass
+        self.assertFalse(LLMTicket.objects.exists())
+
+    def test_dropped_ticket_waits_again(self):
+        blocker = LLMTicket.objects.create(priority=10, tokens=1, state="running", admitted_at=timezone.now())
+        admitted = []
+
+        def call():
+            try:
+                with scheduler.admit("hello") as slot:
+                    admitted.append((slot.ticket_id, LLMTicket.objects.filter(state="running").count()))
+            finally:
+                connections.close_all()
+
+        thread = threading.Thread(target=call)
+        thread.start()
+        time.sleep(0.2)
+        # The stale-ticket sweep deletes the waiting ticket
+        first = LLMTicket.objects.get(state="waiting").pk
+        LLMTicket.objects.filter(pk=first).delete()
+        time.sleep(0.2)
+        self.assertEqual(admitted, [])
+        second = LLMTicket.objects.get(state="waiting").pk
+        self.assertNotEqual(first, second)
+        scheduler._finish(blocker.pk, 1)
+        thread.join(5)
+        self.assertEqual(admitted, [(second, 1)])
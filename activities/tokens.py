@@ -0,0 +1,110 @@
+"""
+Token estimates and per-model token budgets, used to size the parts a long
+document is split into before rewriting.
+
+The estimator is chosen with LLM_TOKEN_ESTIMATOR: "heuristic" (default, no
+dependencies), "tiktoken" (needs the tiktoken package) or the dotted path of
+any callable taking a string and returning a token count.
+"""
+import re
+import threading
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.utils.module_loading import import_string
+
+try:
+    import tiktoken
+except ImportError:  # only needed by the "tiktoken" estimator
+    tiktoken = None
+
+# Context window and maximum completion length, in tokens. LLM_MODEL_BUDGETS
+# adds or overrides entries; models not listed use "default".
+MODEL_BUDGETS = {
+    "openai/gpt-3.5-turbo": {"context": 16385, "output": 4096},
+    "openai/gpt-4o-mini": {"context": 128000, "output": 16384},
+    "openai/gpt-4o": {"context": 128000, "output": 16384},
+    "anthropic/claude-3.5-haiku": {"context": 200000, "output": 8192},
+    "default": {"context": 8192, "output": 2048},
+}
+
+_PIECE = re.compile(r"[^\W\d_]+|\d+|[^\w\s]|_+")
+
+
+def estimate_heuristic(text):
+    """
+    Dependency-free estimate close to BPE tokenizers on English prose: short
+    words are one token, longer words about one per four letters, and digits
+    and punctuation cost more than their length suggests.
+    """
+    tokens = 0
+    for match in _PIECE.finditer(text):
+        piece = match.group()
+        if piece[0].isdigit():
+            tokens += (len(piece) + 2) // 3
+        elif piece[0].isalpha():
+            tokens += 1 if len(piece) <= 6 else (len(piece) + 3) // 4
+        else:
+            tokens += 1
+    return tokens
+
+
+def _tiktoken_estimator():
+    if tiktoken is None:
+        raise ImproperlyConfigured("LLM_TOKEN_ESTIMATOR='tiktoken' needs the 'tiktoken' package.")
+    encoding = tiktoken.get_encoding("cl100k_base")
+    return lambda text: len(encoding.encode(text, disallowed_special=()))
+
+
+_estimator = None
+_estimator_name = None
+_estimator_lock = threading.Lock()
+
+
+def get_estimator():
+    """The callable selected by LLM_TOKEN_ESTIMATOR."""
+    global _estimator, _estimator_name
+    name = settings.LLM_TOKEN_ESTIMATOR
+    if _estimator is None or _estimator_name != name:
+        with _estimator_lock:
+            if name == "heuristic":
+                _estimator = estimate_heuristic
+            elif name == "tiktoken":
+                _estimator = _tiktoken_estimator()
+            else:
+                _estimator = import_string(name)
+            _estimator_name = name
+    return _estimator
+
+
+def estimate_tokens(text):
+    return get_estimator()(text)
+
+
+def model_budget(model=None):
+    """{"context": ..., "output": ...} for `model` (default: LLM_MODEL)."""
+    budgets = {**MODEL_BUDGETS, **settings.LLM_MODEL_BUDGETS}
+    return budgets.get(model or settings.LLM_MODEL, budgets["default"])
+
+
+def part_budget(prompt_tokens, model=None):
+    """
+    Most input tokens one rewrite pass may carry: the prompt and part must fit
+    the context next to a full-length answer, and the rewritten part (about
+    LLM_REWRITE_EXPANSION times the input) must fit the output limit.
+    """
+    budget = model_budget(model)
+    by_context = budget["context"] - budget["output"] - prompt_tokens
+    by_output = int(budget["output"] / settings.LLM_REWRITE_EXPANSION)
+    return max(1, min(by_context, by_output))
+
+
+def merge_budget(prompt_tokens, model=None):
+    """
+    Most seam tokens one normalization merge may carry: the merged seams come
+    back about as long as they were sent, so they must fit the output limit,
+    and the prompt and seams must fit the context next to them.
+    """
+    budget = model_budget(model)
+    by_context = budget["context"] - budget["output"] - prompt_tokens
+    return max(1, min(by_context, budget["output"]))
@@ -0,0 +1,32 @@
+import hashlib
+
+from django.core.files.uploadhandler import FileUploadHandler
+
+
+def fingerprint_text(text):
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+class HashingUploadHandler(FileUploadHandler):
+    """
+    Computes a SHA-256 of each uploaded file while Django streams it in, then
+    passes the data on unchanged to the regular handlers. Digests are kept by
+    form field name in `digests`.
+    """
+
+    def __init__(self, request=None):
+        super().__init__(request)
+        self.digests = {}
+        self._hasher = None
+
+    def new_file(self, *args, **kwargs):
+        super().new_file(*args, **kwargs)
+        self._hasher = hashlib.sha256()
+
+    def receive_data_chunk(self, raw_data, start):
+        self._hasher.update(raw_data)
+        return raw_data
+
+    def file_complete(self, file_size):
+        self.digests[self.field_name] = self._hasher.hexdigest()
+        return None
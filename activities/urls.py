@@ -1,9 +1,26 @@
+from django.conf import settings
 from django.urls import path
-from .views import LessonsListView, LessonDetailView, LessonCreateView, grade_quiz
+from .views import (
+    LessonsListView, LessonDetailView, LessonCreateView, LessonJobDetailView, LessonSlidesView, grade_quiz,
+    lesson_quiz_stats, QuizAttemptDetailView, QuizAttemptsListView, search_lessons, user_quiz_stats,
+)
+from . import async_views
+
+if settings.ACTIVITIES_ASYNC_VIEWS:
+    lesson_create_view, grade_quiz_view = async_views.lesson_create, async_views.grade_quiz
+else:
+    lesson_create_view, grade_quiz_view = LessonCreateView.as_view(), grade_quiz
 
 urlpatterns = [
-    path("lessons/create/", LessonCreateView.as_view(), name="lesson-create"),
+    path("lessons/create/", lesson_create_view, name="lesson-create"),
+    path("lessons/jobs/<int:pk>/", LessonJobDetailView.as_view(), name="lesson-job-detail"),
     path("lessons/", LessonsListView.as_view(), name="lesson-list"),
+    path("lessons/search/", search_lessons, name="lesson-search"),
     path("lessons/<int:pk>/", LessonDetailView.as_view(), name="lesson-detail"),
-    path("lessons/<int:pk>/grade-quiz/", grade_quiz, name="grade-quiz"),
+    path("lessons/<int:pk>/slides/", LessonSlidesView.as_view(), name="lesson-slides"),
+    path("lessons/<int:pk>/grade-quiz/", grade_quiz_view, name="grade-quiz"),
+    path("lessons/<int:pk>/quiz-stats/", lesson_quiz_stats, name="lesson-quiz-stats"),
+    path("quiz/attempts/", QuizAttemptsListView.as_view(), name="quiz-attempt-list"),
+    path("quiz/attempts/<int:pk>/", QuizAttemptDetailView.as_view(), name="quiz-attempt-detail"),
+    path("quiz/stats/", user_quiz_stats, name="user-quiz-stats"),
 ]
@@ -1,18 +1,294 @@
-def chunk_text(text, max_length=500):
+import asyncio
+import contextvars
+import inspect
+import re
+import time
+from bisect import bisect_right
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from itertools import accumulate
+
+from django.db import connections
+
+
+PARAGRAPH = "\n\n"   # marker yielded by iter_words at blank lines
+
+_TOKEN = re.compile(r"\S+|\s+")
+_TAIL = re.compile(r"(?:\S+|\s+)\Z")
+_PARAGRAPH_BREAK = re.compile(r"\n\s*\n")
+_SENTENCE_END = re.compile(r"[.!?][\"')\]]*\Z")
+
+
+def _tokens(text):
+    for m in _TOKEN.finditer(text):
+        token = m.group()
+        if not token[0].isspace():
+            yield token
+        elif token.count("\n") >= 2:
+            yield PARAGRAPH
+
+
+def iter_words(source):
+    """
+    Yield the words of `source` plus a PARAGRAPH marker for every blank line.
+    `source` is a string or an iterable of text pieces (e.g. a token stream);
+    words split across pieces are joined back together.
+    """
+    if isinstance(source, str):
+        yield from _tokens(source)
+        return
+    pending = ""
+    for piece in source:
+        pending += piece
+        # The last word or whitespace run may continue in the next piece
+        tail = _TAIL.search(pending)
+        tail_start = tail.start() if tail else len(pending)
+        yield from _tokens(pending[:tail_start])
+        pending = pending[tail_start:]
+    yield from _tokens(pending)
+
+
+def _is_sentence_end(word):
+    return word[-1] in ".!?" or (word[-1] in "\"')]" and _SENTENCE_END.search(word) is not None)
+
+
+def _cut_chunks(words, sentence_ends, paragraph_ends, max_length, compat, first, final):
+    """
+    Cut `words` into chunks and return (chunks, number of words used).
+
+    `sentence_ends` / `paragraph_ends` are sorted word counts after which a
+    sentence / paragraph ends. Unless `final`, a trailing chunk that more words
+    could still change is left for the next call. Chunk lengths come from a
+    prefix sum of word lengths, so the cost is linear in the number of words.
+    """
+    prefix = [0]
+    prefix.extend(accumulate(len(word) + 1 for word in words))
+    count = len(words)
+    min_fill = max_length // 2
+    boundaries = None if compat else sorted(set(sentence_ends) | set(paragraph_ends))
+    chunks = []
+    start = 0
+
+    while start < count:
+        # Longest run of words starting at `start` whose joined length fits
+        end = bisect_right(prefix, prefix[start] + max_length + 1) - 1
+        cut = None
+
+        if not compat:
+            # Blank line after a chunk that is at least half full: stop there
+            i = bisect_right(paragraph_ends, start)
+            while i < len(paragraph_ends) and paragraph_ends[i] <= end:
+                if prefix[paragraph_ends[i]] - prefix[start] - 1 >= min_fill:
+                    cut = paragraph_ends[i]
+                    break
+                i += 1
+
+        if cut is None:
+            if end == start:
+                # A single word longer than max_length becomes its own chunk
+                if compat and first and start == 0:
+                    chunks.append("")   # the original implementation emitted an empty chunk here
+                cut = start + 1
+            elif end >= count:
+                if not final:
+                    break
+                cut = count
+            else:
+                cut = end
+                if not compat:
+                    # Prefer the last sentence/paragraph end that keeps the chunk half full
+                    i = bisect_right(boundaries, end) - 1
+                    if i >= 0 and boundaries[i] > start and prefix[boundaries[i]] - prefix[start] - 1 >= min_fill:
+                        cut = boundaries[i]
+
+        chunks.append(" ".join(words[start:cut]))
+        start = cut
+
+    return chunks, start
+
+
+def _index_text(text, compat):
+    if compat:
+        return text.split(), [], []
+    words, paragraph_ends = [], []
+    for paragraph in _PARAGRAPH_BREAK.split(text):
+        if words and (not paragraph_ends or paragraph_ends[-1] != len(words)):
+            paragraph_ends.append(len(words))
+        words.extend(paragraph.split())
+    sentence_ends = [i for i, word in enumerate(words, start=1) if _is_sentence_end(word)]
+    return words, sentence_ends, paragraph_ends
+
+
+def iter_chunks(source, max_length=500, compat=False, batch_size=1024):
+    """
+    Lazily break text (a string or an iterable of text pieces) into chunks of
+    roughly `max_length` characters, in linear time.
+
+    By default chunks end at sentence or paragraph boundaries when that keeps
+    them at least half full; single words longer than `max_length` become their
+    own chunk. `compat=True` reproduces the original word-packing output exactly.
+    """
+    if isinstance(source, str):
+        words, sentence_ends, paragraph_ends = _index_text(source, compat)
+        chunks, _ = _cut_chunks(words, sentence_ends, paragraph_ends, max_length, compat, True, True)
+        yield from chunks
+        return
+
+    stream = ChunkStream(max_length=max_length, compat=compat, batch_size=batch_size)
+    for piece in source:
+        yield from stream.feed(piece)
+    yield from stream.close()
+
+
+class ChunkStream:
+    """
+    Push-style iter_chunks for text that arrives in pieces (e.g. LLM tokens).
+    `feed(piece)` returns the chunks that can no longer change, `close()` the
+    rest; together they give exactly what chunk_text gives for the joined text.
+    Cutting happens once `batch_size` words are buffered, so a small batch
+    size emits chunks sooner.
+    """
+
+    def __init__(self, max_length=500, compat=False, batch_size=1024):
+        self.max_length = max_length
+        self.compat = compat
+        self.batch_size = batch_size
+        self._pending = ""
+        self._words, self._sentence_ends, self._paragraph_ends = [], [], []
+        self._first = True
+
+    def feed(self, piece):
+        self._pending += piece
+        # The last word or whitespace run may continue in the next piece
+        tail = _TAIL.search(self._pending)
+        tail_start = tail.start() if tail else len(self._pending)
+        text, self._pending = self._pending[:tail_start], self._pending[tail_start:]
+        return self._add(_tokens(text))
+
+    def close(self):
+        chunks = self._add(_tokens(self._pending))
+        self._pending = ""
+        rest, _ = _cut_chunks(self._words, self._sentence_ends, self._paragraph_ends,
+                              self.max_length, self.compat, self._first, True)
+        self._words, self._sentence_ends, self._paragraph_ends = [], [], []
+        return chunks + rest
+
+    def _add(self, tokens):
+        # Cut in batches and keep only the undecided tail
+        chunks = []
+        words, sentence_ends, paragraph_ends = self._words, self._sentence_ends, self._paragraph_ends
+        for word in tokens:
+            if word is PARAGRAPH:
+                if words and (not paragraph_ends or paragraph_ends[-1] != len(words)):
+                    paragraph_ends.append(len(words))
+                continue
+            words.append(word)
+            if _is_sentence_end(word):
+                sentence_ends.append(len(words))
+            if len(words) >= self.batch_size:
+                cut, used = _cut_chunks(words, sentence_ends, paragraph_ends,
+                                        self.max_length, self.compat, self._first, False)
+                if cut:
+                    self._first = False
+                    chunks.extend(cut)
+                    words = words[used:]
+                    sentence_ends = [i - used for i in sentence_ends if i > used]
+                    paragraph_ends = [i - used for i in paragraph_ends if i > used]
+                self.batch_size = max(self.batch_size, 2 * len(words))
+        self._words, self._sentence_ends, self._paragraph_ends = words, sentence_ends, paragraph_ends
+        return chunks
+
+
+def chunk_text(text, max_length=500, compat=False):
     """
     Break text into smaller chunks (e.g., ~500 characters each).
     """
-    words = text.split()
-    chunks, current = [], []
+    return list(iter_chunks(text, max_length=max_length, compat=compat))
+
+
+def bounded_map(func, items, max_workers=4, retries=0, retry_delay=1.0, on_done=None, retry_if=None):
+    """
+    Call func(item) for every item with at most `max_workers` calls in flight.
+    Results come back in the same order as `items`. Each item is retried up to
+    `retries` times (with a growing delay) before its error is raised; with
+    `retry_if`, only errors for which retry_if(error) is true are retried.
+    `on_done(finished_count)` runs in the calling thread as items complete.
+    """
+    items = list(items)
+    if not items:
+        return []
+
+    def attempt(item):
+        for n in range(retries + 1):
+            try:
+                return func(item)
+            except Exception as e:
+                if n == retries or (retry_if is not None and not retry_if(e)):
+                    raise
+                time.sleep(retry_delay * (2 ** n))
 
-    for word in words:
-        if len(" ".join(current + [word])) > max_length:
-            chunks.append(" ".join(current))
-            current = [word]
-        else:
-            current.append(word)
+    if max_workers <= 1 or len(items) == 1:
+        results = []
+        for item in items:
+            results.append(attempt(item))
+            if on_done:
+                on_done(len(results))
+        return results
+
+    def run(item):
+        try:
+            return attempt(item)
+        finally:
+            # Pool threads are short-lived; don't leave their DB connections open
+            connections.close_all()
+
+    results = [None] * len(items)
+    executor = ThreadPoolExecutor(max_workers=min(max_workers, len(items)))
+    try:
+        # Each call runs in a copy of the caller's context (request timings, ...)
+        futures = {executor.submit(contextvars.copy_context().run, run, item): i for i, item in enumerate(items)}
+        for finished, future in enumerate(as_completed(futures), start=1):
+            results[futures[future]] = future.result()
+            if on_done:
+                on_done(finished)
+    finally:
+        # On failure don't start the remaining items
+        executor.shutdown(wait=True, cancel_futures=True)
+    return results
+
+
+async def gather_bounded(func, items, max_workers=4, retries=0, retry_delay=1.0, on_done=None, retry_if=None):
+    """
+    Async counterpart of bounded_map: await func(item) for every item with at
+    most `max_workers` running at once, results in input order, per-item retry.
+    `on_done(finished_count)` may be a plain function or a coroutine function.
+    """
+    items = list(items)
+    semaphore = asyncio.Semaphore(max(1, max_workers))
+    finished = 0
 
-    if current:
-        chunks.append(" ".join(current))
+    async def run(item):
+        nonlocal finished
+        async with semaphore:
+            for n in range(retries + 1):
+                try:
+                    result = await func(item)
+                    break
+                except Exception as e:
+                    if n == retries or (retry_if is not None and not retry_if(e)):
+                        raise
+                    await asyncio.sleep(retry_delay * (2 ** n))
+        finished += 1
+        if on_done:
+            done = on_done(finished)
+            if inspect.isawaitable(done):
+                await done
+        return result
 
-    return chunks
+    tasks = [asyncio.ensure_future(run(item)) for item in items]
+    try:
+        return await asyncio.gather(*tasks)
+    except BaseException:
+        # On failure don't leave the remaining items running
+        for task in tasks:
+            task.cancel()
+        raise
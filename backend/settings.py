@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.2/ref/settings/
 """
 
+import json
 from decouple import config
 from pathlib import Path
 from datetime import timedelta
@@ -59,6 +60,7 @@ INSTALLED_APPS = [
 
 MIDDLEWARE = [
     'corsheaders.middleware.CorsMiddleware',            # Move to top (after this comment block)
+    'activities.metrics.ServerTimingMiddleware',        # removes itself unless METRICS_ENABLED
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -71,7 +73,7 @@ MIDDLEWARE = [
 
 REST_FRAMEWORK = {
     "DEFAULT_AUTHENTICATION_CLASSES": (
-        "rest_framework_simplejwt.authentication.JWTAuthentication",
+        "users_accounts.authentication.CachedJWTAuthentication",
     )
 }
 
@@ -100,6 +102,23 @@ SIMPLE_JWT = {
     'TOKEN_TYPE_CLAIM': 'token_type',
 }
 
+# Seconds a user resolved from a JWT stays in the per-process cache (0 turns it off)
+JWT_USER_CACHE_TTL = config('JWT_USER_CACHE_TTL', default=300, cast=int)
+# Users kept in that cache per process
+JWT_USER_CACHE_SIZE = config('JWT_USER_CACHE_SIZE', default=4096, cast=int)
+# Seconds between checks of the database for changes to a cached user
+JWT_USER_CACHE_SYNC = config('JWT_USER_CACHE_SYNC', default=5, cast=float)
+# Build request.user from token claims instead of loading it from the database
+JWT_AUTH_STATELESS = config('JWT_AUTH_STATELESS', default=False, cast=bool)
+
+# Refresh-token blacklist filter (users_accounts.blacklist)
+TOKEN_BLACKLIST_ERROR_RATE = config('TOKEN_BLACKLIST_ERROR_RATE', default=0.001, cast=float)  # filter hits that still need a query
+TOKEN_BLACKLIST_SYNC = config('TOKEN_BLACKLIST_SYNC', default=30, cast=float)              # seconds between syncs without a cache marker change
+TOKEN_BLACKLIST_REBUILD = config('TOKEN_BLACKLIST_REBUILD', default=3600, cast=float)      # seconds between full rebuilds
+# Expired tokens are purged by the lesson worker this often (seconds, 0 = never), in batches
+TOKEN_PURGE_INTERVAL = config('TOKEN_PURGE_INTERVAL', default=6 * 3600, cast=int)
+TOKEN_PURGE_BATCH_SIZE = config('TOKEN_PURGE_BATCH_SIZE', default=1000, cast=int)
+
 ROOT_URLCONF = 'backend.urls'
 
 TEMPLATES = [
@@ -181,6 +200,10 @@ USE_TZ = True
 
 STATIC_URL = 'static/'
 
+# default_storage: uploads wait here for their lesson job. Job workers on other machines need
+# this on shared disk, or a shared storage backend in STORAGES
+MEDIA_ROOT = config('MEDIA_ROOT', default=str(BASE_DIR / 'media'))
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.2/ref/settings/#default-auto-field
 
@@ -210,3 +233,86 @@ CORS_ALLOWED_HEADERS = [
     'x-csrftoken',
     'x-requested-with',
 ]
+
+# Lesson generation jobs
+# Threads inside each web process that pick up new jobs right away.
+# Set to 0 when jobs are handled only by `python manage.py run_lesson_worker`.
+LESSON_JOB_WORKERS = config('LESSON_JOB_WORKERS', default=2, cast=int)
+LESSON_JOB_WORKER_CONCURRENCY = config('LESSON_JOB_WORKER_CONCURRENCY', default=4, cast=int)
+# A job still "running" after this many seconds is assumed dead and requeued by the worker
+LESSON_JOB_STALE_AFTER = config('LESSON_JOB_STALE_AFTER', default=1800, cast=int)
+# Parts of a multi-pass lesson rewritten at the same time, and retries per part. Only
+# failures the LLM client doesn't retry itself (LLM_MAX_RETRIES) are retried per part:
+# a malformed answer or a stream cut off by a provider error event
+LESSON_REWRITE_CONCURRENCY = config('LESSON_REWRITE_CONCURRENCY', default=4, cast=int)
+LESSON_REWRITE_RETRIES = config('LESSON_REWRITE_RETRIES', default=2, cast=int)
+# Rewritten parts whose seams (end of one, start of the next) one normalization call merges;
+# merges run level by level, in parallel (see pipeline.normalize_tree)
+LESSON_NORMALIZE_FAN_IN = config('LESSON_NORMALIZE_FAN_IN', default=4, cast=int)
+# Served over ASGI (backend/asgi.py turns this on): lesson creation and quiz grading use
+# the native async views, and new jobs run as tasks on the event loop, at most this many at once
+ACTIVITIES_ASYNC_VIEWS = config('ACTIVITIES_ASYNC_VIEWS', default=False, cast=bool)
+LESSON_JOB_ASYNC_CONCURRENCY = config('LESSON_JOB_ASYNC_CONCURRENCY', default=8, cast=int)
+
+# LLM (OpenRouter chat completions)
+LLM_API_URL = config('LLM_API_URL', default='https://openrouter.ai/api/v1/chat/completions')
+LLM_API_KEY = config('OPENROUTER_API_KEY', default='')   # required for any LLM call
+LLM_MODEL = config('LLM_MODEL', default='openai/gpt-3.5-turbo')
+LLM_TEMPERATURE = config('LLM_TEMPERATURE', default=0.7, cast=float)
+LLM_CONNECT_TIMEOUT = config('LLM_CONNECT_TIMEOUT', default=10, cast=float)   # seconds
+LLM_READ_TIMEOUT = config('LLM_READ_TIMEOUT', default=180, cast=float)        # seconds
+LLM_MAX_RETRIES = config('LLM_MAX_RETRIES', default=4, cast=int)
+LLM_BACKOFF_BASE = config('LLM_BACKOFF_BASE', default=1.0, cast=float)        # seconds, doubled per retry
+LLM_BACKOFF_MAX = config('LLM_BACKOFF_MAX', default=30.0, cast=float)
+LLM_POOL_SIZE = config('LLM_POOL_SIZE', default=16, cast=int)                 # keep-alive connections per process
+# Token counting for splitting: "heuristic", "tiktoken" or a dotted path to a callable(text) -> int
+LLM_TOKEN_ESTIMATOR = config('LLM_TOKEN_ESTIMATOR', default='heuristic')
+# Extra/overriding context and output limits per model, as JSON, e.g.
+# {"my/model": {"context": 32768, "output": 8192}} (see activities/tokens.py)
+LLM_MODEL_BUDGETS = config('LLM_MODEL_BUDGETS', default='{}', cast=json.loads)
+# Expected length of a rewritten part relative to its input, used to keep answers within the output limit
+LLM_REWRITE_EXPANSION = config('LLM_REWRITE_EXPANSION', default=1.15, cast=float)
+# Admission of LLM calls across all worker processes (activities/scheduler.py): at most
+# LLM_MAX_CONCURRENCY calls in flight and LLM_TOKENS_PER_MINUTE tokens per minute
+# (0 = no limit; both 0, the default, turns the scheduler off). Grading goes ahead of lesson generation.
+LLM_MAX_CONCURRENCY = config('LLM_MAX_CONCURRENCY', default=0, cast=int)
+LLM_TOKENS_PER_MINUTE = config('LLM_TOKENS_PER_MINUTE', default=0, cast=int)
+LLM_SCHEDULER_POLL = config('LLM_SCHEDULER_POLL', default=0.25, cast=float)         # first wait between admission checks
+LLM_SCHEDULER_POLL_MAX = config('LLM_SCHEDULER_POLL_MAX', default=2.0, cast=float)  # ... doubling up to this
+LLM_SCHEDULER_TIMEOUT = config('LLM_SCHEDULER_TIMEOUT', default=300, cast=float)    # give up waiting after this long
+LLM_SCHEDULER_LEASE = config('LLM_SCHEDULER_LEASE', default=900, cast=int)          # a running call older than this is assumed dead
+LLM_SCHEDULER_STALE_AFTER = config('LLM_SCHEDULER_STALE_AFTER', default=30, cast=int)   # a waiter silent this long is dropped
+# Cache of LLM responses keyed by (model, temperature, prompt): "memory", "disk", "database" or "none"
+LLM_CACHE_BACKEND = config('LLM_CACHE_BACKEND', default='memory')
+LLM_CACHE_TTL = config('LLM_CACHE_TTL', default=7 * 24 * 3600, cast=int)   # seconds
+LLM_CACHE_MAX_ENTRIES = config('LLM_CACHE_MAX_ENTRIES', default=2000, cast=int)
+LLM_CACHE_DIR = config('LLM_CACHE_DIR', default=str(BASE_DIR / '.llm_cache'))
+
+# PDF extraction: worker processes per document (0 = extract in the job thread),
+# pages per process task, and per-page guards (seconds / characters)
+PDF_EXTRACT_PROCESSES = config('PDF_EXTRACT_PROCESSES', default=0, cast=int)
+PDF_PAGES_PER_TASK = config('PDF_PAGES_PER_TASK', default=25, cast=int)
+PDF_PAGE_TIME_LIMIT = config('PDF_PAGE_TIME_LIMIT', default=10, cast=float)
+PDF_MAX_PAGE_CHARS = config('PDF_MAX_PAGE_CHARS', default=20000, cast=int)
+
+# PowerPoint extraction: include each slide's speaker notes after its text
+PPTX_INCLUDE_NOTES = config('PPTX_INCLUDE_NOTES', default=True, cast=bool)
+
+# Quiz grading: per-question explanation calls in flight when the batched call misses some
+GRADE_EXPLANATION_CONCURRENCY = config('GRADE_EXPLANATION_CONCURRENCY', default=4, cast=int)
+
+# Stage timers: Server-Timing headers, per-job timings and Prometheus metrics at /metrics
+# (kept per process). Off by default; METRICS_TOKEN, when set, is required as a bearer token.
+METRICS_ENABLED = config('METRICS_ENABLED', default=False, cast=bool)
+METRICS_TOKEN = config('METRICS_TOKEN', default='')
+
+# Cache shared by all worker processes on the host (lesson read cache, ...)
+CACHES = {
+    'default': {
+        'BACKEND': config('CACHE_BACKEND', default='django.core.cache.backends.filebased.FileBasedCache'),
+        'LOCATION': config('CACHE_LOCATION', default=str(BASE_DIR / '.cache')),
+        'OPTIONS': {'MAX_ENTRIES': config('CACHE_MAX_ENTRIES', default=5000, cast=int)},
+    }
+}
+# Seconds a serialized lesson list/detail response stays cached (writes invalidate it earlier)
+LESSON_READ_CACHE_TTL = config('LESSON_READ_CACHE_TTL', default=300, cast=int)
@@ -16,16 +16,15 @@ Including another URLconf
 """
 from django.contrib import admin
 from django.urls import path, include
-from rest_framework_simplejwt.views import (
-    TokenObtainPairView,
-    TokenRefreshView,
-)
+from activities.metrics import metrics_view
+from users_accounts.views import ClaimsTokenObtainPairView, FilteredTokenRefreshView
 
 urlpatterns = [
     path("admin/", admin.site.urls),
     path("api/", include("users_accounts.urls")),
     path("activities/", include("activities.urls")),
     # our app endpoints
-    path("api/token/", TokenObtainPairView.as_view(), name="token_obtain_pair"),
-    path("api/token/refresh/", TokenRefreshView.as_view(), name="token_refresh"),
+    path("api/token/", ClaimsTokenObtainPairView.as_view(), name="token_obtain_pair"),
+    path("api/token/refresh/", FilteredTokenRefreshView.as_view(), name="token_refresh"),
+    path("metrics", metrics_view, name="metrics"),
 ]
@@ -0,0 +1,149 @@
+"""
+JWT authentication without a user query on every request.
+
+CachedJWTAuthentication keeps the users it loads in a small per-process LRU
+(JWT_USER_CACHE_SIZE users, each for at most JWT_USER_CACHE_TTL seconds). With
+JWT_AUTH_STATELESS on it loads no users at all: request.user is built from the
+token's claims (id, plus the username and email added at login) and any other
+field is read from the database only if something asks for it.
+
+Saving or deleting a user (see signals) evicts it here and records the change
+in the user's UserAuthState row, in the same transaction. Every process
+re-reads a user's row at most every JWT_USER_CACHE_SYNC seconds: a newer change
+drops the cached user, and a password change or deactivation also rejects
+tokens issued before it, in both modes. Writes that skip model signals
+(QuerySet.update) must call user_changed() themselves.
+"""
+import copy
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, transaction
+from django.utils.translation import gettext_lazy as _
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import AuthenticationFailed, InvalidToken
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.utils import get_md5_hash_password
+
+from .models import UserAuthState
+
+# Claims copied onto stateless users (set at login, see ClaimsTokenObtainPairView)
+TOKEN_USER_CLAIMS = ("username", "email")
+
+
+class _Entry:
+    __slots__ = ("user", "loaded", "checked", "changed", "revoked")
+
+    def __init__(self, now):
+        self.user = None
+        self.loaded = now
+        self.checked = None
+        self.changed = None
+        self.revoked = None
+
+
+_lock = threading.Lock()
+_entries = OrderedDict()   # user id (as in tokens, a string) -> _Entry, least recently used first
+
+
+def evict(user_id):
+    """Forget a user in this process."""
+    with _lock:
+        _entries.pop(str(user_id), None)
+
+
+def clear():
+    with _lock:
+        _entries.clear()
+
+
+def user_changed(user_id, revoke=False):
+    """
+    Record that a user changed (evicting it here after commit); with
+    `revoke`, tokens issued before now stop working too.
+    """
+    user_id = str(user_id)
+    changes = {"changed": time.time_ns()}
+    if revoke:
+        # Token iat claims are whole seconds; a token from the same second survives
+        changes["revoked"] = int(time.time())
+    UserAuthState.objects.bulk_create([UserAuthState(user_id=user_id)], ignore_conflicts=True)
+    UserAuthState.objects.filter(user_id=user_id).update(**changes)
+    transaction.on_commit(lambda: evict(user_id))
+
+
+def _entry(user_id, now):
+    with _lock:
+        entry = _entries.get(user_id)
+        if entry is not None and now - entry.loaded < settings.JWT_USER_CACHE_TTL:
+            _entries.move_to_end(user_id)
+            return entry
+        entry = _Entry(now)
+        if settings.JWT_USER_CACHE_TTL > 0:
+            _entries[user_id] = entry
+            while len(_entries) > settings.JWT_USER_CACHE_SIZE:
+                _entries.popitem(last=False)
+        return entry
+
+
+def _sync(entry, user_id, now):
+    """Pick up changes other processes made to the user, at most every JWT_USER_CACHE_SYNC seconds."""
+    if entry.checked is not None and now - entry.checked < settings.JWT_USER_CACHE_SYNC:
+        return
+    state = UserAuthState.objects.filter(user_id=user_id).values_list("changed", "revoked").first()
+    changed, revoked = state or (None, None)
+    if entry.checked is not None and changed != entry.changed:
+        entry.user = None
+    entry.changed = changed
+    entry.revoked = revoked
+    entry.checked = now
+
+
+class CachedJWTAuthentication(JWTAuthentication):
+    """JWTAuthentication that resolves users from a per-process cache or from the token alone."""
+
+    def get_user(self, validated_token):
+        try:
+            user_id = str(validated_token[api_settings.USER_ID_CLAIM])
+        except KeyError:
+            raise InvalidToken(_("Token contained no recognizable user identification"))
+
+        now = time.monotonic()
+        entry = _entry(user_id, now)
+        _sync(entry, user_id, now)
+        issued = validated_token.get("iat")
+        if entry.revoked is not None and issued is not None and issued < entry.revoked:
+            raise AuthenticationFailed(_("The user's password has been changed."), code="password_changed")
+
+        if settings.JWT_AUTH_STATELESS:
+            return self.token_user(validated_token, user_id)
+
+        user = entry.user
+        if user is None:
+            try:
+                user = self.user_model.objects.get(**{api_settings.USER_ID_FIELD: user_id})
+            except self.user_model.DoesNotExist:
+                raise AuthenticationFailed(_("User not found"), code="user_not_found")
+            entry.user = user
+        self.check_user(user, validated_token)
+        # Each request gets its own copy, so nothing set on it leaks into the cache
+        return copy.copy(user)
+
+    def check_user(self, user, validated_token):
+        """The checks JWTAuthentication.get_user makes on a freshly loaded user."""
+        if api_settings.CHECK_USER_IS_ACTIVE and not user.is_active:
+            raise AuthenticationFailed(_("User is inactive"), code="user_inactive")
+        if api_settings.CHECK_REVOKE_TOKEN:
+            if validated_token.get(api_settings.REVOKE_TOKEN_CLAIM) != get_md5_hash_password(user.password):
+                raise AuthenticationFailed(_("The user's password has been changed."), code="password_changed")
+
+    def token_user(self, validated_token, user_id):
+        """A user instance made from the token's claims, without a query."""
+        id_field = self.user_model._meta.get_field(api_settings.USER_ID_FIELD)
+        known = {id_field.attname: id_field.to_python(user_id), "is_active": True}
+        known.update((claim, validated_token[claim]) for claim in TOKEN_USER_CLAIMS if claim in validated_token)
+        # from_db wants the values in field order; fields left out load on first access
+        fields = [f.attname for f in self.user_model._meta.concrete_fields if f.attname in known]
+        return self.user_model.from_db(DEFAULT_DB_ALIAS, fields, [known[name] for name in fields])
@@ -0,0 +1,193 @@
+"""
+Refresh-token blacklist lookups without a query, and purging of expired tokens.
+
+Each process keeps a Bloom filter of the blacklisted token ids (jti). A token
+the filter has never seen is certainly not blacklisted, which is the answer for
+nearly every refresh; only a hit goes on to simplejwt's database check, so a
+false positive (TOKEN_BLACKLIST_ERROR_RATE) costs one query and never lets a
+blacklisted token through.
+
+Tokens blacklisted here are added right away (see signals) and bump a marker
+in the shared Django cache. Before answering, a process compares that marker
+with the one it last saw and, when it moved, loads the newly blacklisted rows.
+A cleared or evicted marker is created again before those rows are read, so a
+token blacklisted meanwhile is either loaded or moves the new marker. With no
+marker to go by (a per-process or dummy cache, or one that won't keep it) every
+lookup goes to the database, as it would without the filter. Rows written
+without the signals (bulk_create, raw SQL) don't move the marker; they are
+loaded by the next sync, at the latest after TOKEN_BLACKLIST_SYNC seconds.
+
+The filter is rebuilt from the unexpired rows every TOKEN_BLACKLIST_REBUILD
+seconds, or sooner once it holds more tokens than it was sized for.
+
+purge_expired() deletes expired outstanding tokens and their blacklist rows in
+batches; the lesson worker runs it every TOKEN_PURGE_INTERVAL seconds and
+`manage.py purge_tokens` runs it from cron.
+"""
+import hashlib
+import math
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import DEFAULT_CACHE_ALIAS, cache, caches
+from django.core.cache.backends.dummy import DummyCache
+from django.core.cache.backends.locmem import LocMemCache
+from django.db import transaction
+from django.db.models import Max
+from django.utils import timezone
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.token_blacklist.models import BlacklistedToken, OutstandingToken
+from rest_framework_simplejwt.tokens import RefreshToken
+
+MARKER_KEY = "auth:blacklist:changed"
+
+# Ids are taken when a row is inserted but become visible at commit, so a sync
+# also re-reads this many ids below the highest one seen to catch late commits
+_SYNC_OVERLAP = 256
+
+_MIN_CAPACITY = 10_000
+
+# Caches other processes don't see, so they can't carry the marker
+_PROCESS_LOCAL = (LocMemCache, DummyCache)
+
+
+class BloomFilter:
+    def __init__(self, capacity, error_rate):
+        self.capacity = capacity
+        self.size = max(8, math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+        self.count = 0
+
+    def _positions(self, key):
+        digest = hashlib.blake2b(key.encode(), digest_size=16).digest()
+        first = int.from_bytes(digest[:8], "little")
+        step = int.from_bytes(digest[8:], "little") | 1
+        return [(first + i * step) % self.size for i in range(self.hashes)]
+
+    def add(self, key):
+        for position in self._positions(key):
+            self.bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def __contains__(self, key):
+        bits = self.bits
+        return all(bits[position >> 3] & (1 << (position & 7)) for position in self._positions(key))
+
+
+class _State:
+    def __init__(self):
+        self.filter = None
+        self.last_id = 0       # highest BlacklistedToken id loaded
+        self.marker = None     # shared marker at the last sync
+        self.synced = 0.0      # monotonic time of the last sync
+        self.built = 0.0
+
+
+_state = _State()
+_lock = threading.Lock()
+
+
+def _rebuild(now):
+    last_id = BlacklistedToken.objects.aggregate(last=Max("id"))["last"] or 0
+    rows = BlacklistedToken.objects.filter(id__lte=last_id, token__expires_at__gt=timezone.now())
+    capacity = max(_MIN_CAPACITY, 2 * rows.count())
+    bloom = BloomFilter(capacity, settings.TOKEN_BLACKLIST_ERROR_RATE)
+    for jti in rows.values_list("token__jti", flat=True).iterator(chunk_size=5000):
+        bloom.add(jti)
+    _state.filter, _state.last_id = bloom, last_id
+    _state.built = _state.synced = now
+
+
+def _sync(now):
+    rows = BlacklistedToken.objects.filter(id__gt=_state.last_id - _SYNC_OVERLAP).values_list("id", "token__jti")
+    for row_id, jti in rows:
+        _state.filter.add(jti)
+        _state.last_id = max(_state.last_id, row_id)
+    _state.synced = now
+
+
+def _marker():
+    """The shared marker, created if missing; None when there is none to go by."""
+    if isinstance(caches[DEFAULT_CACHE_ALIAS], _PROCESS_LOCAL):
+        return None
+    marker = cache.get(MARKER_KEY)
+    if marker is None:
+        cache.add(MARKER_KEY, time.time_ns(), None)
+        marker = cache.get(MARKER_KEY)
+    return marker
+
+
+def _refresh(marker):
+    now = time.monotonic()
+    with _lock:
+        bloom = _state.filter
+        if bloom is None or bloom.count > bloom.capacity or now - _state.built > settings.TOKEN_BLACKLIST_REBUILD:
+            _rebuild(now)
+        elif marker != _state.marker or now - _state.synced > settings.TOKEN_BLACKLIST_SYNC:
+            _sync(now)
+        _state.marker = marker
+
+
+def might_be_blacklisted(jti):
+    """False when `jti` is certainly not blacklisted; True means ask the database."""
+    # Read before the rows: a later blacklisting moves it and the next lookup syncs
+    marker = _marker()
+    if marker is None:
+        return True
+    _refresh(marker)
+    return jti in _state.filter
+
+
+def blacklisted(jti):
+    """Record (after commit) that `jti` was blacklisted in this process."""
+    def mark():
+        with _lock:
+            if _state.filter is not None:
+                _state.filter.add(jti)
+        cache.set(MARKER_KEY, time.time_ns(), None)
+
+    transaction.on_commit(mark)
+
+
+def reset():
+    """Drop the filter; the next lookup rebuilds it."""
+    with _lock:
+        _state.filter = None
+
+
+class FilteredRefreshToken(RefreshToken):
+    """RefreshToken that only queries the blacklist for tokens the filter may hold."""
+
+    def check_blacklist(self):
+        if might_be_blacklisted(self.payload[api_settings.JTI_CLAIM]):
+            super().check_blacklist()
+
+
+def purge_expired(batch_size=None, pause=0.0):
+    """
+    Delete outstanding tokens that have expired, with their blacklist rows,
+    `batch_size` at a time. Returns (outstanding, blacklisted) rows deleted.
+    """
+    batch_size = batch_size or settings.TOKEN_PURGE_BATCH_SIZE
+    now = timezone.now()
+    outstanding = blacklisted_rows = 0
+    last_id = 0
+    while True:
+        # Walking the primary key keeps each batch an index range scan
+        ids = list(
+            OutstandingToken.objects.filter(id__gt=last_id, expires_at__lte=now)
+            .order_by("id").values_list("id", flat=True)[:batch_size]
+        )
+        if not ids:
+            break
+        with transaction.atomic():
+            blacklisted_rows += BlacklistedToken.objects.filter(token_id__in=ids).delete()[0]
+            outstanding += OutstandingToken.objects.filter(id__in=ids).delete()[0]
+        last_id = ids[-1]
+        if len(ids) < batch_size:
+            break
+        if pause:
+            time.sleep(pause)
+    return outstanding, blacklisted_rows
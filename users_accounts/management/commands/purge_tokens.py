@@ -0,0 +1,20 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from users_accounts import blacklist
+
+
+class Command(BaseCommand):
+    help = (
+        "Delete expired outstanding refresh tokens and their blacklist entries in batches "
+        "(the lesson worker also does this every TOKEN_PURGE_INTERVAL seconds)."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=settings.TOKEN_PURGE_BATCH_SIZE)
+        parser.add_argument("--pause", type=float, default=0.0,
+                            help="Seconds to sleep between batches, to go easy on a busy database.")
+
+    def handle(self, *args, **options):
+        outstanding, blacklisted = blacklist.purge_expired(options["batch_size"], options["pause"])
+        self.stdout.write(f"Purged {outstanding} expired token(s), {blacklisted} of them blacklisted")
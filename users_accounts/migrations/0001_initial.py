@@ -0,0 +1,22 @@
+# Generated by Django 5.2.5 on 2026-10-17 03:43
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UserAuthState',
+            fields=[
+                ('user_id', models.CharField(max_length=64, primary_key=True, serialize=False)),
+                ('changed', models.BigIntegerField(default=0)),
+                ('revoked', models.BigIntegerField(blank=True, null=True)),
+            ],
+        ),
+    ]
@@ -1,3 +1,13 @@
 from django.db import models
 
-# Create your models here.
+
+class UserAuthState(models.Model):
+    """
+    When a user last changed, as CachedJWTAuthentication sees it (see
+    authentication). Kept in the database rather than the cache so a marker is
+    never culled or cleared before the tokens it revokes expire.
+    """
+    # Not a foreign key: the row outlives a deleted user's remaining tokens
+    user_id = models.CharField(max_length=64, primary_key=True)   # as in tokens, a string
+    changed = models.BigIntegerField(default=0)   # time.time_ns() of the latest change
+    revoked = models.BigIntegerField(null=True, blank=True)   # tokens issued before this (epoch seconds) are rejected
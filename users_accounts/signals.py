@@ -0,0 +1,37 @@
+from django.contrib.auth.models import User
+from django.db.models.signals import post_delete, post_init, post_save
+from django.dispatch import receiver
+from rest_framework_simplejwt.token_blacklist.models import BlacklistedToken
+
+from . import authentication, blacklist
+
+
+def _credentials(user):
+    # Straight from __dict__ so deferred fields aren't loaded just to be remembered
+    return user.__dict__.get("password"), user.__dict__.get("is_active")
+
+
+@receiver(post_init, sender=User)
+def remember_credentials(sender, instance, **kwargs):
+    instance._loaded_credentials = _credentials(instance)
+
+
+@receiver(post_save, sender=User)
+def user_saved(sender, instance, created, update_fields=None, **kwargs):
+    if created or (update_fields is not None and set(update_fields) <= {"last_login"}):
+        return
+    credentials = _credentials(instance)
+    revoke = credentials != getattr(instance, "_loaded_credentials", credentials)
+    instance._loaded_credentials = credentials
+    authentication.user_changed(instance.pk, revoke=revoke)
+
+
+@receiver(post_delete, sender=User)
+def user_deleted(sender, instance, **kwargs):
+    authentication.user_changed(instance.pk, revoke=True)
+
+
+@receiver(post_save, sender=BlacklistedToken)
+def token_blacklisted(sender, instance, created, **kwargs):
+    if created:
+        blacklist.blacklisted(instance.token.jti)
@@ -1,3 +1,186 @@
-from django.test import TestCase
+import tempfile
+import time
+from datetime import timedelta
 
-# Create your tests here.
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.token_blacklist.models import BlacklistedToken, OutstandingToken
+from rest_framework_simplejwt.tokens import AccessToken, RefreshToken
+
+from . import authentication, blacklist
+from .models import UserAuthState
+
+
+class CachedJWTAuthenticationTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        authentication.clear()
+        self.user = User.objects.create_user("alice", email="alice@example.com", password="pw-123456")
+
+    def login(self):
+        response = APIClient().post(reverse("token_obtain_pair"), {"username": "alice", "password": "pw-123456"})
+        self.assertEqual(response.status_code, 200)
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION="Bearer " + response.data["access"])
+        return client, response.data
+
+    def wait_a_second(self):
+        # Tokens carry their issue time in whole seconds
+        time.sleep(1.05)
+
+    def test_cached_user_needs_no_queries(self):
+        client, _ = self.login()
+        # The user and its change marker on first use
+        with self.assertNumQueries(2):
+            self.assertEqual(client.get(reverse("profile")).data["email"], "alice@example.com")
+        with self.assertNumQueries(0):
+            for _ in range(3):
+                self.assertEqual(client.get(reverse("profile")).status_code, 200)
+
+    def test_profile_change_reloads_user(self):
+        client, _ = self.login()
+        client.get(reverse("profile"))
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.email = "new@example.com"
+            self.user.save()
+        self.assertEqual(client.get(reverse("profile")).data["email"], "new@example.com")
+
+    def test_password_change_revokes_tokens(self):
+        client, _ = self.login()
+        client.get(reverse("profile"))
+        self.wait_a_second()
+        with self.captureOnCommitCallbacks(execute=True):
+            user = User.objects.get(pk=self.user.pk)
+            user.set_password("new-pw-9876")
+            user.save()
+        self.assertEqual(client.get(reverse("profile")).status_code, 401)
+
+    def test_revocation_survives_cache_clear(self):
+        client, _ = self.login()
+        self.wait_a_second()
+        user = User.objects.get(pk=self.user.pk)
+        user.set_password("new-pw-9876")
+        user.save()
+        # Another process, with nothing cached and the shared cache emptied
+        cache.clear()
+        authentication.clear()
+        self.assertEqual(client.get(reverse("profile")).status_code, 401)
+
+    @override_settings(JWT_USER_CACHE_SYNC=0)
+    def test_other_process_change_is_picked_up(self):
+        client, _ = self.login()
+        client.get(reverse("profile"))
+        User.objects.filter(pk=self.user.pk).update(email="bulk@example.com")
+        self.assertEqual(client.get(reverse("profile")).data["email"], "alice@example.com")
+        authentication.user_changed(self.user.pk)
+        self.assertEqual(client.get(reverse("profile")).data["email"], "bulk@example.com")
+
+    @override_settings(JWT_AUTH_STATELESS=True)
+    def test_stateless_user_from_claims(self):
+        client, _ = self.login()
+        client.get(reverse("profile"))
+        with self.assertNumQueries(0):
+            response = client.get(reverse("profile"))
+        self.assertEqual(response.data, {"id": self.user.pk, "username": "alice", "email": "alice@example.com"})
+
+    def test_deleted_user_keeps_revocation(self):
+        token = AccessToken.for_user(self.user)
+        self.wait_a_second()
+        user_id = self.user.pk
+        self.user.delete()
+        self.assertIsNotNone(UserAuthState.objects.get(user_id=str(user_id)).revoked)
+        with override_settings(JWT_AUTH_STATELESS=True):
+            client = APIClient()
+            client.credentials(HTTP_AUTHORIZATION=f"Bearer {token}")
+            self.assertEqual(client.get(reverse("profile")).status_code, 401)
+
+    def test_refresh_keeps_claims(self):
+        _, tokens = self.login()
+        response = APIClient().post(reverse("token_refresh"), {"refresh": tokens["refresh"]})
+        self.assertEqual(AccessToken(response.data["access"])["username"], "alice")
+
+
+class BlacklistTests(TestCase):
+    def setUp(self):
+        # The filter needs a cache that worker processes share
+        location = tempfile.TemporaryDirectory()
+        self.addCleanup(location.cleanup)
+        shared = override_settings(CACHES={"default": {
+            "BACKEND": "django.core.cache.backends.filebased.FileBasedCache", "LOCATION": location.name,
+        }})
+        shared.enable()
+        self.addCleanup(shared.disable)
+        cache.clear()
+        blacklist.reset()
+        self.user = User.objects.create_user("bob", password="pw-123456")
+
+    def refresh(self, token):
+        return APIClient().post(reverse("token_refresh"), {"refresh": str(token)})
+
+    def test_unlisted_token_needs_no_blacklist_query(self):
+        token = RefreshToken.for_user(self.user)
+        self.refresh(token)
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(self.refresh(token).status_code, 200)
+        self.assertFalse([query for query in queries.captured_queries if "blacklistedtoken" in query["sql"]])
+
+    def test_logged_out_token_is_rejected(self):
+        token = RefreshToken.for_user(self.user)
+        self.refresh(token)
+        client = APIClient()
+        client.force_authenticate(self.user)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(client.post(reverse("logout"), {"refresh": str(token)}).status_code, 205)
+        self.assertEqual(self.refresh(token).status_code, 401)
+
+    def test_other_process_blacklisting_is_picked_up(self):
+        token = RefreshToken.for_user(self.user)
+        self.refresh(token)
+        outstanding = OutstandingToken.objects.get(jti=token["jti"])
+        BlacklistedToken.objects.bulk_create([BlacklistedToken(token=outstanding)])
+        self.assertFalse(blacklist.might_be_blacklisted(token["jti"]))
+        cache.set(blacklist.MARKER_KEY, 123)
+        self.assertTrue(blacklist.might_be_blacklisted(token["jti"]))
+
+    def test_cleared_marker_is_recreated_before_syncing(self):
+        token = RefreshToken.for_user(self.user)
+        self.refresh(token)
+        outstanding = OutstandingToken.objects.get(jti=token["jti"])
+        BlacklistedToken.objects.bulk_create([BlacklistedToken(token=outstanding)])
+        cache.clear()
+        self.assertTrue(blacklist.might_be_blacklisted(token["jti"]))
+        self.assertIsNotNone(cache.get(blacklist.MARKER_KEY))
+
+    def test_process_local_cache_asks_the_database(self):
+        token = RefreshToken.for_user(self.user)
+        with override_settings(CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}}):
+            self.refresh(token)
+            with CaptureQueriesContext(connection) as queries:
+                self.assertEqual(self.refresh(token).status_code, 200)
+        self.assertTrue([query for query in queries.captured_queries if "blacklistedtoken" in query["sql"]])
+
+    def test_bloom_filter(self):
+        bloom = blacklist.BloomFilter(10000, 0.001)
+        for i in range(10000):
+            bloom.add(f"k{i}")
+        self.assertTrue(all(f"k{i}" in bloom for i in range(10000)))
+        self.assertLess(sum(f"x{i}" in bloom for i in range(100000)), 300)
+
+    def test_purge_expired(self):
+        now = timezone.now()
+        OutstandingToken.objects.bulk_create([
+            OutstandingToken(jti=f"j{i}", token="t", expires_at=now + timedelta(days=-1 if i % 2 else 1))
+            for i in range(25)
+        ])
+        BlacklistedToken.objects.bulk_create([
+            BlacklistedToken(token=token) for token in OutstandingToken.objects.filter(jti__in=["j1", "j2", "j3"])
+        ])
+        self.assertEqual(blacklist.purge_expired(batch_size=4), (12, 2))
+        self.assertEqual(OutstandingToken.objects.count(), 13)
+        self.assertEqual(BlacklistedToken.objects.count(), 1)
@@ -1,11 +1,12 @@
 from rest_framework import generics
 from django.contrib.auth.models import User
 from .serializers import RegisterSerializer, UserSerializer
+from .blacklist import FilteredRefreshToken
 from rest_framework.permissions import AllowAny, IsAuthenticated
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework import status
-from rest_framework_simplejwt.tokens import RefreshToken
+from rest_framework_simplejwt.views import TokenObtainPairView, TokenRefreshView
 
 
 # Signup View
@@ -25,13 +26,23 @@ class ProfileView(generics.RetrieveAPIView):
         return self.request.user
 
 
+# Login View: tokens also carry the username and email (for JWT_AUTH_STATELESS)
+class ClaimsTokenObtainPairView(TokenObtainPairView):
+    _serializer_class = "users_accounts.serializers.ClaimsTokenObtainPairSerializer"
+
+
+# Refresh View: blacklist lookups go through the in-memory filter first
+class FilteredTokenRefreshView(TokenRefreshView):
+    _serializer_class = "users_accounts.serializers.FilteredTokenRefreshSerializer"
+
+
 class LogoutView(APIView):
     permission_classes = [IsAuthenticated]
 
     def post(self, request):
         try:
             refresh_token = request.data["refresh"]
-            token = RefreshToken(refresh_token)
+            token = FilteredRefreshToken(refresh_token)
             token.blacklist()  # mark refresh token as invalid
             return Response({"message": "Logged out successfully"}, status=status.HTTP_205_RESET_CONTENT)
         except Exception as e: